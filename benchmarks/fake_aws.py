@@ -0,0 +1,511 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# In-memory stand-ins for the AWS APIs the RLSecLake lambda uses, so it can be
+# benchmarked without network access or an AWS account. They take the same keyword
+# arguments and return the same shapes as boto3, page like the real APIs, and count
+# every call per service and operation. Athena is reached through awswrangler, so a
+# stand-in awswrangler module applies the lambda's statements to the fake Glue tables.
+
+import collections
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+from botocore.exceptions import ClientError
+
+
+class CallCounter:
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, service, operation):
+        with self.lock:
+            self.counts[service+'.'+operation] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return collections.Counter(self.counts)
+
+
+def operation_name(method_name):
+    return ''.join(part.capitalize() for part in method_name.split('_'))
+
+
+def client_error(code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+def etag(body):
+    return '"'+hashlib.md5(body).hexdigest()+'"'
+
+
+def page(items, next_token, page_size):
+    # returns (items on the page, token for the next page or None)
+    start = int(next_token or 0)
+    end = start + page_size
+    return items[start:end], (str(end) if end < len(items) else None)
+
+
+def with_token(response, token):
+    if token:
+        response['NextToken'] = token
+    return response
+
+
+class FakeClient:
+    service = ''
+
+    def __init__(self, counter, latency=0.0):
+        self.counter = counter
+        self.latency = latency
+
+    def record(self, method_name):
+        self.counter.add(self.service, operation_name(method_name))
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeOrganizations(FakeClient):
+    service = 'organizations'
+
+    # the page sizes Organizations uses when MaxResults isn't given
+    PAGE_SIZE = 20
+
+    def __init__(self, org, counter, latency=0.0):
+        super().__init__(counter, latency)
+        self.org = org
+        self.children = collections.defaultdict(list)
+        for ou_id, ou in org['ous'].items():
+            self.children[ou['parent_id']].append(ou_id)
+        self.accounts = collections.defaultdict(list)
+        for account_id, account in org['accounts'].items():
+            self.accounts[account['parent_id']].append(account_id)
+
+    def account(self, account_id):
+        return {'Id': account_id, 'Name': self.org['accounts'][account_id]['name'], 'Status': 'ACTIVE'}
+
+    def move_account(self, account_id, parent_id):
+        # changes the org behind the lambda's back, like an account moved in the console
+        self.accounts[self.org['accounts'][account_id]['parent_id']].remove(account_id)
+        self.accounts[parent_id].append(account_id)
+        self.org['accounts'][account_id]['parent_id'] = parent_id
+
+    def describe_organization(self):
+        self.record('describe_organization')
+        return {'Organization': {'Id': self.org['org_id']}}
+
+    def list_roots(self, **kwargs):
+        self.record('list_roots')
+        return {'Roots': [{'Id': self.org['root_id'], 'Name': 'Root'}]}
+
+    def check_parent(self, parent_id, operation):
+        if parent_id != self.org['root_id'] and parent_id not in self.org['ous']:
+            raise client_error('ParentNotFoundException', operation)
+
+    def describe_organizational_unit(self, OrganizationalUnitId, **kwargs):
+        self.record('describe_organizational_unit')
+        if OrganizationalUnitId not in self.org['ous']:
+            raise client_error('OrganizationalUnitNotFoundException', 'DescribeOrganizationalUnit')
+        return {'OrganizationalUnit': {'Id': OrganizationalUnitId, 'Name': self.org['ous'][OrganizationalUnitId]['name']}}
+
+    def list_organizational_units_for_parent(self, ParentId, NextToken=None, **kwargs):
+        self.record('list_organizational_units_for_parent')
+        self.check_parent(ParentId, 'ListOrganizationalUnitsForParent')
+        items, token = page(self.children[ParentId], NextToken, self.PAGE_SIZE)
+        return with_token({'OrganizationalUnits': [{'Id': ou_id, 'Name': self.org['ous'][ou_id]['name']} for ou_id in items]}, token)
+
+    def list_accounts_for_parent(self, ParentId, NextToken=None, **kwargs):
+        self.record('list_accounts_for_parent')
+        self.check_parent(ParentId, 'ListAccountsForParent')
+        items, token = page(self.accounts[ParentId], NextToken, self.PAGE_SIZE)
+        return with_token({'Accounts': [self.account(account_id) for account_id in items]}, token)
+
+    def list_parents(self, ChildId, **kwargs):
+        self.record('list_parents')
+        parent_id = self.org['accounts'][ChildId]['parent_id']
+        return {'Parents': [{'Id': parent_id, 'Type': 'ROOT' if parent_id == self.org['root_id'] else 'ORGANIZATIONAL_UNIT'}]}
+
+    def list_tags_for_resource(self, ResourceId, NextToken=None, **kwargs):
+        self.record('list_tags_for_resource')
+        tags = sorted(self.org['accounts'].get(ResourceId, {}).get('tags', {}).items())
+        items, token = page(tags, NextToken, self.PAGE_SIZE)
+        return with_token({'Tags': [{'Key': key, 'Value': value} for key, value in items]}, token)
+
+
+class FakeLakeFormation(FakeClient):
+    service = 'lakeformation'
+
+    PAGE_SIZE = 100
+    BATCH_LIMIT = 20
+
+    def __init__(self, counter, latency=0.0):
+        super().__init__(counter, latency)
+        self.filters = {}
+        self.permissions = set()
+        self.lock = threading.Lock()
+
+    def list_data_cells_filter(self, Table, NextToken=None, **kwargs):
+        self.record('list_data_cells_filter')
+        with self.lock:
+            names = sorted(name for database, table, name in self.filters if database == Table['DatabaseName'] and table == Table['Name'])
+            items, token = page(names, NextToken, self.PAGE_SIZE)
+            filters = [{
+                'TableCatalogId': Table.get('CatalogId'),
+                'DatabaseName': Table['DatabaseName'],
+                'TableName': Table['Name'],
+                'Name': name,
+                'RowFilter': {'FilterExpression': self.filters[(Table['DatabaseName'], Table['Name'], name)]},
+                'ColumnWildcard': {},
+            } for name in items]
+
+        return with_token({'DataCellsFilters': filters}, token)
+
+    def create_data_cells_filter(self, TableData):
+        self.record('create_data_cells_filter')
+        key = (TableData['DatabaseName'], TableData['TableName'], TableData['Name'])
+        with self.lock:
+            if key in self.filters:
+                raise client_error('AlreadyExistsException', 'CreateDataCellsFilter')
+            self.filters[key] = TableData['RowFilter']['FilterExpression']
+        return {}
+
+    def update_data_cells_filter(self, TableData):
+        self.record('update_data_cells_filter')
+        key = (TableData['DatabaseName'], TableData['TableName'], TableData['Name'])
+        with self.lock:
+            if key not in self.filters:
+                raise client_error('EntityNotFoundException', 'UpdateDataCellsFilter')
+            self.filters[key] = TableData['RowFilter']['FilterExpression']
+        return {}
+
+    def delete_data_cells_filter(self, DatabaseName, TableName, Name, **kwargs):
+        self.record('delete_data_cells_filter')
+        with self.lock:
+            if self.filters.pop((DatabaseName, TableName, Name), None) is None:
+                raise client_error('EntityNotFoundException', 'DeleteDataCellsFilter')
+            self.permissions = set(p for p in self.permissions if p[:3] != (DatabaseName, TableName, Name))
+        return {}
+
+    def list_permissions(self, Resource, NextToken=None, **kwargs):
+        self.record('list_permissions')
+        table = Resource['Table']
+        with self.lock:
+            items = sorted(p for p in self.permissions if p[0] == table['DatabaseName'] and p[1] == table['Name'])
+        items, token = page(items, NextToken, self.PAGE_SIZE)
+        return with_token({'PrincipalResourcePermissions': [{
+            'Principal': {'DataLakePrincipalIdentifier': principal},
+            'Resource': {'DataCellsFilter': {'DatabaseName': database, 'TableName': table_name, 'Name': name}},
+            'Permissions': ['SELECT'],
+            'PermissionsWithGrantOption': ['SELECT'],
+        } for database, table_name, name, principal in items]}, token)
+
+    def batch_permissions(self, method_name, Entries, grant):
+        self.record(method_name)
+        if len(Entries) > self.BATCH_LIMIT:
+            raise client_error('InvalidInputException', operation_name(method_name))
+
+        failures = []
+        with self.lock:
+            for entry in Entries:
+                data_cells_filter = entry['Resource']['DataCellsFilter']
+                key = (data_cells_filter['DatabaseName'], data_cells_filter['TableName'], data_cells_filter['Name'])
+                if key not in self.filters:
+                    failures.append({'RequestEntry': entry, 'Error': {'ErrorCode': 'EntityNotFoundException'}})
+                elif grant:
+                    self.permissions.add(key + (entry['Principal']['DataLakePrincipalIdentifier'],))
+                else:
+                    self.permissions.discard(key + (entry['Principal']['DataLakePrincipalIdentifier'],))
+
+        return {'Failures': failures}
+
+    def batch_grant_permissions(self, CatalogId, Entries):
+        return self.batch_permissions('batch_grant_permissions', Entries, True)
+
+    def batch_revoke_permissions(self, CatalogId, Entries):
+        return self.batch_permissions('batch_revoke_permissions', Entries, False)
+
+
+class FakeGlue(FakeClient):
+    service = 'glue'
+
+    PAGE_SIZE = 100
+
+    def __init__(self, counter, latency=0.0):
+        super().__init__(counter, latency)
+        self.tables = {}
+
+    def get_table(self, DatabaseName, Name, **kwargs):
+        self.record('get_table')
+        table = self.tables.get((DatabaseName, Name))
+        if table is None:
+            raise client_error('EntityNotFoundException', 'GetTable')
+
+        return {'Table': {
+            'Name': Name,
+            'DatabaseName': DatabaseName,
+            'Parameters': dict(table['parameters']),
+            'StorageDescriptor': {'Columns': [{'Name': column, 'Type': 'string'} for column in table['columns']]},
+            'PartitionKeys': [{'Name': column, 'Type': 'string'} for column in table.get('partition_keys', [])],
+        }}
+
+    def get_tables(self, DatabaseName, NextToken=None, **kwargs):
+        self.record('get_tables')
+        names = sorted(name for database, name in self.tables if database == DatabaseName)
+        start = int(NextToken or 0)
+
+        response = {'TableList': [{'Name': name, 'DatabaseName': DatabaseName} for name in names[start:start+self.PAGE_SIZE]]}
+        if start+self.PAGE_SIZE < len(names):
+            response['NextToken'] = str(start+self.PAGE_SIZE)
+        return response
+
+
+class FakeS3(FakeClient):
+    service = 's3'
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, counter, latency=0.0):
+        super().__init__(counter, latency)
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self.record('get_object')
+        with self.lock:
+            if (Bucket, Key) not in self.objects:
+                raise client_error('NoSuchKey', 'GetObject')
+            body = self.objects[(Bucket, Key)]
+
+        if IfNoneMatch is not None and IfNoneMatch == etag(body):
+            raise client_error('304', 'GetObject')
+
+        return {'Body': types.SimpleNamespace(read=lambda: body), 'ContentLength': len(body), 'ETag': etag(body)}
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        self.record('put_object')
+        body = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        with self.lock:
+            self.objects[(Bucket, Key)] = body
+        return {'ETag': etag(body)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.record('delete_object')
+        with self.lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.record('delete_objects')
+        with self.lock:
+            for item in Delete['Objects']:
+                self.objects.pop((Bucket, item['Key']), None)
+        return {'Deleted': [{'Key': item['Key']} for item in Delete['Objects']]}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, **kwargs):
+        self.record('list_objects_v2')
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix) and key > (ContinuationToken or ''))
+            sizes = dict((key, len(self.objects[(Bucket, key)])) for key in keys)
+
+        # like S3 the token carries on after the last key listed, so objects can be
+        # deleted between pages without others being skipped
+        items = keys[:self.PAGE_SIZE]
+        token = items[-1] if len(keys) > self.PAGE_SIZE else None
+
+        response = {'KeyCount': len(items), 'IsTruncated': token is not None}
+        if items:
+            response['Contents'] = [{'Key': key, 'Size': sizes[key]} for key in items]
+        if token:
+            response['NextContinuationToken'] = token
+        return response
+
+    def put(self, bucket, key, body):
+        # used by the fake awswrangler, which writes to S3 without going through the client
+        with self.lock:
+            self.objects[(bucket, key)] = body
+
+
+class FakeLambda(FakeClient):
+    service = 'lambda'
+
+    def __init__(self, counter, latency=0.0):
+        super().__init__(counter, latency)
+        self.invocations = []
+
+    def invoke(self, **kwargs):
+        self.record('invoke')
+        self.invocations.append(kwargs)
+        return {'StatusCode': 202}
+
+
+class FakeSession:
+    # boto3.Session stand-in handing out the shared fake clients
+
+    def __init__(self, clients, region_name):
+        self.clients = clients
+        self.region_name = region_name
+
+    def client(self, name, **kwargs):
+        return self.clients[name]
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def fake_awswrangler(glue, s3, counter, latency=0.0):
+    # a module with the parts of awswrangler.athena the lambda uses, applied to the
+    # rows kept in the fake Glue tables. statements are matched, not parsed, so
+    # only the statements the lambda actually sends are understood
+    import pandas as pd
+
+    def record(operation):
+        counter.add('athena', operation)
+        if latency:
+            time.sleep(latency)
+
+    def table(database, name):
+        return glue.tables.get((database, name))
+
+    def to_iceberg(df, database, table, table_location=None, temp_path=None, merge_cols=None, schema_evolution=False, **kwargs):
+        record('ToIceberg')
+        rows = df.to_dict('records')
+        existing = glue.tables.get((database, table))
+        if existing is None:
+            existing = {'columns': [], 'rows': [], 'parameters': {'table_type': 'ICEBERG'}, 'location': table_location, 'version': 0}
+            glue.tables[(database, table)] = existing
+
+        for column in df.columns:
+            if column not in existing['columns']:
+                if existing['rows'] and not schema_evolution:
+                    raise Exception('Column '+column+' not in table '+table)
+                existing['columns'].append(column)
+
+        if merge_cols:
+            keys = dict((tuple(row[c] for c in merge_cols), index) for index, row in enumerate(existing['rows']))
+            for row in rows:
+                key = tuple(row[c] for c in merge_cols)
+                if key in keys:
+                    existing['rows'][keys[key]] = dict(existing['rows'][keys[key]], **row)
+                else:
+                    existing['rows'].append(row)
+        else:
+            existing['rows'] += rows
+
+        # each commit leaves a data file and a metadata file behind, like Iceberg does
+        existing['version'] += 1
+        bucket, prefix = split_s3_uri(table_location or 's3://benchmark/'+table+'/')
+        s3.put(bucket, prefix+'data/'+str(existing['version']).zfill(5)+'.parquet', b'x' * (64 * len(rows)))
+        s3.put(bucket, prefix+'metadata/'+str(existing['version']).zfill(5)+'.metadata.json', b'{}')
+
+    def run_statement(sql, database):
+        match = re.match(r'\s*SELECT \* FROM "([^"]+)"', sql)
+        if match:
+            existing = table(database, match.group(1))
+            return pd.DataFrame(existing['rows'] if existing else [], columns=existing['columns'] if existing else None)
+
+        match = re.match(r'\s*DROP TABLE `([^`]+)`', sql)
+        if match:
+            glue.tables.pop((database, match.group(1)), None)
+            return pd.DataFrame()
+
+        match = re.match(r'\s*DELETE FROM "([^"]+)" WHERE "([^"]+)" (NOT IN|IN) \((.*)\)\s*$', sql, re.S)
+        if match:
+            existing = table(database, match.group(1))
+            column, condition = match.group(2), match.group(3)
+            keys = set(value.replace("''", "'") for value in re.findall(r"'((?:[^']|'')*)'", match.group(4)))
+            if existing:
+                existing['rows'] = [row for row in existing['rows'] if (str(row.get(column)) in keys) == (condition == 'NOT IN')]
+            return pd.DataFrame()
+
+        match = re.match(r"\s*ALTER TABLE (\w+) SET TBLPROPERTIES \('([^']+)'='([^']*)'\)", sql)
+        if match:
+            table(database, match.group(1))['parameters'][match.group(2)] = match.group(3)
+            return pd.DataFrame()
+
+        # OPTIMIZE writes every row to one new data file, VACUUM then removes the
+        # files the current version doesn't use. the snapshot retention is ignored
+        match = re.match(r'\s*OPTIMIZE (\w+) REWRITE DATA USING BIN_PACK', sql)
+        if match:
+            existing = table(database, match.group(1))
+            existing['version'] += 1
+            bucket, prefix = split_s3_uri(existing['location'])
+            existing['live_data'] = prefix+'data/'+str(existing['version']).zfill(5)+'.parquet'
+            s3.put(bucket, existing['live_data'], b'x' * (64 * len(existing['rows'])))
+            s3.put(bucket, prefix+'metadata/'+str(existing['version']).zfill(5)+'.metadata.json', b'{}')
+            return pd.DataFrame()
+
+        match = re.match(r'\s*VACUUM (\w+)', sql)
+        if match:
+            existing = table(database, match.group(1))
+            bucket, prefix = split_s3_uri(existing['location'])
+            keep = set([prefix+'metadata/'+str(existing['version']).zfill(5)+'.metadata.json'])
+            if existing.get('live_data'):
+                keep.add(existing['live_data'])
+            with s3.lock:
+                for key in [key for b, key in s3.objects if b == bucket and key.startswith(prefix) and key not in keep]:
+                    if existing.get('live_data') or '/metadata/' in key:
+                        del s3.objects[(bucket, key)]
+            return pd.DataFrame()
+
+        raise Exception('Statement not understood by the fake Athena: '+sql[:80])
+
+    def read_sql_query(sql, database, **kwargs):
+        record('ReadSqlQuery')
+        return run_statement(sql, database)
+
+    def start_query_execution(sql, database, wait=False, **kwargs):
+        record('StartQueryExecution')
+        run_statement(sql, database)
+        return {'Status': {'State': 'SUCCEEDED'}} if wait else 'query-id'
+
+    module = types.ModuleType('awswrangler')
+    module.athena = types.SimpleNamespace(
+        to_iceberg=to_iceberg,
+        read_sql_query=read_sql_query,
+        start_query_execution=start_query_execution,
+    )
+    return module
+
+
+def install(org, latency=0.0, regions=None):
+    # points boto3 and awswrangler at the fakes for the rest of the process and
+    # returns (counter, clients). must run before the lambda is imported. regions
+    # other than the default get Lake Formation and Glue of their own, in
+    # clients['regions']
+    import boto3
+
+    counter = CallCounter()
+    s3 = FakeS3(counter, latency)
+    glue = FakeGlue(counter, latency)
+    clients = {
+        'organizations': FakeOrganizations(org, counter, latency),
+        'lakeformation': FakeLakeFormation(counter, latency),
+        'glue': glue,
+        's3': s3,
+        'lambda': FakeLambda(counter, latency),
+        'athena': FakeClient(counter, latency),
+    }
+
+    home_region = os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')
+    clients['regions'] = dict(
+        (region, {'lakeformation': FakeLakeFormation(counter, latency), 'glue': FakeGlue(counter, latency)})
+        for region in regions or [] if region != home_region
+    )
+
+    def client(name, region_name=None, **kwargs):
+        return clients['regions'].get(region_name, clients)[name]
+
+    boto3.client = client
+    boto3.Session = lambda *args, **kwargs: FakeSession(clients, home_region)
+    sys.modules['awswrangler'] = fake_awswrangler(glue, s3, counter, latency)
+
+    return counter, clients
@@ -0,0 +1,267 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Runs the RLSecLake lambda end to end against a synthetic organization and the
+# in-memory AWS stand-ins in fake_aws.py, with no network access. Reports wall time,
+# API calls per service and operation, and peak Python memory for each phase as JSON.
+# Pass the report of an earlier version with --baseline to flag regressions.
+#
+#   python benchmarks/org_benchmark.py --depth 3 --fanout 6 --accounts-per-ou 40 --tags team=20,env=4
+#   python benchmarks/org_benchmark.py --output before.json
+#   python benchmarks/org_benchmark.py --baseline before.json
+#
+# needs boto3 and pandas installed locally, awswrangler is replaced by a stand-in
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import fake_aws
+import synthetic_org
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'rl_sec_lake')
+
+# the lambda reads its configuration from the environment at import time
+LAMBDA_ENVIRONMENT = {
+    'metadata_database': 'aws_account_metadata_db',
+    'metadata_bucket': 'benchmark-bucket',
+    'account_id': '111111111111',
+    'security_lake_db': 'amazon_security_lake_glue_db_us_east_1',
+    'security_lake_table': 'amazon_security_lake_table_us_east_1_*',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+}
+
+
+class PhaseRecorder:
+
+    def __init__(self, counter, trace_memory):
+        self.counter = counter
+        self.trace_memory = trace_memory
+        self.phases = {}
+
+    def run(self, name, function, *args):
+        calls_before = self.counter.snapshot()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+
+        calls = self.counter.snapshot()
+        calls.subtract(calls_before)
+
+        phase = {
+            'seconds': round(elapsed, 4),
+            'api_calls': dict(sorted((operation, count) for operation, count in calls.items() if count)),
+            'total_api_calls': sum(calls.values()),
+        }
+        if self.trace_memory:
+            phase['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1] - memory_before
+
+        self.phases[name] = phase
+        return result
+
+
+# a table per Security Lake source, all shared by the security_lake_table pattern
+SECURITY_LAKE_SOURCES = ['sh_findings_1_0', 'cloud_trail_mgmt_2_0', 'vpc_flow_2_0', 'route53_2_0']
+
+
+def add_security_lake_tables(clients, regions):
+    # the lambda reads the Security Lake tables' schemas to find their account column.
+    # every region has a database of its own, in its own Glue catalog
+    for region in regions:
+        suffix = region.replace('-', '_')
+        glue = clients['regions'].get(region, clients)['glue']
+        for source in SECURITY_LAKE_SOURCES:
+            glue.tables[('amazon_security_lake_glue_db_'+suffix, 'amazon_security_lake_table_'+suffix+'_'+source)] = {
+                'columns': ['metadata', 'time', 'cloud', 'severity'],
+                'rows': [],
+                'parameters': {},
+                'partition_keys': ['region', 'accountid', 'eventday'],
+            }
+
+
+def share_groups(clients, database, fraction, consumers, seed):
+    # maps a share of the OU and tag groups to consumer accounts, the way an
+    # operator would with UPDATE statements in Athena
+    rng = random.Random(seed)
+    for table_name in ('ou_groups', 'tags_groups'):
+        table = clients['glue'].tables.get((database, table_name))
+        if table is None:
+            continue
+
+        for row in table['rows']:
+            if rng.random() < fraction:
+                row['consumer_aws_account_id'] = ','.join(rng.sample(consumers, 1 + rng.randrange(len(consumers))))
+
+
+def move_account_event(org, seed):
+    rng = random.Random(seed)
+    account_id = rng.choice(sorted(org['accounts']))
+    destination = rng.choice(sorted(org['ous']))
+    return {
+        'source': 'aws.organizations',
+        'detail-type': 'AWS API Call via CloudTrail',
+        'detail': {
+            'eventName': 'MoveAccount',
+            'requestParameters': {
+                'accountId': account_id,
+                'sourceParentId': org['accounts'][account_id]['parent_id'],
+                'destinationParentId': destination,
+            },
+        },
+    }
+
+
+def scoped_resync_event(org, clients, seed):
+    # an account is moved into one OU without an event, and that OU is resynced
+    rng = random.Random(seed)
+    ou_id = rng.choice(sorted(org['ous']))
+    account_id = rng.choice(sorted(account_id for account_id, account in org['accounts'].items() if account['parent_id'] != ou_id))
+    clients['organizations'].move_account(account_id, ou_id)
+
+    return {'scope': {'ou_ids': [ou_id]}}
+
+
+def compare(report, baseline, tolerance):
+    # a phase regresses when it got slower than the tolerance allows, or made more API calls
+    regressions = []
+    for name, phase in report['phases'].items():
+        before = baseline.get('phases', {}).get(name)
+        if before is None:
+            continue
+
+        if phase['seconds'] > before['seconds'] * (1 + tolerance) and phase['seconds'] - before['seconds'] > 0.05:
+            regressions.append(name+': '+str(before['seconds'])+'s -> '+str(phase['seconds'])+'s')
+        if phase['total_api_calls'] > before['total_api_calls']:
+            regressions.append(name+': '+str(before['total_api_calls'])+' -> '+str(phase['total_api_calls'])+' API calls')
+        if 'peak_memory_bytes' in phase and 'peak_memory_bytes' in before and phase['peak_memory_bytes'] > before['peak_memory_bytes'] * (1 + tolerance):
+            regressions.append(name+': '+str(before['peak_memory_bytes'])+' -> '+str(phase['peak_memory_bytes'])+' bytes peak memory')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end to end benchmark of the RLSecLake lambda')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--accounts-per-ou', type=int, default=10)
+    parser.add_argument('--tags', default='team=10,env=3', help='tag keys and their number of distinct values, eg team=10,env=3')
+    parser.add_argument('--tag-coverage', type=float, default=0.8, help='share of accounts that have each tag key')
+    parser.add_argument('--shared-fraction', type=float, default=0.5, help='share of groups mapped to consumer accounts')
+    parser.add_argument('--consumers', type=int, default=3, help='number of distinct consumer accounts')
+    parser.add_argument('--regions', default='us-east-1,us-west-2', help='Security Lake regions to share, the first is the one the lambda runs in')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added to every fake API call')
+    parser.add_argument('--org-api-rate', type=float, default=1000000.0, help='Organizations calls per second, the lambda defaults to 8')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, which slows everything down')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--output', help='write the report here as well as to stdout')
+    parser.add_argument('--verbose', action='store_true', help='show the lambda log')
+    args = parser.parse_args()
+
+    tags = synthetic_org.parse_tag_spec(args.tags)
+    org = synthetic_org.generate_org(args.depth, args.fanout, args.accounts_per_ou, tags, args.tag_coverage, args.seed)
+
+    os.environ.update(LAMBDA_ENVIRONMENT)
+    os.environ['org_api_rate'] = str(args.org_api_rate)
+    regions = [region.strip() for region in args.regions.split(',') if region.strip()]
+    os.environ['AWS_DEFAULT_REGION'] = regions[0]
+    os.environ['security_lake_db'] = 'amazon_security_lake_glue_db_'+regions[0].replace('-', '_')
+    os.environ['security_lake_table'] = 'amazon_security_lake_table_'+regions[0].replace('-', '_')+'_*'
+    os.environ['security_lake_regions'] = ','.join(regions)
+    sys.path.insert(0, LAMBDA_DIR)
+
+    counter, clients = fake_aws.install(org, args.latency_ms / 1000.0, regions)
+    add_security_lake_tables(clients, regions)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR, format='%(asctime)s %(message)s')
+
+    if not args.no_memory:
+        tracemalloc.start()
+
+    recorder = PhaseRecorder(counter, not args.no_memory)
+
+    # importing the lambda creates its clients, so it's measured like a cold start
+    lambda_function = recorder.run('import', __import__, 'lambda_function')
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    # the lambda's metrics records go to stdout and would mix with the report
+    import metrics
+    metrics.metrics_logger.setLevel(logging.INFO if args.verbose else logging.ERROR)
+
+    import org_metadata
+
+    recorder.run('org_walk', org_metadata.get_org_snapshot)
+
+    # first run against an empty account: tables are created, nothing is shared yet
+    recorder.run('first_run', lambda_function.lambda_handler, {}, None)
+
+    consumers = [str(222222222222 + index) for index in range(args.consumers)]
+    share_groups(clients, LAMBDA_ENVIRONMENT['metadata_database'], args.shared_fraction, consumers, args.seed)
+
+    # data cells filters and grants are created for the shared groups
+    recorder.run('share_run', lambda_function.lambda_handler, {}, None)
+
+    # nothing has changed, this is the common case for the hourly run and is
+    # skipped once the org has been walked. account tags come from the stored snapshot
+    recorder.run('steady_run', lambda_function.lambda_handler, {}, None)
+
+    # nothing has changed either, but the fingerprint check and the tag cache are bypassed
+    recorder.run('forced_run', lambda_function.lambda_handler, {'force_refresh': True}, None)
+
+    # the stored org snapshot, as read by a cold start and then by a warm one
+    org_metadata.snapshot_cache.clear()
+    recorder.run('snapshot_load_cold', org_metadata.load_org_snapshot, clients['s3'], LAMBDA_ENVIRONMENT['metadata_bucket'])
+    recorder.run('snapshot_load_warm', org_metadata.load_org_snapshot, clients['s3'], LAMBDA_ENVIRONMENT['metadata_bucket'])
+
+    # a single account moves, applied to the stored snapshot
+    recorder.run('event_run', lambda_function.lambda_handler, move_account_event(org, args.seed), None)
+
+    # one OU subtree is walked again and only its groups are applied
+    recorder.run('scoped_run', lambda_function.lambda_handler, scoped_resync_event(org, clients, args.seed), None)
+
+    # the metadata tables are compacted and their old files removed
+    recorder.run('maintenance_run', lambda_function.lambda_handler, {'maintenance': True}, None)
+
+    lakeformation = clients['lakeformation']
+    report = {
+        'config': dict(vars(args), tags=tags),
+        'org': {
+            'ous': len(org['ous']) + 1,
+            'accounts': len(org['accounts']),
+        },
+        'results': {
+            'data_cells_filters': len(lakeformation.filters),
+            'grants': len(lakeformation.permissions),
+        },
+        'python': platform.python_version(),
+        'phases': recorder.phases,
+    }
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output+'\n')
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
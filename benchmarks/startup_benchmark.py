@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Measures the cold start cost of the RLSecLake lambda: import time and peak RSS of
+# the pandas-free core, and of the core plus the libraries the Iceberg write step loads.
+# Each measurement runs in a fresh interpreter so nothing is cached between runs.
+#
+#   python benchmarks/startup_benchmark.py --repeat 5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'rl_sec_lake')
+
+PATHS = {
+    'core': 'import lambda_function',
+    'iceberg_write': 'import lambda_function; import pandas; import awswrangler',
+}
+
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'import_seconds': elapsed,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+'''
+
+# the lambda reads its configuration from the environment at import time
+LAMBDA_ENVIRONMENT = {
+    'metadata_database': 'aws_account_metadata_db',
+    'metadata_bucket': 'benchmark-bucket',
+    'account_id': '111111111111',
+    'security_lake_db': 'amazon_security_lake_glue_db_us_east_1',
+    'security_lake_table': 'amazon_security_lake_table_us_east_1_sh_findings_1_0',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+}
+
+
+def measure(statement):
+    env = dict(os.environ, **LAMBDA_ENVIRONMENT)
+    env['PYTHONPATH'] = os.pathsep.join([LAMBDA_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    result = subprocess.run([sys.executable, '-c', PROBE, statement], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception('Unable to import '+statement+': '+result.stderr.strip().splitlines()[-1])
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and peak RSS of the RLSecLake lambda')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    report = {}
+    for name, statement in PATHS.items():
+        try:
+            runs = [measure(statement) for _ in range(args.repeat)]
+        except Exception as e:
+            report[name] = {'error': str(e)}
+            continue
+
+        report[name] = {
+            'import_seconds': statistics.median(run['import_seconds'] for run in runs),
+            'peak_rss_mb': statistics.median(run['peak_rss_mb'] for run in runs),
+            'runs': len(runs),
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
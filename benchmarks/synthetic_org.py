@@ -0,0 +1,71 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Generates synthetic AWS Organizations trees for the benchmarks. The same
+# arguments and seed always produce the same org, so reports from different
+# versions of the lambda can be compared.
+
+import random
+
+
+def parse_tag_spec(spec):
+    # 'team=20,env=4' -> {'team': 20, 'env': 4}, the number of distinct values per tag key
+    tags = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+
+        key, _, count = item.partition('=')
+        tags[key.strip()] = int(count or 1)
+
+    return tags
+
+
+def count_ous(depth, fanout):
+    return sum(fanout ** level for level in range(depth + 1))
+
+
+def generate_org(depth=3, fanout=4, accounts_per_ou=5, tags=None, tag_coverage=1.0, seed=0):
+    # returns {'org_id', 'root_id', 'ous': {id: {'name', 'parent_id'}},
+    # 'accounts': {id: {'name', 'parent_id', 'tags'}}}. every OU, including the
+    # root, gets accounts_per_ou accounts. each account gets each tag key with
+    # probability tag_coverage, with values spread evenly over the distinct values
+    rng = random.Random(seed)
+    tags = tags or {}
+
+    org = {
+        'org_id': 'o-benchmark01',
+        'root_id': 'r-0001',
+        'ous': {},
+        'accounts': {},
+    }
+
+    ou_count = 0
+    level = [(org['root_id'], None, 'root')]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for ou_id, parent_id, name in level:
+            if parent_id is not None:
+                org['ous'][ou_id] = {'name': name, 'parent_id': parent_id}
+
+            for _ in range(accounts_per_ou):
+                account_id = str(len(org['accounts']) + 100000000000)
+                account_tags = {}
+                for key, values in sorted(tags.items()):
+                    if rng.random() < tag_coverage:
+                        account_tags[key] = key+'-'+str(rng.randrange(values))
+
+                org['accounts'][account_id] = {
+                    'name': 'account-'+account_id,
+                    'parent_id': ou_id,
+                    'tags': account_tags,
+                }
+
+            if current_depth < depth:
+                for index in range(fanout):
+                    ou_count += 1
+                    next_level.append(('ou-0001-'+str(ou_count).zfill(8), ou_id, name.replace('root', 'OU')+'-'+str(index + 1)))
+
+        level = next_level
+
+    return org
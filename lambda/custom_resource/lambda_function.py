@@ -7,6 +7,9 @@ import json
 
 RLSECLAKE_LAMBDA_ARN = os.environ['rlseclake_lambda_arn']
 
+# what the RLSecLake lambda accepts in a scoped resync
+SCOPE_KEYS = ['ou_paths', 'ou_ids', 'consumer_account_ids']
+
 client = boto3.client('lambda')  
 
 def on_event(event, context):
@@ -27,8 +30,45 @@ def on_create(event):
     )
     return {'Output': json.loads(json.dumps(response, default=str))}
 
+def parse_scope(value):
+    # a resync_scope is a JSON object of OU paths, OU ids or consumer account ids,
+    # each a list or a single string. anything else fails the deploy with the reason
+    try:
+        scope = json.loads(value)
+    except ValueError as e:
+        raise Exception(f'resync_scope is not valid JSON: {e}')
+
+    if not isinstance(scope, dict):
+        raise Exception('resync_scope must be a JSON object, eg {"ou_paths": ["OU=root,OU=Team"]}')
+
+    unknown = sorted(set(scope) - set(SCOPE_KEYS))
+    if unknown:
+        raise Exception(f'resync_scope has unknown keys {unknown}, expected any of {SCOPE_KEYS}')
+
+    for key, values in scope.items():
+        if isinstance(values, str):
+            values = [values]
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise Exception(f'resync_scope {key} must be a string or a list of strings')
+
+    if not any(scope.values()):
+        raise Exception(f'resync_scope needs at least one of {SCOPE_KEYS}')
+
+    return scope
+
 def on_update(event):
-    return
+    # deploying with a resync_scope applies just the OUs or consumers in it,
+    # other updates are left to the next scheduled run
+    scope = event.get('ResourceProperties', {}).get('Scope')
+    if not scope:
+        return
+
+    response = client.invoke(
+        FunctionName=RLSECLAKE_LAMBDA_ARN,
+        InvocationType='Event',
+        Payload=json.dumps({'scope': parse_scope(scope)})
+    )
+    return {'Output': json.loads(json.dumps(response, default=str))}
 
 def on_delete(event):
     return
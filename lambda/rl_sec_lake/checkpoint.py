@@ -0,0 +1,196 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import json
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+# a run is split into stages, and the filters stage into one work item per shared
+# group. progress is kept in the metadata bucket so a run that is running out
+# of time can hand over to a new invocation of the lambda
+CHECKPOINT_PREFIX = '_state/checkpoints/'
+CHECKPOINT_VERSION = 9
+
+STAGE_TABLES = 'tables'
+STAGE_FILTERS = 'filters'
+STAGE_GRANTS = 'grants'
+STAGE_CLEANUP = 'cleanup'
+
+# stop and hand over when less than this is left of the lambda timeout
+RESUME_MARGIN_SECONDS = int(os.environ.get('resume_margin_seconds', '60'))
+
+# progress is saved at least this often, so a run that is killed by the timeout
+# anyway can be picked up by the next invocation without starting over
+CHECKPOINT_INTERVAL_SECONDS = int(os.environ.get('checkpoint_interval_seconds', '30'))
+
+# give up on a run that keeps handing over without finishing
+MAX_RESUMES = int(os.environ.get('max_resumes', '20'))
+
+# a run belongs to the invocation that last saved it, or the one it handed over to,
+# until its lease runs out. it is as long as the longest lambda timeout, so it
+# outlasts any unit of work, and a run that was killed is free again after that
+CHECKPOINT_LEASE_SECONDS = int(os.environ.get('checkpoint_lease_seconds', '900'))
+
+
+def checkpoint_key(kind, run_id):
+    # there is only ever one full sync, which the next scheduled run picks up if it
+    # was killed. change events each get their own so they don't overwrite each other
+    if kind == 'full':
+        return CHECKPOINT_PREFIX+'full.json'
+
+    return CHECKPOINT_PREFIX+kind+'/'+run_id+'.json'
+
+
+def new_checkpoint(kind, snapshot, group_filter, consumer_filter=None):
+    # kind is 'full' for org walks, 'event' for org change events and 'scoped' for
+    # resyncs of some OUs or consumers. consumer_filter limits grants to those accounts
+    return {
+        'version': CHECKPOINT_VERSION,
+        'run_id': uuid.uuid4().hex,
+        'kind': kind,
+        'stage': STAGE_TABLES,
+        'resumes': 0,
+        'started_at': time.time(),
+        'snapshot': snapshot,
+        'group_filter': None if group_filter is None else sorted(group_filter),
+        'consumer_filter': None if consumer_filter is None else sorted(consumer_filter),
+        'account_columns': {},
+        'region_results': {},
+        'shared_groups': [],
+        'next_group': 0,
+        'targets_done': [],
+        'regions_failed': [],
+        'pending_events': [],
+        'lease_until': 0,
+        'error': None,
+    }
+
+
+def load_checkpoint(s3_client, bucket, kind, run_id=None):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=checkpoint_key(kind, run_id))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+    checkpoint = json.loads(response['Body'].read())
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        logging.info('--- Ignoring checkpoint with version '+str(checkpoint.get('version'))+' ---')
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(s3_client, bucket, checkpoint):
+    checkpoint['updated_at'] = time.time()
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=checkpoint_key(checkpoint['kind'], checkpoint['run_id']),
+        Body=json.dumps(checkpoint, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+
+def clear_checkpoint(s3_client, bucket, checkpoint):
+    s3_client.delete_object(Bucket=bucket, Key=checkpoint_key(checkpoint['kind'], checkpoint['run_id']))
+
+
+def take_lease(checkpoint):
+    checkpoint['lease_until'] = time.time()+CHECKPOINT_LEASE_SECONDS
+
+
+def is_checkpoint_active(checkpoint):
+    # the run is still going, either in an invocation or being handed over to the next one
+    return time.time() < checkpoint.get('lease_until', 0)
+
+
+def record_failure(s3_client, bucket, checkpoint, error):
+    # a full sync whose invocation failed starts over when it is next picked up, rather
+    # than carrying on from a snapshot that may be hours old by then. it is kept for the
+    # changes waiting on it. change events and resyncs are retried by lambda, and the
+    # fingerprint they cleared makes the next full sync apply everything anyway
+    try:
+        if checkpoint['kind'] != 'full':
+            clear_checkpoint(s3_client, bucket, checkpoint)
+            return
+
+        checkpoint['error'] = str(error)[:1000]
+        checkpoint['lease_until'] = 0
+        save_checkpoint(s3_client, bucket, checkpoint)
+    except ClientError as e:
+        logging.error('Unable to record the failure of run '+checkpoint['run_id']+': '+str(e))
+
+
+class RunClock:
+    # tracks the time left in this invocation and when progress was last saved
+
+    def __init__(self, context):
+        self.context = context
+        self.last_saved = time.time()
+
+    def remaining_seconds(self):
+        if self.context is None:
+            return float('inf')
+
+        return self.context.get_remaining_time_in_millis()/1000.0
+
+    def running_out(self):
+        return self.remaining_seconds() < RESUME_MARGIN_SECONDS
+
+    def save_due(self):
+        return time.time()-self.last_saved >= CHECKPOINT_INTERVAL_SECONDS
+
+    def saved(self):
+        self.last_saved = time.time()
+
+
+def resume_payload(checkpoint):
+    return {'resume': {'run_id': checkpoint['run_id'], 'kind': checkpoint['kind']}}
+
+
+def hand_over(s3_client, lambda_client, bucket, checkpoint, context):
+    # saves progress and starts a new invocation of this lambda to carry on from it.
+    # returns False when the run has already been handed over too many times
+    if checkpoint['resumes'] >= MAX_RESUMES:
+        logging.error('Run '+checkpoint['run_id']+' did not finish after '+str(checkpoint['resumes'])+' invocations, giving up. The next full sync starts over')
+        abandon_checkpoint(s3_client, lambda_client, bucket, checkpoint, context)
+        return False
+
+    checkpoint['resumes'] += 1
+    take_lease(checkpoint)
+    save_checkpoint(s3_client, bucket, checkpoint)
+
+    logging.info('--- Running out of time in '+checkpoint['stage']+' stage, handing run '+checkpoint['run_id']+' over to a new invocation ---')
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(resume_payload(checkpoint)).encode('utf-8')
+    )
+
+    return True
+
+
+def replay_pending_events(lambda_client, checkpoint, context):
+    # org changes and resyncs that came in while a full sync was in progress are
+    # sent to the lambda again, to be applied once this invocation has returned
+    for event in checkpoint.get('pending_events', []):
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps(event).encode('utf-8')
+        )
+
+    if checkpoint.get('pending_events'):
+        logging.info('--- Replaying '+str(len(checkpoint['pending_events']))+' changes that came in during run '+checkpoint['run_id']+' ---')
+    checkpoint['pending_events'] = []
+
+
+def abandon_checkpoint(s3_client, lambda_client, bucket, checkpoint, context):
+    # drops a run that won't be carried on, without losing the changes waiting on it
+    replay_pending_events(lambda_client, checkpoint, context)
+    clear_checkpoint(s3_client, bucket, checkpoint)
@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+# a hash of everything a full run applies is kept next to the org snapshot once the
+# run has finished. a full run that would apply exactly the same again is skipped
+FINGERPRINT_KEY = '_state/fingerprint.json'
+
+# bump when a change to the lambda means unchanged orgs have to be applied again
+FINGERPRINT_VERSION = 1
+
+# Lake Formation is still swept in full this often, to put back filters and grants
+# that were changed by hand since the last apply
+FINGERPRINT_MAX_AGE_HOURS = float(os.environ.get('fingerprint_max_age_hours', '24'))
+
+
+def compute_fingerprint(snapshot, mappings, settings):
+    # only the content of the snapshot is hashed, keys are sorted so the hash
+    # doesn't depend on the order the org was walked in
+    content = {
+        'version': FINGERPRINT_VERSION,
+        'org': dict((key, snapshot.get(key)) for key in ('org_id', 'root_id', 'ous', 'accounts')),
+        'mappings': mappings,
+        'settings': settings,
+    }
+    body = json.dumps(content, sort_keys=True, separators=(',', ':'), default=sorted)
+
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def load_fingerprint(s3_client, bucket, key=FINGERPRINT_KEY):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+    return json.loads(response['Body'].read())
+
+
+def save_fingerprint(s3_client, bucket, fingerprint, run_id, key=FINGERPRINT_KEY):
+    body = json.dumps({'fingerprint': fingerprint, 'run_id': run_id, 'applied_at': time.time()}, separators=(',', ':'))
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body.encode('utf-8'), ContentType='application/json')
+
+
+def clear_fingerprint(s3_client, bucket, key=FINGERPRINT_KEY):
+    s3_client.delete_object(Bucket=bucket, Key=key)
+
+
+def is_unchanged(stored, fingerprint):
+    if stored is None:
+        return False
+
+    if stored.get('fingerprint') != fingerprint:
+        return False
+
+    age_hours = (time.time()-stored.get('applied_at', 0))/3600.0
+    if age_hours >= FINGERPRINT_MAX_AGE_HOURS:
+        logging.info('--- Last full apply was '+str(round(age_hours, 1))+' hours ago, sweeping Lake Formation ---')
+        return False
+
+    return True
@@ -0,0 +1,270 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Reads the live rows of a small Iceberg table straight from its metadata and data
+# files, without going through Athena. Only what our tables use is supported:
+# parquet data files, and position deletes as written by Athena UPDATE/DELETE.
+# Anything else raises so the caller can fall back to an Athena query.
+
+import gzip
+import json
+import struct
+import zlib
+
+AVRO_MAGIC = b'Obj\x01'
+AVRO_SYNC_SIZE = 16
+
+# manifest entry status and data file content types from the Iceberg spec
+ENTRY_STATUS_DELETED = 2
+CONTENT_DATA = 0
+CONTENT_POSITION_DELETES = 1
+
+
+class AvroDecoder:
+
+    def __init__(self, data, position=0):
+        self.data = data
+        self.position = position
+        self.named_types = {}
+
+    def read(self, size):
+        value = self.data[self.position:self.position+size]
+        if len(value) != size:
+            raise ValueError('Unexpected end of Avro data')
+        self.position += size
+        return value
+
+    def read_long(self):
+        # zig-zag encoded variable length integer
+        shift = 0
+        value = 0
+        while True:
+            byte = self.data[self.position]
+            self.position += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+
+        return (value >> 1) ^ -(value & 1)
+
+    def read_bytes(self):
+        return self.read(self.read_long())
+
+    def read_blocks(self, read_item):
+        # arrays and maps are written as blocks of items ending with an empty block
+        while True:
+            count = self.read_long()
+            if count == 0:
+                return
+            if count < 0:
+                count = -count
+                self.read_long()
+            for _ in range(count):
+                read_item()
+
+    def decode(self, schema):
+        if isinstance(schema, list):
+            return self.decode(schema[self.read_long()])
+
+        if isinstance(schema, dict):
+            schema_type = schema['type']
+        else:
+            schema_type = schema
+
+        if schema_type == 'null':
+            return None
+        if schema_type == 'boolean':
+            return self.read(1) != b'\x00'
+        if schema_type in ('int', 'long'):
+            return self.read_long()
+        if schema_type == 'float':
+            return struct.unpack('<f', self.read(4))[0]
+        if schema_type == 'double':
+            return struct.unpack('<d', self.read(8))[0]
+        if schema_type == 'bytes':
+            return self.read_bytes()
+        if schema_type == 'string':
+            return self.read_bytes().decode('utf-8')
+
+        if schema_type == 'record':
+            self.named_types[schema['name']] = schema
+            return dict((field['name'], self.decode(field['type'])) for field in schema['fields'])
+
+        if schema_type == 'enum':
+            self.named_types[schema['name']] = schema
+            return schema['symbols'][self.read_long()]
+
+        if schema_type == 'fixed':
+            self.named_types[schema['name']] = schema
+            return self.read(schema['size'])
+
+        if schema_type == 'array':
+            items = []
+            self.read_blocks(lambda: items.append(self.decode(schema['items'])))
+            return items
+
+        if schema_type == 'map':
+            values = {}
+
+            def read_entry():
+                key = self.read_bytes().decode('utf-8')
+                values[key] = self.decode(schema['values'])
+
+            self.read_blocks(read_entry)
+            return values
+
+        if isinstance(schema_type, (dict, list)):
+            return self.decode(schema_type)
+
+        # reference to a named type defined earlier in the schema
+        named = self.named_types.get(schema_type) or self.named_types.get(schema_type.split('.')[-1])
+        if named is None:
+            raise ValueError('Unsupported Avro type: '+str(schema_type))
+
+        return self.decode(named)
+
+
+def read_avro_records(data):
+    # decodes an Avro object container file, as used for Iceberg manifests
+    header = AvroDecoder(data)
+    if header.read(4) != AVRO_MAGIC:
+        raise ValueError('Not an Avro object container file')
+
+    meta = header.decode({'type': 'map', 'values': 'bytes'})
+    sync = header.read(AVRO_SYNC_SIZE)
+    schema = json.loads(meta['avro.schema'])
+    codec = meta.get('avro.codec', b'null').decode('utf-8')
+
+    records = []
+    while header.position < len(data):
+        count = header.read_long()
+        block = header.read(header.read_long())
+        if header.read(AVRO_SYNC_SIZE) != sync:
+            raise ValueError('Avro sync marker mismatch')
+
+        if codec == 'deflate':
+            block = zlib.decompress(block, -15)
+        elif codec != 'null':
+            raise ValueError('Unsupported Avro codec: '+codec)
+
+        decoder = AvroDecoder(block)
+        for _ in range(count):
+            records.append(decoder.decode(schema))
+
+    return records
+
+
+class FileReader:
+    # opens s3:// URIs and local paths through pyarrow, reusing one filesystem per bucket
+
+    def __init__(self):
+        import pyarrow.fs as pafs
+
+        self.pafs = pafs
+        self.local = pafs.LocalFileSystem()
+        self.filesystems = {}
+
+    def resolve(self, uri):
+        # returns (filesystem, path within that filesystem)
+        if '://' not in uri:
+            return self.local, uri
+
+        scheme, path = uri.split('://', 1)
+        if scheme == 'file':
+            return self.local, path
+
+        if scheme not in ('s3', 's3a', 's3n'):
+            raise ValueError('Unsupported URI scheme: '+scheme)
+
+        bucket = path.split('/', 1)[0]
+        if bucket not in self.filesystems:
+            self.filesystems[bucket] = self.pafs.FileSystem.from_uri('s3://'+path)[0]
+
+        return self.filesystems[bucket], path
+
+    def read_bytes(self, uri):
+        filesystem, path = self.resolve(uri)
+        with filesystem.open_input_stream(path) as stream:
+            return stream.read()
+
+    def read_parquet(self, uri):
+        import pyarrow.parquet as pq
+
+        filesystem, path = self.resolve(uri)
+        return pq.read_table(path, filesystem=filesystem)
+
+
+def read_iceberg_records(metadata_location, reader=None):
+    # returns the live rows of the table's current snapshot as a list of dicts
+    import pyarrow as pa
+
+    reader = reader or FileReader()
+
+    metadata_bytes = reader.read_bytes(metadata_location)
+    if metadata_location.endswith('.gz.metadata.json') or metadata_bytes[:2] == b'\x1f\x8b':
+        metadata_bytes = gzip.decompress(metadata_bytes)
+    metadata = json.loads(metadata_bytes)
+
+    snapshot_id = metadata.get('current-snapshot-id')
+    if snapshot_id is None or snapshot_id == -1:
+        return []
+
+    snapshot = next(s for s in metadata.get('snapshots', []) if s['snapshot-id'] == snapshot_id)
+    if 'manifest-list' in snapshot:
+        manifests = read_avro_records(reader.read_bytes(snapshot['manifest-list']))
+    else:
+        manifests = [{'manifest_path': path} for path in snapshot.get('manifests', [])]
+
+    data_files = []
+    delete_files = []
+    for manifest in manifests:
+        for entry in read_avro_records(reader.read_bytes(manifest['manifest_path'])):
+            if entry['status'] == ENTRY_STATUS_DELETED:
+                continue
+
+            data_file = entry['data_file']
+            content = data_file.get('content', CONTENT_DATA)
+            if str(data_file.get('file_format', 'PARQUET')).upper() != 'PARQUET':
+                raise ValueError('Unsupported data file format: '+str(data_file.get('file_format')))
+
+            if content == CONTENT_DATA:
+                data_files.append(data_file['file_path'])
+            elif content == CONTENT_POSITION_DELETES:
+                delete_files.append(data_file['file_path'])
+            else:
+                raise ValueError('Equality deletes are not supported')
+
+    deleted_positions = {}
+    for delete_file in delete_files:
+        deletes = reader.read_parquet(delete_file).to_pydict()
+        for file_path, position in zip(deletes['file_path'], deletes['pos']):
+            deleted_positions.setdefault(file_path, set()).add(position)
+
+    tables = []
+    for data_file in data_files:
+        table = reader.read_parquet(data_file)
+        deleted = deleted_positions.get(data_file)
+        if deleted:
+            table = table.filter(pa.array([position not in deleted for position in range(table.num_rows)]))
+        tables.append(table)
+
+    if not tables:
+        return []
+
+    # data files written before a column was added won't have it
+    try:
+        table = pa.concat_tables(tables, promote_options='default')
+    except TypeError:
+        table = pa.concat_tables(tables, promote=True)
+
+    return table.to_pylist()
+
+
+def get_iceberg_metadata_location(table):
+    # table is the Table from a glue get_table response
+    parameters = table.get('Parameters', {})
+    if parameters.get('table_type', '').upper() != 'ICEBERG' or 'metadata_location' not in parameters:
+        raise ValueError(table.get('DatabaseName', '')+'.'+table.get('Name', '')+' is not an Iceberg table')
+
+    return parameters['metadata_location']
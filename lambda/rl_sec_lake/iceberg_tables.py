@@ -0,0 +1,221 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import hashlib
+import json
+
+from botocore.exceptions import ClientError
+
+from iceberg_reader import get_iceberg_metadata_location, read_iceberg_records
+from s3_cleanup import delete_prefix
+
+# pandas and awswrangler take seconds to import, so they are only loaded by the
+# functions below that actually read or write a table through them
+
+# what was last committed to each table is kept next to the org snapshot so
+# unchanged rows don't have to be read back from the table to be diffed
+TABLE_STATE_PREFIX = '_state/tables/'
+
+# keep DELETE statements well within Athena's 256KB query string limit
+DELETE_BATCH_SIZE = 1000
+
+
+def row_hash(row):
+    # missing values come through astype(str) as 'nan', leaving them out means a
+    # new tag column doesn't change the hash of rows that don't have the tag
+    values = dict((k, v) for k, v in row.items() if v != 'nan')
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_table_state(s3_client, bucket, table_name):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=TABLE_STATE_PREFIX+table_name+'.json')
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}
+        raise
+
+    return json.loads(response['Body'].read())
+
+
+def save_table_state(s3_client, bucket, table_name, state):
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=TABLE_STATE_PREFIX+table_name+'.json',
+        Body=json.dumps(state, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+
+def table_exists(glue_client, database, table_name):
+    try:
+        glue_client.get_table(DatabaseName=database, Name=table_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'EntityNotFoundException':
+            return False
+        raise
+
+    return True
+
+
+def flatten_record(record, prefix=''):
+    # same column names as pandas.json_normalize, eg tags.owner, with every value as a string
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, prefix+key+'.'))
+        else:
+            flat[prefix+key] = str(value)
+
+    return flat
+
+
+def sql_string(value):
+    return "'"+str(value).replace("'", "''")+"'"
+
+
+def delete_rows(database, table_name, key_column, keys):
+    # deletes the rows whose key is in keys, a batch at a time
+    import awswrangler as wr
+
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start:start+DELETE_BATCH_SIZE]
+        wr.athena.start_query_execution(
+            sql=f'DELETE FROM "{table_name}" WHERE "{key_column}" IN ('+', '.join(sql_string(key) for key in batch)+')',
+            database=database,
+            wait=True,
+        )
+
+
+def upsert_iceberg_table(s3_client, glue_client, database, table_name, records, bucket, key_column='id'):
+    # MERGEs rows that changed since the last write and deletes rows that have gone,
+    # so the table is never dropped and the cost follows the size of the change
+    state = load_table_state(s3_client, bucket, table_name)
+
+    # columns only ever get added to the table, so anything that disappeared
+    # from the records is written as missing
+    columns = set(state.get('columns', []))
+    for record in records:
+        columns.update(record)
+    columns = sorted(columns)
+
+    rows = {}
+    row_hashes = {}
+    for record in records:
+        row = dict((column, str(record.get(column, 'nan'))) for column in columns)
+        rows[row[key_column]] = row
+        row_hashes[row[key_column]] = row_hash(row)
+
+    table_hash = hashlib.sha256(json.dumps([columns, sorted(row_hashes.items())]).encode('utf-8')).hexdigest()
+    exists = table_exists(glue_client, database, table_name)
+
+    if exists and state.get('hash') == table_hash:
+        logging.info('--- '+table_name+' table is unchanged, skipping write ---')
+        return
+
+    import pandas as pd
+    import awswrangler as wr
+
+    if not exists:
+        logging.info('--- Creating '+table_name+' table ---')
+        wr.athena.to_iceberg(
+            pd.DataFrame(list(rows.values()), columns=columns),
+            database=database,
+            table=table_name,
+            table_location='s3://'+bucket+'/'+table_name+'/',
+            temp_path='s3://'+bucket+'/'+table_name+'/temp/',
+            keep_files=False
+        )
+
+    else:
+        previous_rows = state.get('rows')
+        changed = [key for key, value in row_hashes.items() if previous_rows is None or previous_rows.get(key) != value]
+
+        if changed:
+            logging.info('--- Merging '+str(len(changed))+' changed rows into '+table_name+' table ---')
+            wr.athena.to_iceberg(
+                pd.DataFrame([rows[key] for key in changed], columns=columns),
+                database=database,
+                table=table_name,
+                table_location='s3://'+bucket+'/'+table_name+'/',
+                temp_path='s3://'+bucket+'/'+table_name+'/temp/',
+                merge_cols=[key_column],
+                schema_evolution=True,
+                keep_files=False
+            )
+
+        if previous_rows is None:
+            # without a previous state the keys in the table are read back, a NOT IN
+            # of every key we keep would outgrow Athena's query string limit
+            previous_rows = dict((record.get(key_column), None) for record in read_table_records(glue_client, database, table_name) or [])
+
+        removed = sorted(key for key in previous_rows if key not in rows)
+        if removed:
+            logging.info('--- Removing '+str(len(removed))+' rows from '+table_name+' table ---')
+            delete_rows(database, table_name, key_column, removed)
+
+    save_table_state(s3_client, bucket, table_name, {
+        'hash': table_hash,
+        'columns': columns,
+        'rows': row_hashes
+    })
+
+
+def read_table_records(glue_client, database, table_name):
+    # returns the rows of the table as dicts of strings, or None if it doesn't exist.
+    # the live data files are read directly, Athena is only used if that fails
+    try:
+        response = glue_client.get_table(DatabaseName=database, Name=table_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'EntityNotFoundException':
+            return None
+        raise
+
+    try:
+        metadata_location = get_iceberg_metadata_location(response['Table'])
+        records = read_iceberg_records(metadata_location)
+        logging.info('--- Read '+str(len(records))+' rows from '+metadata_location+' ---')
+        return [dict((k, '' if v is None else str(v)) for k, v in record.items()) for record in records]
+    except Exception as e:
+        logging.warning('Unable to read '+table_name+' from its Iceberg files, falling back to Athena: '+repr(e))
+
+    import awswrangler as wr
+
+    df_table = wr.athena.read_sql_query(
+        sql=f'SELECT * FROM "{table_name}"',
+        database=database,
+        ctas_approach=False,
+        unload_approach=False,
+    )
+
+    return df_table.fillna('').astype(str).to_dict('records')
+
+
+def replace_iceberg_table(s3_client, glue_client, database, table_name, records, bucket):
+    import pandas as pd
+    import awswrangler as wr
+
+    if table_exists(glue_client, database, table_name):
+        ## drop existing table
+        logging.info('--- Dropping old '+table_name+' table ---')
+        wr.athena.read_sql_query(
+            sql=f'DROP TABLE `{table_name}`',
+            database=database,
+            ctas_approach=False,
+            unload_approach=False,
+        )
+
+        logging.info('--- Removing '+table_name+' table metadata ---')
+        delete_prefix(s3_client, bucket, table_name+'/')
+
+    # write table to S3
+    logging.info('--- Creating new '+table_name+' Iceberg table ---')
+
+    wr.athena.to_iceberg(
+        pd.DataFrame(records),
+        database=database,
+        table=table_name,
+        table_location='s3://'+bucket+'/'+table_name+'/',
+        temp_path='s3://'+bucket+'/'+table_name+'/temp/',
+    )
@@ -0,0 +1,254 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import hashlib
+import logging
+import json
+import re
+
+from lf_executor import run_concurrently
+
+ACCOUNT_METADATA_FILTER_PREFIX = 'account_metadata_filter_'
+SECURITY_LAKE_FILTER_PREFIX = 'security_lake_filter_'
+
+# BatchGrantPermissions and BatchRevokePermissions accept at most 20 entries
+PERMISSIONS_BATCH_SIZE = 20
+GRANTED_PERMISSIONS = ['SELECT']
+
+AWS_ACCOUNT_ID_PATTERN = re.compile(r'\d{12}')
+
+# Lake Formation names are at most 255 characters. the readable part of a filter name
+# is cut short so the group's hash and a shard suffix, eg __part12, always fit
+MAX_FILTER_NAME_LENGTH = 255
+FILTER_NAME_HASH_LENGTH = 12
+SHARD_SUFFIX_MAX_LENGTH = 12
+
+# changes whenever group_filter_name names filters differently, it is part of the
+# fingerprint so the next full run puts the new filters in place of the old ones
+FILTER_NAME_VERSION = 2
+
+
+def group_filter_name(prefix, group):
+    # group is an OU path or a tag group key, eg OU=root,OU=Security becomes
+    # OU_root_OU_Security_<hash>. the readable part maps anything but letters and digits
+    # to _, so different groups can read the same, eg TAG=cost_center=x and
+    # TAG=cost=center_x. the hash of the group itself keeps their names apart
+    group = str(group)
+    digest = hashlib.sha256(group.encode('utf-8')).hexdigest()[:FILTER_NAME_HASH_LENGTH]
+    readable = re.sub(r'[^A-Za-z0-9]+', '_', group).strip('_')
+    readable = readable[:MAX_FILTER_NAME_LENGTH-SHARD_SUFFIX_MAX_LENGTH-len(prefix)-len(digest)-1].rstrip('_')
+
+    return prefix+readable+'_'+digest
+
+
+def normalize_filter_expression(expression):
+    # Lake Formation hands back the expression as it was stored, so only
+    # whitespace differences need to be ignored when comparing
+    if expression is None:
+        return None
+
+    return ' '.join(str(expression).split())
+
+
+def get_data_cells_filters(lf_client, catalog_id, database_name, table_name):
+    # returns {filter name: row filter expression} for every filter on the table
+    kwargs = {
+        'Table': {
+            'CatalogId': catalog_id,
+            'DatabaseName': database_name,
+            'Name': table_name
+        }
+    }
+
+    data_cells_filters = {}
+    while True:
+        response = lf_client.list_data_cells_filter(**kwargs)
+        for data_cells_filter in response.get('DataCellsFilters', []):
+            row_filter = data_cells_filter.get('RowFilter', {})
+            data_cells_filters[data_cells_filter['Name']] = row_filter.get('FilterExpression')
+
+        if not response.get('NextToken'):
+            return data_cells_filters
+
+        kwargs['NextToken'] = response['NextToken']
+
+
+def put_data_cells_filter(lf_client, existing_filters, catalog_id, database_name, table_name, name, filter_expression):
+    # creates or updates the filter only when it differs from what is already
+    # in Lake Formation. returns 'created', 'updated' or 'unchanged'
+    table_data = {
+        'TableCatalogId': catalog_id,
+        'DatabaseName': database_name,
+        'TableName': table_name,
+        'Name': name,
+        'RowFilter': {
+            'FilterExpression': filter_expression
+        },
+        'ColumnWildcard': {}
+    }
+
+    if name not in existing_filters:
+        logging.info('--- Creating data cells filter '+name+' on '+database_name+'.'+table_name+' ---')
+        lf_client.create_data_cells_filter(TableData=table_data)
+        existing_filters[name] = filter_expression
+        return 'created'
+
+    if normalize_filter_expression(existing_filters[name]) == normalize_filter_expression(filter_expression):
+        logging.debug('Data cells filter '+name+' is unchanged')
+        return 'unchanged'
+
+    logging.info('--- Updating existing data cells filter '+name+' on '+database_name+'.'+table_name+' ---')
+    lf_client.update_data_cells_filter(TableData=table_data)
+    existing_filters[name] = filter_expression
+    return 'updated'
+
+
+def get_data_cells_filter_grants(lf_client, catalog_id, database_name, table_name):
+    # returns {(filter name, principal)} for every SELECT grant on the table's data cells filters
+    kwargs = {
+        'CatalogId': catalog_id,
+        'Resource': {
+            'Table': {
+                'CatalogId': catalog_id,
+                'DatabaseName': database_name,
+                'Name': table_name
+            }
+        },
+        'IncludeRelated': 'TRUE'
+    }
+
+    grants = set()
+    while True:
+        response = lf_client.list_permissions(**kwargs)
+        for permission in response.get('PrincipalResourcePermissions', []):
+            data_cells_filter = permission.get('Resource', {}).get('DataCellsFilter')
+            if data_cells_filter is None:
+                continue
+            if data_cells_filter.get('DatabaseName') != database_name or data_cells_filter.get('TableName') != table_name:
+                continue
+            if 'SELECT' not in permission.get('Permissions', []):
+                continue
+
+            grants.add((data_cells_filter['Name'], permission['Principal']['DataLakePrincipalIdentifier']))
+
+        if not response.get('NextToken'):
+            return grants
+
+        kwargs['NextToken'] = response['NextToken']
+
+
+def plan_grants(desired_grants, existing_grants, in_scope):
+    # desired_grants: {filter name: set of principals}. existing grants outside of
+    # in_scope(filter name, principal), or to principals that aren't AWS accounts, are left alone
+    desired = set()
+    for name, principals in desired_grants.items():
+        for principal in principals:
+            desired.add((name, principal))
+
+    to_grant = sorted(desired - existing_grants)
+    to_revoke = sorted(
+        grant for grant in existing_grants - desired
+        if in_scope(grant[0], grant[1]) and AWS_ACCOUNT_ID_PATTERN.fullmatch(grant[1])
+    )
+
+    return to_grant, to_revoke
+
+
+def apply_grants(batch_operation, catalog_id, database_name, table_name, grants):
+    # sends (filter name, principal) pairs to batch_grant_permissions or
+    # batch_revoke_permissions in full-size batches, several batches at a time.
+    # returns the number of failures
+    def send_batch(start):
+        entries = []
+        for index, (name, principal) in enumerate(grants[start:start+PERMISSIONS_BATCH_SIZE]):
+            entries.append({
+                'Id': str(start+index),
+                'Principal': {
+                    'DataLakePrincipalIdentifier': principal
+                },
+                'Resource': {
+                    'DataCellsFilter': {
+                        'TableCatalogId': catalog_id,
+                        'DatabaseName': database_name,
+                        'TableName': table_name,
+                        'Name': name
+                    }
+                },
+                'Permissions': GRANTED_PERMISSIONS,
+                'PermissionsWithGrantOption': GRANTED_PERMISSIONS
+            })
+
+        return batch_operation(CatalogId=catalog_id, Entries=entries)
+
+    results, errors = run_concurrently(send_batch, list(range(0, len(grants), PERMISSIONS_BATCH_SIZE)))
+
+    failures = 0
+    for start, response in results:
+        for failure in response.get('Failures', []):
+            failures += 1
+            entry = failure.get('RequestEntry', {})
+            logging.error('Failed '+batch_operation.__name__+' for '+json.dumps(entry.get('Resource', {}))+' to '+str(entry.get('Principal', {}).get('DataLakePrincipalIdentifier'))+': '+json.dumps(failure.get('Error', {})))
+
+    for start, error in errors:
+        batch = grants[start:start+PERMISSIONS_BATCH_SIZE]
+        failures += len(batch)
+        logging.error('Failed '+batch_operation.__name__+' for '+str(len(batch))+' grants on '+database_name+'.'+table_name+': '+str(error))
+
+    return failures
+
+
+def reconcile_grants(lf_client, catalog_id, database_name, table_name, desired_grants, in_scope):
+    existing_grants = get_data_cells_filter_grants(lf_client, catalog_id, database_name, table_name)
+    to_grant, to_revoke = plan_grants(desired_grants, existing_grants, in_scope)
+
+    logging.info('--- Grants on '+database_name+'.'+table_name+': '+str(len(to_grant))+' to grant, '+str(len(to_revoke))+' to revoke, '+str(len(existing_grants)-len(to_revoke))+' kept ---')
+
+    failures = apply_grants(lf_client.batch_revoke_permissions, catalog_id, database_name, table_name, to_revoke)
+    failures += apply_grants(lf_client.batch_grant_permissions, catalog_id, database_name, table_name, to_grant)
+
+    return failures
+
+
+def delete_data_cells_filter(lf_client, catalog_id, database_name, table_name, name):
+    logging.info('--- Deleting data cells filter '+name+' on '+database_name+'.'+table_name+' ---')
+    lf_client.delete_data_cells_filter(
+        TableCatalogId=catalog_id,
+        DatabaseName=database_name,
+        TableName=table_name,
+        Name=name
+    )
+
+
+def sweep_orphan_filters(lf_client, catalog_id, database_name, table_name, prefix, desired_names, max_deletes):
+    # deletes the filters with our prefix that no shared group needs any more, after
+    # revoking what is still granted on them. nothing is deleted when there are more
+    # than max_deletes of them, which would rather point at a broken org walk.
+    # returns (filters deleted, failures)
+    existing_filters = get_data_cells_filters(lf_client, catalog_id, database_name, table_name)
+    orphans = sorted(name for name in existing_filters if name.startswith(prefix) and name not in desired_names)
+    if not orphans:
+        return 0, 0
+
+    if len(orphans) > max_deletes:
+        logging.error('Found '+str(len(orphans))+' orphaned data cells filters on '+database_name+'.'+table_name+', more than orphan_filter_max_deletes ('+str(max_deletes)+'), not deleting any')
+        return 0, 0
+
+    logging.info('--- Found '+str(len(orphans))+' orphaned data cells filters on '+database_name+'.'+table_name+' ---')
+
+    orphan_names = set(orphans)
+    grants = sorted(grant for grant in get_data_cells_filter_grants(lf_client, catalog_id, database_name, table_name) if grant[0] in orphan_names)
+    failures = apply_grants(lf_client.batch_revoke_permissions, catalog_id, database_name, table_name, grants)
+
+    # filters that are still granted to someone are left for the next run
+    if failures:
+        still_granted = set(name for name, principal in get_data_cells_filter_grants(lf_client, catalog_id, database_name, table_name))
+        orphans = [name for name in orphans if name not in still_granted]
+
+    def delete_orphan(name):
+        delete_data_cells_filter(lf_client, catalog_id, database_name, table_name, name)
+
+    results, errors = run_concurrently(delete_orphan, orphans)
+    for name, error in errors:
+        logging.error('Failed to delete data cells filter '+name+' on '+database_name+'.'+table_name+': '+str(error))
+
+    return len(results), failures + len(errors)
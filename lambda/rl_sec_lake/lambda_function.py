@@ -5,21 +5,74 @@ import logging
 import os
 import boto3
 import json
-import pandas as pd
-import awswrangler as wr
+import collections
 
 from botocore.exceptions import ClientError
 
+from org_metadata import ORG_CACHE_TTL_HOURS, get_org_snapshot, refresh_org_subtrees, metadata_from_snapshot, load_org_snapshot, save_org_snapshot
+from iceberg_tables import flatten_record, upsert_iceberg_table, read_table_records, replace_iceberg_table
+from org_index import build_ou_index, build_tag_index, tag_group_key, subtree_ou_ids, changed_groups
+from row_filters import FILTER_EXPRESSION_MAX_LENGTH, build_row_filters, unshard_filter_name
+from org_events import is_org_change_event, apply_org_events
+import metrics
+from lf_executor import LF_MAX_CONCURRENCY, LF_CLIENT_CONFIG, AdaptiveClient, run_concurrently
+from checkpoint import (
+    STAGE_TABLES,
+    STAGE_FILTERS,
+    STAGE_GRANTS,
+    STAGE_CLEANUP,
+    MAX_RESUMES,
+    RunClock,
+    new_checkpoint,
+    load_checkpoint,
+    save_checkpoint,
+    clear_checkpoint,
+    take_lease,
+    is_checkpoint_active,
+    record_failure,
+    abandon_checkpoint,
+    hand_over,
+    replay_pending_events,
+)
+from table_maintenance import maintain_table
+from security_lake import table_patterns, regional_names, get_account_columns
+from fingerprint import compute_fingerprint, load_fingerprint, save_fingerprint, clear_fingerprint, is_unchanged
+from lake_formation import (
+    ACCOUNT_METADATA_FILTER_PREFIX,
+    SECURITY_LAKE_FILTER_PREFIX,
+    FILTER_NAME_VERSION,
+    group_filter_name,
+    get_data_cells_filters,
+    put_data_cells_filter,
+    reconcile_grants,
+    sweep_orphan_filters,
+)
+
 METADATA_DATABASE = os.environ['metadata_database']
 BUCKET = os.environ['metadata_bucket']
 CATALOG_ID = os.environ['account_id']
 SECURITY_LAKE_DB = os.environ['security_lake_db']
-SECURITY_LAKE_TABLE = os.environ['security_lake_table']
+# the Security Lake tables to share, by name or pattern, eg amazon_security_lake_table_us_east_1_*
+SECURITY_LAKE_TABLES = table_patterns(os.environ['security_lake_table'])
+# comma separated regions whose Security Lake is shared, the lambda's own region when
+# empty. other regions use their own database, eg amazon_security_lake_glue_db_eu_west_1
+SECURITY_LAKE_REGIONS = [region.strip() for region in os.environ.get('security_lake_regions', '').split(',') if region.strip()]
 ACCOUNT_METADATA_TABLE = 'aws_account_metadata'
 OU_TABLE = 'ou_groups'
 TAGS_TABLE = 'tags_groups'
 
-GROUP_BY_TAG = ''
+# comma separated tag keys to group accounts by, all tag keys when empty
+GROUP_BY_TAG = os.environ.get('group_by_tag', '')
+
+# shared groups whose data cells filters are put concurrently between checkpoints
+FILTER_BATCH_SIZE = 4*LF_MAX_CONCURRENCY
+
+# full runs delete data cells filters no shared group needs any more, unless there
+# are more than this many on a table. 0 turns the sweep off
+ORPHAN_FILTER_MAX_DELETES = int(os.environ.get('orphan_filter_max_deletes', '100'))
+
+# errors kept per region in the run's result, the rest are only counted and logged
+MAX_REGION_ERRORS = 10
 
 # set up logging for lambda
 if len(logging.getLogger().handlers) > 0:
@@ -32,348 +85,706 @@ else:
         datefmt='%Y-%m-%d %H:%M:%S'
     )
 
-# set up clients
-lf_client = boto3.client('lakeformation')
+# set up clients, the default session is instrumented first so every client made
+# from it, including the ones awswrangler uses, is counted in the run's metrics
+boto3.setup_default_session()
+metrics.instrument(boto3.DEFAULT_SESSION)
+# every Lake Formation call in a region goes through one adaptive concurrency limit
+lf_client = AdaptiveClient(boto3.client('lakeformation', config=LF_CLIENT_CONFIG))
 athena_client = boto3.client('athena')
+glue_client = boto3.client('glue')
 s3_client = boto3.client('s3')
+lambda_client = boto3.client('lambda')
 
-def get_account_metadata(session=None):
-    
-    # if we don't get a session, create one
-    if session is None:
-        session = boto3.Session()
-    
-    organizations = session.client('organizations')
-
-    # get org-id
-    response = organizations.describe_organization()
-    org_info = response.get("Organization")
-    
-    def get_org_root():
-        response = organizations.list_roots()
-        roots = response.get("Roots", None)
-    
-        if not roots:
-            return None
-    
-        return roots[0]
-    
-    def get_tags(id):
-        paginator = organizations.get_paginator("list_tags_for_resource")
-        responses = paginator.paginate(ResourceId=id)
-    
-        tags = {}
-        for response in responses:
-            for tag in response.get("Tags", []):
-                tags[tag["Key"]] = tag["Value"]
-    
-        return tags
-    
-    def get_child_orgunits(parent_id):
-        paginator = organizations.get_paginator("list_organizational_units_for_parent")
-        responses = paginator.paginate(ParentId=parent_id)
-    
-        orgunits = []
-        for response in responses:
-            orgunits += response.get("OrganizationalUnits", [])
-    
-        return orgunits
-        
-    def get_child_accounts(parent_id):
-        paginator = organizations.get_paginator("list_accounts_for_parent")
-        responses = paginator.paginate(ParentId=parent_id)
-    
-        accounts = []
-        for response in responses:
-            accounts += response.get("Accounts", [])
-    
-        return accounts
-    
-    accounts_list = {}
-    accounts_list['Accounts'] = []
-    
-    ou_list = []
-    
-    def walk_org(orgunit_id, depth):
-        child_accounts = get_child_accounts(orgunit_id)
-    
-        for account in child_accounts:
-            child_account_id = account["Id"]
-            tags = get_tags(child_account_id)
-            
-            # make sure all tag keys are lower case
-            tags = dict((k.lower(), v) for k,v in tags.items())
-
-            account_info = {}
-            account_info['id'] = child_account_id
-            account_info['name'] = account['Name']
-            account_info['org_id'] = org_info['Id']
-            account_info['ou'] = depth
-            account_info['ou_id'] = orgunit_id
-            account_info['tags'] = tags
-            logging.info("Found account: "+json.dumps(account_info))
-            accounts_list['Accounts'].append(account_info)
-    
-        child_orgunits = get_child_orgunits(orgunit_id)
-        for orgunit in child_orgunits:
-            child_orgunit_id = orgunit["Id"]
-    
-            # lookup orgunit details
-            response = organizations.describe_organizational_unit(OrganizationalUnitId=child_orgunit_id)
-            name = response["OrganizationalUnit"]["Name"]
-            tags = get_tags(child_orgunit_id)
-            
-            ou_list.append(depth+',OU='+name)
-            
-            walk_org(child_orgunit_id, depth+',OU='+name)
-
-              
-    org_root = get_org_root()
-    org_root_id = org_root.get("Id")
-    ou_list.append("OU=root")
-    walk_org(org_root_id, "OU=root")
-    
-    return accounts_list, ou_list
-
-def get_data_cells_filter_names(catalog_id, database_name, table_name):
-    paginator = lf_client.get_paginator("list_data_cells_filter")
-    responses = paginator.paginate(Table={
-        'CatalogId': catalog_id,
-        'DatabaseName': database_name,
-        'Name': table_name
-    })
-    
-    data_cells_filters_list = []
-    for response in responses:
-        for data_cells_filter in response['DataCellsFilters']:
-            data_cells_filters_list.append(data_cells_filter['Name'])
-        
-    return data_cells_filters_list
-    
-def create_metadata_table(database, table_name, df_table, bucket):
-    # check if table exists
-    if wr.catalog.does_table_exist(database=database, table=table_name):
-        # remove old account metadata
-        logging.info('--- Dropping '+table_name+' table ---')
-        wr.athena.read_sql_query(
-            sql=f'DROP TABLE `{table_name}`',
-            database=database,
-            ctas_approach=False,
-            unload_approach=False,
-        )
-    
-    # write table to S3
-    logging.info('--- Creating '+table_name+' table ---')
-    df_table = df_table.astype(str)
-    
-    wr.athena.to_iceberg(
-        df_table,
-        database=database,
-        table=table_name,
-        table_location='s3://'+bucket+'/'+table_name+'/',
-        temp_path='s3://'+bucket+'/'+table_name+'/temp/',
-        keep_files=False
-    )
+# the metadata tables live in this region, next to its Security Lake
+HOME_REGION = boto3.DEFAULT_SESSION.region_name
+SECURITY_LAKE_REGIONS = SECURITY_LAKE_REGIONS or [HOME_REGION]
+
+# Lake Formation and Glue clients of the other Security Lake regions
+regional_client_cache = {}
+
+def regional_clients(region):
+    # made on first use. making clients isn't thread safe so this is only called
+    # from the main thread
+    if region == HOME_REGION:
+        return {'lf': lf_client, 'glue': glue_client}
+
+    if region not in regional_client_cache:
+        regional_client_cache[region] = {
+            'lf': AdaptiveClient(boto3.client('lakeformation', region_name=region, config=LF_CLIENT_CONFIG)),
+            'glue': boto3.client('glue', region_name=region),
+        }
+
+    return regional_client_cache[region]
+
+
+def consumer_account_ids(value):
+    # values read back from the groups tables, one account id or a comma separated
+    # list of them. empty when the group isn't shared
+    value = str(value or '').strip()
+    if value.lower() in ('nan', 'none'):
+        return []
+
+    return sorted(set(account_id.strip() for account_id in value.split(',') if account_id.strip()))
+
+
+def consumer_account_id(value):
+    return ','.join(consumer_account_ids(value))
+
+
+def get_incremental_snapshot(event, snapshot):
+    # returns the stored snapshot with the event applied and the OU and tag groups
+    # it affects, or (None, None) when a full walk of the org is needed instead
+    if snapshot is None:
+        logging.info('--- No stored org snapshot found, walking the org ---')
+        return None, None
+
+    snapshot, affected_groups, requires_full_sync = apply_org_events(snapshot, [event])
+    if requires_full_sync:
+        logging.info('--- Unable to apply change to stored org snapshot, walking the org ---')
+        return None, None
+
+    logging.info('--- Groups affected by change: '+json.dumps(sorted(affected_groups))+' ---')
+    return snapshot, affected_groups
+
+
+def scope_values(scope, name):
+    # scope values can be given as a list or as a single string
+    values = scope.get(name) or []
+    if isinstance(values, str):
+        values = [values]
+
+    return set(str(value).strip() for value in values if str(value).strip())
+
+
+def get_scoped_snapshot(scope, max_age_hours=ORG_CACHE_TTL_HOURS):
+    # returns the snapshot with the OUs in scope walked again, the groups to apply and
+    # the consumers to limit grants to. only the stored snapshot is used when the
+    # scope is just consumers. (None, None, None) when nothing in the scope is known.
+    # OU names and tags read less than max_age_hours ago are kept
+    ou_paths = scope_values(scope, 'ou_paths')
+    ou_ids = scope_values(scope, 'ou_ids')
+    consumer_filter = set(consumer_account_ids(','.join(scope_values(scope, 'consumer_account_ids')))) or None
+
+    snapshot = load_org_snapshot(s3_client, BUCKET)
+    if snapshot is None:
+        logging.info('--- No stored org snapshot found, walking the org ---')
+        snapshot = get_org_snapshot()
+        previous = None
+    else:
+        previous = snapshot
+
+    if not ou_paths and not ou_ids:
+        if consumer_filter is None:
+            logging.error('Scoped resync needs ou_paths, ou_ids or consumer_account_ids')
+            return None, None, None
+        return snapshot, None, consumer_filter
+
+    ou_ids_by_path = dict((ou['path'], ou_id) for ou_id, ou in snapshot['ous'].items())
+    for path in sorted(ou_paths - set(ou_ids_by_path)):
+        logging.warning('OU '+path+' is not in the org snapshot, it is picked up by the next full sync')
+    for ou_id in sorted(ou_ids - set(snapshot['ous'])):
+        logging.warning('OU '+ou_id+' is not in the org snapshot, it is picked up by the next full sync')
+
+    scoped_ou_ids = set(ou_ids_by_path[path] for path in ou_paths if path in ou_ids_by_path)
+    scoped_ou_ids.update(ou_id for ou_id in ou_ids if ou_id in snapshot['ous'])
+    if not scoped_ou_ids:
+        return None, None, None
+
+    if previous is not None:
+        snapshot = refresh_org_subtrees(previous, scoped_ou_ids, None, max_age_hours)
+
+    # the OUs in scope and below them, as well as every group the walk changed
+    group_filter = set(snapshot['ous'][ou_id]['path'] for ou_id in subtree_ou_ids(snapshot, scoped_ou_ids))
+    if previous is not None:
+        group_filter.update(changed_groups(previous, snapshot, tag_group_keys()))
+
+    return snapshot, group_filter, consumer_filter
+
+
+def defer_to_full_sync(event):
+    # invocations don't overlap, but a full sync hands over from one invocation to
+    # the next and would write back the org as it was before this change. while one
+    # is in progress the change is kept with it and replayed once it has finished
+    checkpoint = load_checkpoint(s3_client, BUCKET, 'full')
+    if checkpoint is None or checkpoint.get('error'):
+        # a failed full sync starts over from a new walk of the org
+        return False
+
+    checkpoint['pending_events'].append(event)
+    save_checkpoint(s3_client, BUCKET, checkpoint)
+    logging.info('--- Full sync run '+checkpoint['run_id']+' is in progress, applying this change once it has finished ---')
+    return True
+
+
+def run_maintenance(run_metrics):
+    # compacts the metadata tables and expires their old snapshots. Iceberg commits
+    # would conflict with a full sync writing the same tables, so it waits for one
+    checkpoint = load_checkpoint(s3_client, BUCKET, 'full')
+    if checkpoint is not None and is_checkpoint_active(checkpoint):
+        logging.info('--- Full sync run '+checkpoint['run_id']+' is in progress, skipping table maintenance ---')
+        return
+
+    def maintain(table_name):
+        return maintain_table(s3_client, glue_client, METADATA_DATABASE, table_name, BUCKET)
+
+    with metrics.phase('TableMaintenance'):
+        results, errors = run_concurrently(maintain, [ACCOUNT_METADATA_TABLE, OU_TABLE, TAGS_TABLE])
+
+    for table_name, result in results:
+        if result is None:
+            continue
+
+        metrics.add_total('TableFilesBefore', result['before']['files'])
+        metrics.add_total('TableFilesAfter', result['after']['files'])
+        metrics.add_total('TableBytesBefore', result['before']['bytes'], 'Bytes')
+        metrics.add_total('TableBytesAfter', result['after']['bytes'], 'Bytes')
+
+    run_metrics.properties['TableMaintenance'] = dict((table_name, result) for table_name, result in results)
+    for table_name, error in errors:
+        logging.error('Maintenance of '+table_name+' table failed: '+str(error))
+        metrics.add_total('TableMaintenanceFailures')
 
-    # write metadata to Iceberg table
-    logging.info('--- Creating grant for '+table_name+' table ---')
 
-    
 def lambda_handler(event, context):
+    run_metrics = metrics.start_run()
+    run_metrics.dimensions['RunKind'] = 'none'
+    try:
+        handle_event(event, context, run_metrics)
+    finally:
+        # one EMF record per invocation, also when it handed over or failed
+        run_metrics.emit()
+
+
+def handle_event(event, context, run_metrics):
+    clock = RunClock(context)
+
+    # {"force_refresh": true} applies everything even when nothing has changed, and
+    # reads every tag and OU name again rather than taking them from the last snapshot
+    force_refresh = isinstance(event, dict) and bool(event.get('force_refresh'))
+    cache_ttl_hours = 0 if force_refresh else ORG_CACHE_TTL_HOURS
+
+    if isinstance(event, dict) and event.get('maintenance'):
+        # sent by its own schedule, nothing is synced
+        run_metrics.dimensions['RunKind'] = 'maintenance'
+        run_maintenance(run_metrics)
+        return
+
+    checkpoint = None
+    if isinstance(event, dict) and 'resume' in event:
+        # handed over by an invocation that ran out of time
+        resume = event['resume']
+        checkpoint = load_checkpoint(s3_client, BUCKET, resume.get('kind', 'full'), resume.get('run_id'))
+        if checkpoint is None or checkpoint['run_id'] != resume.get('run_id'):
+            logging.info('--- Run '+str(resume.get('run_id'))+' has finished or been superseded, nothing to resume ---')
+            return
+
+        if checkpoint.get('error'):
+            # lambda retrying an invocation that failed, the full sync below starts over
+            checkpoint = None
+        else:
+            logging.info('--- Resuming run '+checkpoint['run_id']+' at '+checkpoint['stage']+' stage ---')
+
+    elif (is_org_change_event(event) or isinstance(event, dict) and isinstance(event.get('scope'), dict)) and defer_to_full_sync(event):
+        return
+
+    elif isinstance(event, dict) and isinstance(event.get('scope'), dict):
+        logging.info('--- Resyncing '+json.dumps(event['scope'], sort_keys=True)+' ---')
+        with metrics.phase('OrgWalk'):
+            snapshot, group_filter, consumer_filter = get_scoped_snapshot(event['scope'], cache_ttl_hours)
+        if snapshot is None:
+            return
+
+        if group_filter is not None:
+            logging.info('--- Groups in scope: '+json.dumps(sorted(group_filter))+' ---')
+        checkpoint = new_checkpoint('scoped', snapshot, group_filter, consumer_filter)
+
+        # only part of Lake Formation is applied, so the next full run applies everything again
+        clear_fingerprint(s3_client, BUCKET)
+
+    elif is_org_change_event(event):
+        logging.info('--- Applying '+str(event['detail'].get('eventName'))+' to stored org snapshot ---')
+        with metrics.phase('OrgEvent'):
+            stored = load_org_snapshot(s3_client, BUCKET)
+            snapshot, group_filter = get_incremental_snapshot(event, stored)
+
+        if snapshot is not None and not group_filter and snapshot == stored:
+            # eg tags put on an OU, a policy or the root. Lake Formation is still as
+            # the last run left it, so the fingerprint is kept as well
+            logging.info('--- Change does not affect any account or group, nothing to apply ---')
+            run_metrics.dimensions['RunKind'] = 'event'
+            run_metrics.properties['Skipped'] = True
+            return
+
+        if snapshot is not None:
+            checkpoint = new_checkpoint('event', snapshot, group_filter)
+
+            # the stored fingerprint only vouches for Lake Formation as the last full
+            # run left it, so the next full run applies everything again
+            clear_fingerprint(s3_client, BUCKET)
+
+    if checkpoint is None:
+        checkpoint = load_checkpoint(s3_client, BUCKET, 'full')
+        if checkpoint is not None and is_checkpoint_active(checkpoint):
+            logging.info('--- Full sync run '+checkpoint['run_id']+' is still in progress, skipping ---')
+            return
+
+        # the run that is started over, its changes are applied by the new one
+        abandoned = None
+        pending_events = []
+        if checkpoint is not None and checkpoint.get('error'):
+            logging.error('Full sync run '+checkpoint['run_id']+' failed in its last invocation, starting over: '+checkpoint['error'])
+            abandoned = checkpoint
+            pending_events = checkpoint['pending_events']
+            checkpoint = None
+
+        elif checkpoint is not None and checkpoint['resumes'] >= MAX_RESUMES:
+            logging.error('Full sync run '+checkpoint['run_id']+' did not finish after '+str(checkpoint['resumes'])+' invocations, starting over')
+            abandoned = checkpoint
+            pending_events = checkpoint['pending_events']
+            checkpoint = None
+
+        if checkpoint is not None:
+            # a run that was killed before it could hand over carries on from its last save
+            logging.info('--- Picking up unfinished full sync run '+checkpoint['run_id']+' at '+checkpoint['stage']+' stage ---')
+            checkpoint['resumes'] += 1
+        else:
+            logging.info('--- Getting Metadata ---')
+            with metrics.phase('OrgWalk'):
+                snapshot = get_org_snapshot(None, load_org_snapshot(s3_client, BUCKET), cache_ttl_hours)
+
+            # a new Security Lake table matching the patterns makes the run apply again
+            region_results = {}
+            with metrics.phase('Fingerprint'):
+                account_columns = security_lake_account_columns(region_results)
+                fingerprint = compute_fingerprint(snapshot, group_mappings(snapshot), run_settings(account_columns))
+
+            if force_refresh:
+                logging.info('--- Forced refresh, applying everything ---')
+            elif is_unchanged(load_fingerprint(s3_client, BUCKET), fingerprint):
+                logging.info('--- Org and group mappings are unchanged since the last apply, skipping run ---')
+                run_metrics.dimensions['RunKind'] = 'full'
+                run_metrics.properties['Skipped'] = True
+
+                # the org is as the last run applied it, only the times tags were read
+                # have moved on, so the next walk can keep reusing them
+                save_org_snapshot(s3_client, BUCKET, snapshot)
+
+                # nor is there a new run to apply the changes the abandoned one held
+                if abandoned is not None:
+                    abandon_checkpoint(s3_client, lambda_client, BUCKET, abandoned, context)
+                return
+
+            checkpoint = new_checkpoint('full', snapshot, None)
+            checkpoint['account_columns'] = account_columns
+            checkpoint['region_results'] = region_results
+            checkpoint['fingerprint'] = fingerprint
+            checkpoint['pending_events'] = pending_events
+
+    run_metrics.dimensions['RunKind'] = checkpoint['kind']
+    run_metrics.properties.update({'RunId': checkpoint['run_id'], 'Resumes': checkpoint['resumes'], 'Completed': False})
+
+    try:
+        completed = sync_org(checkpoint, clock, context)
+    except Exception as e:
+        record_failure(s3_client, BUCKET, checkpoint, e)
+        raise
+    run_metrics.properties['Regions'] = checkpoint['region_results']
+    if not completed:
+        return
+
+    run_metrics.properties['Completed'] = True
+    for region, result in sorted(checkpoint['region_results'].items()):
+        logging.info('--- '+region+': '+str(result['tables'])+' Security Lake tables, '+str(result['failures'])+' failures ---')
+
+    # only keep the snapshot once it has been applied, a failed run will be
+    # picked up again by the next full walk
+    save_org_snapshot(s3_client, BUCKET, checkpoint['snapshot'])
+
+    # the fingerprint vouches for Lake Formation being fully applied, so a run where
+    # anything failed leaves none behind and the next full run applies everything again
+    failures = sum(result['failures'] for result in checkpoint['region_results'].values())
+    if failures:
+        clear_fingerprint(s3_client, BUCKET)
+    elif checkpoint.get('fingerprint'):
+        save_fingerprint(s3_client, BUCKET, checkpoint['fingerprint'], checkpoint['run_id'])
+    replay_pending_events(lambda_client, checkpoint, context)
+    clear_checkpoint(s3_client, BUCKET, checkpoint)
+
+    logging.info('--- Run '+checkpoint['run_id']+' finished after '+str(checkpoint['resumes']+1)+' invocations ---')
+
+
+def region_result(region_results, region):
+    return region_results.setdefault(region, {'tables': 0, 'failures': 0, 'errors': []})
+
+
+def region_error(region_results, region, message, failures=1):
+    # every region gets its own result, a failure in one doesn't stop the others
+    logging.error(message)
+    result = region_result(region_results, region)
+    result['failures'] += failures
+    if len(result['errors']) < MAX_REGION_ERRORS:
+        result['errors'].append(message)
+
+
+def security_lake_account_columns(region_results):
+    # {region: {table name: account column}} for the Security Lake tables that are
+    # shared, read from Glue before anything is written. a region whose tables can't
+    # be read is left out of the run, which only fails when none of them can
+    clients = dict((region, regional_clients(region)) for region in SECURITY_LAKE_REGIONS)
+
+    def read_region(region):
+        database, patterns = regional_names(SECURITY_LAKE_DB, SECURITY_LAKE_TABLES, HOME_REGION, region)
+        return get_account_columns(clients[region]['glue'], database, patterns)
+
+    results, errors = run_concurrently(read_region, SECURITY_LAKE_REGIONS)
+    for region, error in errors:
+        region_error(region_results, region, 'Unable to read the Security Lake tables in '+region+', skipping the region: '+str(error))
+    if not results:
+        raise errors[0][1]
+
+    account_columns = {}
+    for region, columns in results:
+        for table_name in sorted(columns):
+            logging.info('--- Filtering '+table_name+' in '+region+' on '+columns[table_name]+' ---')
+        account_columns[region] = columns
+
+    return account_columns
+
+
+def run_settings(account_columns):
+    # configuration that changes what a run applies even when the org doesn't
+    return {
+        'metadata_database': METADATA_DATABASE,
+        'security_lake': {'database': SECURITY_LAKE_DB, 'account_columns': account_columns},
+        'group_by_tag': sorted(tag_group_keys()),
+        'filter_expression_max_length': FILTER_EXPRESSION_MAX_LENGTH,
+        'filter_name_version': FILTER_NAME_VERSION,
+    }
+
+
+def group_mappings(snapshot):
+    # the consumers of the groups in the snapshot, as sync_tables will share them
+    # once it has merged the groups tables. groups that aren't shared are left out
+    ou_paths = set(ou['path'] for ou in snapshot['ous'].values())
+    tag_index = build_tag_index(snapshot, tag_group_keys())
+
+    mappings = {}
+    for row in read_table_records(glue_client, METADATA_DATABASE, OU_TABLE) or []:
+        consumers = consumer_account_ids(row.get('consumer_aws_account_id'))
+        if consumers and str(row.get('ou', '')) in ou_paths:
+            mappings[str(row.get('ou', ''))] = consumers
+
+    for row in read_table_records(glue_client, METADATA_DATABASE, TAGS_TABLE) or []:
+        key, value = str(row.get('tag_key', '')), str(row.get('tag_value', ''))
+        consumers = consumer_account_ids(row.get('consumer_aws_account_id'))
+        if consumers and value in tag_index.get(key, {}):
+            mappings[tag_group_key(key, value)] = consumers
+
+    return mappings
+
+
+def keep_going(checkpoint, clock, context):
+    # called after every unit of work. saves progress from time to time and hands
+    # the run over to a new invocation when this one is running out of time
+    if clock.running_out():
+        hand_over(s3_client, lambda_client, BUCKET, checkpoint, context)
+        return False
+
+    if clock.save_due():
+        take_lease(checkpoint)
+        save_checkpoint(s3_client, BUCKET, checkpoint)
+        clock.saved()
+
+    return True
+
+
+def tag_group_keys():
+    return set(key.strip().lower() for key in GROUP_BY_TAG.split(',') if key.strip())
+
+
+def sync_groups_table(table_name, groups, key_columns):
+    # merges the consumer mappings already in the table into groups, so new groups
+    # can be added without losing them, and rewrites the table only when it changed
+    def group_key(row):
+        return tuple(str(row.get(column, '')) for column in key_columns)
+
+    existing_groups = read_table_records(glue_client, METADATA_DATABASE, table_name)
+    if existing_groups is not None:
+        logging.info('--- Found existing '+table_name+' table ---')
+        logging.info('--- Mapping existing account ids to groups ---')
+        consumers = dict((group_key(row), consumer_account_id(row.get('consumer_aws_account_id'))) for row in existing_groups)
+        for group in groups:
+            group['consumer_aws_account_id'] = consumers.get(group_key(group), '')
+
+    # the table is only rewritten when groups have been added or removed
+    if not groups:
+        logging.info('--- No groups for '+table_name+' table, skipping write ---')
+    elif existing_groups is None or sorted(consumers.items()) != sorted((group_key(group), group['consumer_aws_account_id']) for group in groups):
+        replace_iceberg_table(s3_client, glue_client, METADATA_DATABASE, table_name, groups, BUCKET)
+    else:
+        logging.info('--- '+table_name+' table is unchanged, skipping write ---')
+
+
+def sync_tables(snapshot, group_filter):
+    # writes the metadata tables and returns the groups that are shared in this run
+
+    with metrics.phase('MetadataWrite'):
+        account_metadata, ou_metadata = metadata_from_snapshot(snapshot)
+
+        # upsert metadata iceberg table, only rows that changed since the last run are written
+        account_records = [flatten_record(account) for account in account_metadata['Accounts']]
+        upsert_iceberg_table(s3_client, glue_client, METADATA_DATABASE, ACCOUNT_METADATA_TABLE, account_records, BUCKET)
+
+    with metrics.phase('GroupsMerge'):
+        ou_groups = [{'ou': ou, 'consumer_aws_account_id': ''} for ou in ou_metadata]
+        sync_groups_table(OU_TABLE, ou_groups, ['ou'])
+
+        # a tag group for every value of the tag keys we group by
+        tag_index = build_tag_index(snapshot, tag_group_keys())
+        tag_groups = [
+            {'tag_key': key, 'tag_value': value, 'consumer_aws_account_id': ''}
+            for key in sorted(tag_index) for value in sorted(tag_index[key])
+        ]
+        sync_groups_table(TAGS_TABLE, tag_groups, ['tag_key', 'tag_value'])
+
+    metrics.set_total('Accounts', len(account_records))
+    metrics.set_total('OUs', len(ou_groups))
+    metrics.set_total('TagGroups', len(tag_groups))
+
+    # both kinds of group are shared the same way, keyed by OU path or tag group key
+    groups = [{'group': group['ou'], 'consumers': consumer_account_ids(group['consumer_aws_account_id'])} for group in ou_groups]
+    groups += [{'group': tag_group_key(group['tag_key'], group['tag_value']), 'tag_key': group['tag_key'], 'tag_value': group['tag_value'], 'consumers': consumer_account_ids(group['consumer_aws_account_id'])} for group in tag_groups]
 
-    logging.info('--- Getting Metadata ---')
-    account_metadata, ou_metadata = get_account_metadata()
-    df_account_metadata = pd.json_normalize(account_metadata['Accounts'])
-
-    df_ou_metadata = pd.DataFrame({'ou':ou_metadata})
-    df_ou_metadata['consumer_aws_account_id'] = ''          
-    
-    # write metadata iceberg table (static)
-    create_metadata_table(METADATA_DATABASE, ACCOUNT_METADATA_TABLE, df_account_metadata, BUCKET)
-    
-    # check if OU table exists and merge existing consumer_aws_account_id to ou_id mappings
-    # this allows us to add new OUs without having to update the whole table
-    if wr.catalog.does_table_exist(database=METADATA_DATABASE, table=OU_TABLE):
-        # get the table
-        df_existing_table = wr.athena.read_sql_query(
-            sql=f'SELECT * FROM "{OU_TABLE}"',
-            database=METADATA_DATABASE,
-            ctas_approach=False,
-            unload_approach=False,
-        )
-        
-        logging.info('--- Found existing OU grouping table ---') 
-        logging.debug(df_existing_table)
-        
-        logging.info('--- Mapping existing account ids to OU groups ---')
-        df_new_table = pd.merge(df_ou_metadata, df_existing_table, left_on='ou', right_on='ou', how='left').drop('consumer_aws_account_id_x', axis=1)
-        df_ou_metadata = df_new_table.rename(columns={'consumer_aws_account_id_y': 'consumer_aws_account_id'})
-                
-        logging.debug("new table:")
-        logging.debug(df_ou_metadata)
-        
-        
-        ## drop existing table
-        logging.info('--- Dropping old table ---')
-        wr.athena.read_sql_query(
-            sql=f'DROP TABLE `{OU_TABLE}`',
-            database=METADATA_DATABASE,
-            ctas_approach=False,
-            unload_approach=False,
-        )
-    
-    
-        response = s3_client.list_objects_v2(Bucket=BUCKET, Prefix=OU_TABLE+'/')
-        logging.info('--- Removing '+OU_TABLE+' table metadata ---')
-        for object in response['Contents']:
-            logging.debug('Deleting', object['Key'])
-            s3_client.delete_object(Bucket=BUCKET, Key=object['Key'])
-        
-    # write table to S3
-    logging.info('--- Creating new '+OU_TABLE+' Iceberg table ---')
-    logging.debug(df_ou_metadata)
-    
-    wr.athena.to_iceberg(
-        df_ou_metadata,
-        database=METADATA_DATABASE,
-        table=OU_TABLE,
-        table_location='s3://'+BUCKET+'/'+OU_TABLE+'/',
-        temp_path='s3://'+BUCKET+'/'+OU_TABLE+'/temp/',
-    )
-    
     # only set up sharing if we have groups to share to
-    df_ou_metadata = df_ou_metadata.replace(r'^s*$', float('NaN'), regex = True)
-    df_ou_metadata = df_ou_metadata.dropna()
-    if not df_ou_metadata.empty:
-    
-        # get all data cells filters for the account_metadata table
-        data_cells_filters_account_metadata = get_data_cells_filter_names(CATALOG_ID, METADATA_DATABASE, ACCOUNT_METADATA_TABLE)
-        
-        # get data cells filters for SL table
-        data_cells_filters_security_lake = get_data_cells_filter_names(CATALOG_ID, SECURITY_LAKE_DB, SECURITY_LAKE_TABLE)
-        
-        # build the SQL for data filters
-        for index, row in df_ou_metadata.iterrows():
-            data_filter = ""
-            df_accounts_in_group = df_account_metadata.query('ou.str.contains("'+row['ou']+'")', engine='python')
-            for account_index, account_row in df_accounts_in_group.iterrows():
-                data_filter = data_filter+"id='"+str(account_row['id'])+"' OR "
-        
-            data_filter = data_filter.rstrip(" OR ") 
-            
-            # if the data cells filter already exists we can just update the filter
-            if 'account_metadata_filter_'+str(row['ou']).replace(',','_').replace('=','_') in data_cells_filters_account_metadata:
-                logging.info('--- Updating existing data cells filter for '+row['ou']+' = '+str(row['consumer_aws_account_id'])+' ---')
-                response = lf_client.update_data_cells_filter(
-                    TableData={
-                        'TableCatalogId': CATALOG_ID,
-                        'DatabaseName': METADATA_DATABASE,
-                        'TableName': ACCOUNT_METADATA_TABLE,
-                        'Name': 'account_metadata_filter_'+str(row['ou']).replace(',','_').replace('=','_'),
-                        'RowFilter': {
-                            'FilterExpression': data_filter
-                        },
-                        'ColumnWildcard': {}
-                    }
-                )
-            
-            else:
-                logging.info('--- Creating data cells filter for '+row['ou']+' = '+str(row['consumer_aws_account_id'])+' ---')
-                response = lf_client.create_data_cells_filter(
-                    TableData={
-                        'TableCatalogId': CATALOG_ID,
-                        'DatabaseName': METADATA_DATABASE,
-                        'TableName': ACCOUNT_METADATA_TABLE,
-                        'Name': 'account_metadata_filter_'+str(row['ou']).replace(',','_').replace('=','_'),
-                        'RowFilter': {
-                            'FilterExpression': data_filter
-                        },
-                        'ColumnWildcard': {}
-                    }
-                )
-            
-            # create cross-account grants for account_metadata
-            logging.info('--- Creating grant for account_metadata table to account '+str(row['consumer_aws_account_id'])+' ---')
-            response = lf_client.batch_grant_permissions(
-                CatalogId=CATALOG_ID,
-                Entries=[
-                    {
-                        'Id': 'account-share-'+str(row['consumer_aws_account_id']),
-                        'Principal': {
-                            'DataLakePrincipalIdentifier': str(row['consumer_aws_account_id'])
-                        },
-                        'Resource': {
-                            'DataCellsFilter': {
-                                'TableCatalogId': CATALOG_ID,
-                                'DatabaseName': METADATA_DATABASE,
-                                'TableName': ACCOUNT_METADATA_TABLE,
-                                'Name': 'account_metadata_filter_'+str(row['ou']).replace(',','_').replace('=','_')
-                            }
-                        },
-                        'Permissions': [
-                            'SELECT',
-                        ],
-                        'PermissionsWithGrantOption': [
-                            'SELECT',
-                        ]
-                    },
-                ]
-            )
-            
-            if 'security_lake_filter_'+str(row['ou']).replace(',','_').replace('=','_') in data_cells_filters_security_lake:
-                logging.info('--- Updating existing data cells filter for SL '+row['ou']+' = '+str(row['consumer_aws_account_id'])+' ---')
-                response = lf_client.update_data_cells_filter(
-                    TableData={
-                        'TableCatalogId': CATALOG_ID,
-                        'DatabaseName': SECURITY_LAKE_DB,
-                        'TableName': SECURITY_LAKE_TABLE,
-                        'Name': 'security_lake_filter_'+str(row['ou']).replace(',','_').replace('=','_'),
-                        'RowFilter': {
-                            'FilterExpression': data_filter.replace('id','accountid')
-                        },
-                        'ColumnWildcard': {}
-                    }
-                )
-            else:
-                logging.info('--- Creating data cells filter for SL '+row['ou']+' = '+str(row['consumer_aws_account_id'])+' ---')
-                response = lf_client.create_data_cells_filter(
-                    TableData={
-                        'TableCatalogId': CATALOG_ID,
-                        'DatabaseName': SECURITY_LAKE_DB,
-                        'TableName': SECURITY_LAKE_TABLE,
-                        'Name': 'security_lake_filter_'+str(row['ou']).replace(',','_').replace('=','_'),
-                        'RowFilter': {
-                            'FilterExpression': data_filter.replace('id','accountid')
-                        },
-                        'ColumnWildcard': {}
-                    }
-                )
-            
-            # create cross-account grants for account_metadata
-            logging.info('--- Creating grant for SL table to account '+str(row['consumer_aws_account_id'])+' ---')
-            response = lf_client.batch_grant_permissions(
-                CatalogId=CATALOG_ID,
-                Entries=[
-                    {
-                        'Id': 'account-share-'+str(row['consumer_aws_account_id']),
-                        'Principal': {
-                            'DataLakePrincipalIdentifier': str(row['consumer_aws_account_id'])
-                        },
-                        'Resource': {
-                            'DataCellsFilter': {
-                                'TableCatalogId': CATALOG_ID,
-                                'DatabaseName': SECURITY_LAKE_DB,
-                                'TableName': SECURITY_LAKE_TABLE,
-                                'Name': 'security_lake_filter_'+str(row['ou']).replace(',','_').replace('=','_'),
-                            }
-                        },
-                        'Permissions': [
-                            'SELECT',
-                        ],
-                        'PermissionsWithGrantOption': [
-                            'SELECT',
-                        ]
-                    },
-                ]
-            )
-    
+    return [
+        group for group in groups
+        if group['consumers'] and (group_filter is None or group['group'] in group_filter)
+    ]
+
+
+def sync_org(checkpoint, clock, context):
+    # runs the remaining stages of the run in the checkpoint. returns False when
+    # the run was handed over to another invocation before it finished
+    snapshot = checkpoint['snapshot']
+
+    # group_filter limits Lake Formation changes to the given groups and
+    # consumer_filter to grants to the given accounts, None means all
+    group_filter = None if checkpoint['group_filter'] is None else set(checkpoint['group_filter'])
+    consumer_filter = None if checkpoint['consumer_filter'] is None else set(checkpoint['consumer_filter'])
+
+    # the Security Lake tables and their schemas are read once per run, full runs
+    # have already read them for the fingerprint
+    region_results = checkpoint['region_results']
+    if not checkpoint['account_columns']:
+        checkpoint['account_columns'] = security_lake_account_columns(region_results)
+    account_columns = checkpoint['account_columns']
+    metrics.set_total('SecurityLakeRegions', len(account_columns))
+    metrics.set_total('SecurityLakeTables', sum(len(columns) for columns in account_columns.values()))
+
+    if checkpoint['stage'] == STAGE_TABLES:
+        checkpoint['shared_groups'] = sync_tables(snapshot, group_filter)
+        if consumer_filter is not None:
+            checkpoint['shared_groups'] = [group for group in checkpoint['shared_groups'] if consumer_filter.intersection(group['consumers'])]
+        checkpoint['next_group'] = 0
+        checkpoint['stage'] = STAGE_FILTERS
+        if not keep_going(checkpoint, clock, context):
+            return False
+
+    shared_groups = checkpoint['shared_groups']
+    metrics.set_total('SharedGroups', len(shared_groups))
+
+    def target_name(target):
+        return target['database']+'.'+target['table']+' in '+target['region']
+
+    # tables that get a data cells filter per group, the column holding the account id
+    # and the Lake Formation client of their region. every Security Lake table in every
+    # region is a target of its own, all planned from the same snapshot
+    filter_targets = [
+        {'region': HOME_REGION, 'lf': lf_client, 'database': METADATA_DATABASE, 'table': ACCOUNT_METADATA_TABLE, 'prefix': ACCOUNT_METADATA_FILTER_PREFIX, 'column': 'id', 'grants': {}},
+    ]
+    for region in sorted(account_columns):
+        database, patterns = regional_names(SECURITY_LAKE_DB, SECURITY_LAKE_TABLES, HOME_REGION, region)
+        region_result(region_results, region)['tables'] = len(account_columns[region])
+        filter_targets += [
+            {'region': region, 'lf': regional_clients(region)['lf'], 'database': database, 'table': table_name, 'prefix': SECURITY_LAKE_FILTER_PREFIX, 'column': account_columns[region][table_name], 'grants': {}}
+            for table_name in sorted(account_columns[region])
+        ]
+
+    def skip_failed_regions(targets):
+        # Security Lake tables of regions whose filters couldn't be listed are left
+        # out of the rest of the run, the metadata table is always kept
+        return [target for target in targets if target['table'] == ACCOUNT_METADATA_TABLE or target['region'] not in checkpoint['regions_failed']]
+
+    filter_targets = skip_failed_regions(filter_targets)
+
+    # regions have their own Lake Formation limits, so each gets its own share of workers
+    max_workers = LF_MAX_CONCURRENCY*len(set(target['region'] for target in filter_targets))
+
+    # accounts in every OU including the OUs below it, and accounts by tag value
+    with metrics.phase('FilterPlanning'):
+        ou_index = build_ou_index(snapshot)
+        tag_index = build_tag_index(snapshot, tag_group_keys())
+
+    def group_accounts(group):
+        if 'tag_key' in group:
+            return tag_index.get(group['tag_key'], {}).get(group['tag_value'], set())
+
+        return ou_index.get(group['group'], set())
+
+    # the SQL for data filters, large groups are sharded over several filters. tables
+    # filtered on the same column share the same filters, so they're built once
+    row_filters_cache = {}
+
+    def group_row_filters(target, group):
+        key = (target['prefix'], target['column'], group['group'])
+        if key not in row_filters_cache:
+            row_filters_cache[key] = build_row_filters(group_filter_name(target['prefix'], group['group']), target['column'], group_accounts(group))
+
+        return row_filters_cache[key]
+
+    if checkpoint['stage'] == STAGE_FILTERS:
+        if checkpoint['next_group'] < len(shared_groups):
+
+            # get all data cells filters for each table
+            def list_target_filters(target):
+                target['filters'] = get_data_cells_filters(target['lf'], CATALOG_ID, target['database'], target['table'])
+
+            with metrics.phase('FilterPlanning'):
+                results, errors = run_concurrently(list_target_filters, filter_targets, max_workers)
+
+            # a region that can't be read, eg without the Lake Formation admin grant there,
+            # doesn't stop the others. nothing can be applied without the metadata table
+            for target, error in errors:
+                if target['table'] == ACCOUNT_METADATA_TABLE:
+                    raise error
+
+                region_error(region_results, target['region'], 'Unable to list the data cells filters on '+target_name(target)+', skipping the region: '+str(error))
+                if target['region'] not in checkpoint['regions_failed']:
+                    checkpoint['regions_failed'].append(target['region'])
+            filter_targets = skip_failed_regions(filter_targets)
+
+            filter_changes = collections.Counter()
+            filter_errors = []
+
+            def log_filter_changes():
+                logging.info('--- Data cells filters: '+str(filter_changes['created'])+' created, '+str(filter_changes['updated'])+' updated, '+str(filter_changes['unchanged'])+' unchanged, '+str(len(filter_errors))+' failed ---')
+                metrics.set_total('FiltersCreated', filter_changes['created'])
+                metrics.set_total('FiltersUpdated', filter_changes['updated'])
+                metrics.set_total('FiltersUnchanged', filter_changes['unchanged'])
+                metrics.set_total('FilterFailures', len(filter_errors))
+
+            # only create or update the data cells filters that have changed
+            def put_group_filters(item):
+                group, target, row_filters = item
+                if len(row_filters) > 1:
+                    logging.info('--- Sharding '+group['group']+' over '+str(len(row_filters))+' data cells filters on '+target['table']+' ---')
+
+                changes = collections.Counter()
+                for name, expression in row_filters:
+                    changes[put_data_cells_filter(
+                        target['lf'],
+                        target['filters'],
+                        CATALOG_ID,
+                        target['database'],
+                        target['table'],
+                        name,
+                        expression
+                    )] += 1
+
+                return changes
+
+            # groups are worked through a batch at a time, with the filters for every
+            # group and table in the batch put concurrently. groups done by an earlier
+            # invocation are skipped
+            while checkpoint['next_group'] < len(shared_groups):
+                batch = shared_groups[checkpoint['next_group']:checkpoint['next_group']+FILTER_BATCH_SIZE]
+
+                with metrics.phase('FilterPlanning'):
+                    items = [(group, target, group_row_filters(target, group)) for group in batch for target in filter_targets]
+
+                with metrics.phase('LakeFormationApply'):
+                    results, errors = run_concurrently(put_group_filters, items, max_workers)
+
+                for item, changes in results:
+                    filter_changes.update(changes)
+                for (group, target, row_filters), error in errors:
+                    region_error(region_results, target['region'], 'Failed to put data cells filters for '+group['group']+' on '+target_name(target)+': '+str(error))
+                    filter_errors.append(group['group'])
+
+                checkpoint['next_group'] += len(batch)
+                if not keep_going(checkpoint, clock, context):
+                    log_filter_changes()
+                    return False
+
+            log_filter_changes()
+
+        checkpoint['stage'] = STAGE_GRANTS
+        if not keep_going(checkpoint, clock, context):
+            return False
+
+    # grant missing shares and revoke shares from consumers that are no longer
+    # mapped to a group. only groups covered by this run are considered. grants
+    # are sorted by filter, so a filter's consumers go out in the same batch
+    with metrics.phase('FilterPlanning'):
+        for group in shared_groups:
+            for target in filter_targets:
+                for name, expression in group_row_filters(target, group):
+                    target['grants'].setdefault(name, set()).update(consumer for consumer in group['consumers'] if consumer_filter is None or consumer in consumer_filter)
+
+    metrics.set_total('DataCellsFilters', sum(len(target['grants']) for target in filter_targets))
+
+    def in_scope(prefix):
+        names = None if group_filter is None else set(group_filter_name(prefix, group) for group in group_filter)
+
+        def filter_in_scope(name, principal):
+            if consumer_filter is not None and principal not in consumer_filter:
+                return False
+            if names is None:
+                return name.startswith(prefix)
+            return unshard_filter_name(name) in names
+
+        return filter_in_scope
+
+    # the tables are independent of each other so their grants are reconciled concurrently
+    def reconcile_target_grants(target):
+        return reconcile_grants(target['lf'], CATALOG_ID, target['database'], target['table'], target['grants'], in_scope(target['prefix']))
+
+    if checkpoint['stage'] == STAGE_GRANTS:
+        with metrics.phase('LakeFormationApply'):
+            results, errors = run_concurrently(reconcile_target_grants, [target for target in filter_targets if target_name(target) not in checkpoint['targets_done']], max_workers)
+
+        for target, failures in results:
+            checkpoint['targets_done'].append(target_name(target))
+            metrics.add_total('GrantFailures', failures)
+            if failures:
+                region_error(region_results, target['region'], str(failures)+' grants or revokes failed on '+target_name(target), failures)
+        for target, error in errors:
+            region_error(region_results, target['region'], 'Failed to reconcile grants on '+target_name(target)+': '+str(error))
+
+        # only a full run knows every group that still needs a filter
+        if group_filter is not None or consumer_filter is not None or ORPHAN_FILTER_MAX_DELETES <= 0:
+            return True
+
+        checkpoint['stage'] = STAGE_CLEANUP
+        if not keep_going(checkpoint, clock, context):
+            return False
+
+    # filters left behind by OUs that were renamed, moved or deleted, groups that are
+    # no longer shared and shards that are no longer needed. tables whose grants
+    # couldn't be reconciled are left alone
+    def sweep_target(target):
+        return sweep_orphan_filters(target['lf'], CATALOG_ID, target['database'], target['table'], target['prefix'], set(target['grants']), ORPHAN_FILTER_MAX_DELETES)
+
+    with metrics.phase('LakeFormationApply'):
+        results, errors = run_concurrently(sweep_target, [target for target in filter_targets if target_name(target) in checkpoint['targets_done']], max_workers)
+
+    for target, (deleted, failures) in results:
+        metrics.add_total('FiltersDeleted', deleted)
+        metrics.add_total('FilterFailures', failures)
+        if failures:
+            region_error(region_results, target['region'], str(failures)+' orphaned data cells filters could not be removed from '+target_name(target), failures)
+    for target, error in errors:
+        region_error(region_results, target['region'], 'Failed to sweep orphaned data cells filters on '+target_name(target)+': '+str(error))
+
+    return True
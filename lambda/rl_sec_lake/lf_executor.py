@@ -0,0 +1,129 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import functools
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+from throttling import ADAPTIVE_ERROR_CODES, MAX_ATTEMPTS, backoff_delay, error_code, is_transient_error
+from metrics import record_retry
+
+# upper bound on Lake Formation requests in flight, the actual limit adapts to
+# how much Lake Formation lets us get away with
+LF_MAX_CONCURRENCY = int(os.environ.get('lf_max_concurrency', '8'))
+
+# retries are handled by the adaptive limit so all workers back off together
+LF_CLIENT_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 1})
+
+
+class AdaptiveLimit:
+    # AIMD limit on the number of requests in flight. it is halved whenever Lake
+    # Formation pushes back and raised by one after a window of successful calls
+
+    def __init__(self, maximum=LF_MAX_CONCURRENCY, minimum=1):
+        self.maximum = max(1, maximum)
+        self.minimum = min(minimum, self.maximum)
+        self.limit = self.maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.calls = 0
+        self.throttles = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+
+            self.in_flight += 1
+            self.calls += 1
+
+    def release(self, throttled=False, transient=False):
+        # a transient server or connection error says nothing about our request
+        # rate, so it neither cuts the limit nor counts towards raising it
+        with self.condition:
+            self.in_flight -= 1
+
+            if throttled:
+                self.throttles += 1
+                self.limit = max(self.minimum, self.limit // 2)
+                self.successes = 0
+            elif not transient:
+                self.successes += 1
+                if self.limit < self.maximum and self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+
+            self.condition.notify_all()
+
+
+class AdaptiveClient:
+    # wraps a boto3 client so that every API call made through it, from any
+    # thread, goes through the same adaptive limit and is retried on pushback
+
+    def __init__(self, client, limit=None):
+        self.client = client
+        self.limit = limit or AdaptiveLimit()
+
+    def __getattr__(self, name):
+        operation = getattr(self.client, name)
+        if not callable(operation) or name in ('get_paginator', 'can_paginate', 'get_waiter'):
+            return operation
+
+        @functools.wraps(operation)
+        def call(**kwargs):
+            return self.call(operation, **kwargs)
+
+        return call
+
+    def call(self, operation, **kwargs):
+        attempt = 0
+        while True:
+            self.limit.acquire()
+            try:
+                response = operation(**kwargs)
+            except (ClientError, BotoConnectionError, HTTPClientError) as e:
+                throttled = isinstance(e, ClientError) and error_code(e) in ADAPTIVE_ERROR_CODES
+                transient = not throttled and is_transient_error(e)
+                self.limit.release(throttled, transient)
+
+                attempt += 1
+                if not (throttled or transient) or attempt >= MAX_ATTEMPTS:
+                    raise
+
+                record_retry(operation)
+                delay = backoff_delay(attempt)
+                logging.warning(error_code(e)+' calling '+operation.__name__+', retrying in '+str(round(delay, 2))+'s (concurrency now '+str(self.limit.limit)+')')
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.limit.release()
+                raise
+
+            self.limit.release()
+            return response
+
+
+def run_concurrently(operation, items, max_workers=LF_MAX_CONCURRENCY):
+    # calls operation(item) for every item on a thread pool. a failing item doesn't
+    # stop the others, returns ([(item, result)], [(item, exception)]) in item order
+    results = []
+    errors = []
+    if not items:
+        return results, errors
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        futures = [(item, pool.submit(operation, item)) for item in items]
+        for item, future in futures:
+            try:
+                results.append((item, future.result()))
+            except Exception as e:
+                errors.append((item, e))
+
+    return results, errors
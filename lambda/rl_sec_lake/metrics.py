@@ -0,0 +1,183 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from throttling import ADAPTIVE_ERROR_CODES
+
+# every invocation writes one record in CloudWatch embedded metric format to its log,
+# which CloudWatch turns into metrics without any PutMetricData calls
+METRICS_NAMESPACE = os.environ.get('metrics_namespace', 'RLSecLake')
+
+# EMF records have to be written to the log as bare JSON, so they go through their
+# own logger rather than the lambda's formatted one. tests can attach a handler to it
+metrics_logger = logging.getLogger('rl_sec_lake.metrics')
+metrics_logger.propagate = False
+metrics_logger.setLevel(logging.INFO)
+if not metrics_logger.handlers:
+    metrics_handler = logging.StreamHandler(sys.stdout)
+    metrics_handler.setFormatter(logging.Formatter('%(message)s'))
+    metrics_logger.addHandler(metrics_handler)
+
+class RunMetrics:
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = collections.Counter()
+        self.totals = collections.Counter()
+        self.units = {}
+        self.api = collections.defaultdict(collections.Counter)
+        self.dimensions = {'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'RLSecLakeLambda')}
+        self.properties = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # phases can be entered several times in a run, their time adds up
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] += elapsed
+
+    def set_total(self, name, value, unit='Count'):
+        with self.lock:
+            self.totals[name] = value
+            self.units[name] = unit
+
+    def add_total(self, name, value=1, unit='Count'):
+        with self.lock:
+            self.totals[name] += value
+            self.units[name] = unit
+
+    def api_event(self, service, operation, kind):
+        with self.lock:
+            self.api[service+'.'+operation][kind] += 1
+
+    def record(self):
+        # builds the EMF record. calls, throttles and retries are metrics per
+        # service, the break down per operation is kept as a plain property
+        metrics = {}
+        units = {}
+
+        for name, seconds in self.phases.items():
+            metrics[name+'Seconds'] = round(seconds, 3)
+            units[name+'Seconds'] = 'Seconds'
+
+        for name, value in self.totals.items():
+            metrics[name] = value
+            units[name] = self.units.get(name, 'Count')
+
+        services = collections.defaultdict(collections.Counter)
+        for operation, counts in self.api.items():
+            services[operation.split('.')[0]].update(counts)
+
+        for service, counts in services.items():
+            for kind in ('Calls', 'Throttles', 'Retries', 'Errors'):
+                metrics[service.capitalize()+kind] = counts[kind]
+                units[service.capitalize()+kind] = 'Count'
+
+        metrics['DurationSeconds'] = round(time.time() - self.started, 3)
+        units['DurationSeconds'] = 'Seconds'
+
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [sorted(self.dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': units[name]} for name in sorted(metrics)],
+                }],
+            },
+            'ApiCallsByOperation': dict((operation, dict(counts)) for operation, counts in sorted(self.api.items())),
+        }
+        record.update(self.properties)
+        record.update(self.dimensions)
+        record.update(metrics)
+
+        return record
+
+    def emit(self):
+        metrics_logger.info(json.dumps(self.record(), default=str))
+
+
+current = RunMetrics()
+
+
+def start_run():
+    global current
+    current = RunMetrics()
+    return current
+
+
+def phase(name):
+    return current.phase(name)
+
+
+def set_total(name, value, unit='Count'):
+    current.set_total(name, value, unit)
+
+
+def add_total(name, value=1, unit='Count'):
+    current.add_total(name, value, unit)
+
+
+def parse_event_name(event_name):
+    # eg after-call.lakeformation.CreateDataCellsFilter
+    parts = event_name.split('.')
+    return parts[1], '.'.join(parts[2:])
+
+
+def on_after_call(event_name, parsed=None, **kwargs):
+    service, operation = parse_event_name(event_name)
+    parsed = parsed or {}
+    current.api_event(service, operation, 'Calls')
+
+    # botocore's own retries, our backoff loops report theirs through record_retry
+    for _ in range(parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)):
+        current.api_event(service, operation, 'Retries')
+
+    code = parsed.get('Error', {}).get('Code')
+    if code in ADAPTIVE_ERROR_CODES:
+        current.api_event(service, operation, 'Throttles')
+    elif code:
+        current.api_event(service, operation, 'Errors')
+
+
+def on_after_call_error(event_name, **kwargs):
+    service, operation = parse_event_name(event_name)
+    current.api_event(service, operation, 'Calls')
+    current.api_event(service, operation, 'Errors')
+
+
+def record_retry(operation):
+    # called by our own backoff loops when they retry a call that was pushed back
+    client = getattr(operation, '__self__', None)
+    meta = getattr(client, 'meta', None)
+    if meta is None:
+        current.api_event('unknown', operation.__name__, 'Retries')
+        return
+
+    current.api_event(meta.service_model.service_name, meta.method_to_api_mapping.get(operation.__name__, operation.__name__), 'Retries')
+
+
+def instrument(session):
+    # counts the calls, throttles and errors of every client created from the
+    # session from now on, whichever run they are made in
+    events = getattr(session, 'events', None)
+    if events is None:
+        return session
+
+    events.register('after-call', on_after_call, unique_id='rl_sec_lake_metrics_after_call')
+    events.register('after-call-error', on_after_call_error, unique_id='rl_sec_lake_metrics_after_call_error')
+
+    return session
@@ -0,0 +1,168 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import copy
+
+from org_index import tag_group_key, subtree_ou_ids
+
+# Organizations CloudTrail events that are routed to the lambda through EventBridge.
+# anything we can't apply to the stored snapshot falls back to a full org walk
+ORG_CHANGE_EVENT_NAMES = [
+    'MoveAccount',
+    'CreateAccount',
+    'CreateAccountResult',
+    'AcceptHandshake',
+    'RemoveAccountFromOrganization',
+    'LeaveOrganization',
+    'CreateOrganizationalUnit',
+    'UpdateOrganizationalUnit',
+    'DeleteOrganizationalUnit',
+    'TagResource',
+    'UntagResource',
+]
+
+
+def is_org_change_event(event):
+    return isinstance(event, dict) and event.get('source') == 'aws.organizations' and 'detail' in event
+
+
+def ancestor_paths(snapshot, ou_id):
+    paths = set()
+    ous = snapshot['ous']
+    while ou_id is not None and ou_id in ous:
+        paths.add(ous[ou_id]['path'])
+        ou_id = ous[ou_id]['parent_id']
+
+    return paths
+
+
+def refresh_paths(snapshot, ou_id):
+    # a child's path is longer than its parent's, so every parent gets its new path first
+    ous = snapshot['ous']
+    for child_id in sorted(subtree_ou_ids(snapshot, [ou_id]), key=lambda child_id: len(ous[child_id]['path'])):
+        ou = ous[child_id]
+        if ou['parent_id'] is not None:
+            ou['path'] = ous[ou['parent_id']]['path']+',OU='+ou['name']
+
+
+def apply_org_events(snapshot, events):
+    # applies Organizations change events to a copy of the snapshot and returns
+    # (new snapshot, OU paths and tag group keys whose membership may have changed,
+    # whether a full walk is needed instead). the input snapshot is never modified
+    new = copy.deepcopy(snapshot)
+    touched = set()
+    touched_tag_groups = set()
+    requires_full_sync = False
+
+    for event in events:
+        detail = event.get('detail', {})
+        if detail.get('errorCode'):
+            continue
+
+        name = detail.get('eventName')
+        params = detail.get('requestParameters') or {}
+        response = detail.get('responseElements') or {}
+
+        if name == 'MoveAccount':
+            account = new['accounts'].get(params.get('accountId'))
+            destination = params.get('destinationParentId')
+            if account is None or destination not in new['ous']:
+                requires_full_sync = True
+                continue
+
+            touched.add(account['ou_id'])
+            touched.add(destination)
+            account['ou_id'] = destination
+
+        elif name in ('CreateAccount', 'CreateAccountResult'):
+            # CreateAccount only starts the request, the account id arrives with
+            # the CreateAccountResult service event once it has been created
+            status = (detail.get('serviceEventDetails') or response).get('createAccountStatus', {})
+            if status.get('state') != 'SUCCEEDED' or not status.get('accountId'):
+                continue
+
+            # CloudTrail masks the account name as ****, the next walk reads the real one
+            account_name = status.get('accountName') or ''
+            new['accounts'][status['accountId']] = {
+                'name': account_name if account_name.strip('*') else '',
+                'ou_id': new['root_id'],
+                'tags': {}
+            }
+            touched.add(new['root_id'])
+
+        elif name in ('RemoveAccountFromOrganization', 'LeaveOrganization'):
+            account_id = params.get('accountId') or detail.get('userIdentity', {}).get('accountId')
+            account = new['accounts'].pop(account_id, None)
+            if account is not None:
+                touched.add(account['ou_id'])
+                touched_tag_groups.update(tag_group_key(key, value) for key, value in account['tags'].items())
+
+        elif name == 'CreateOrganizationalUnit':
+            orgunit = response.get('organizationalUnit', {})
+            parent_id = params.get('parentId')
+            ou_name = orgunit.get('name') or params.get('name')
+            if not orgunit.get('id') or not ou_name or parent_id not in new['ous']:
+                requires_full_sync = True
+                continue
+
+            new['ous'][orgunit['id']] = {
+                'name': ou_name,
+                'parent_id': parent_id,
+                'path': new['ous'][parent_id]['path']+',OU='+ou_name
+            }
+            touched.add(orgunit['id'])
+
+        elif name == 'UpdateOrganizationalUnit':
+            ou_id = params.get('organizationalUnitId')
+            if ou_id not in new['ous']:
+                requires_full_sync = True
+                continue
+
+            if params.get('name'):
+                new['ous'][ou_id]['name'] = params['name']
+                refresh_paths(new, ou_id)
+                touched.update(subtree_ou_ids(new, [ou_id]))
+
+        elif name == 'DeleteOrganizationalUnit':
+            ou_id = params.get('organizationalUnitId')
+            if ou_id in new['ous']:
+                # only empty OUs can be deleted, so the snapshot has missed a change
+                if any(ou['parent_id'] == ou_id for ou in new['ous'].values()) or any(account['ou_id'] == ou_id for account in new['accounts'].values()):
+                    requires_full_sync = True
+                    continue
+
+                touched.add(ou_id)
+                del new['ous'][ou_id]
+
+        elif name in ('TagResource', 'UntagResource'):
+            # only account tags are recorded, tags don't change OU membership but
+            # the account leaves the group of the old value and joins the new one.
+            # tags on OUs, policies and the root change nothing
+            resource_id = str(params.get('resourceId') or '')
+            account = new['accounts'].get(resource_id)
+            if account is None:
+                # an account the snapshot doesn't know yet, its tags come with a walk
+                if resource_id.isdigit() and len(resource_id) == 12:
+                    requires_full_sync = True
+                continue
+
+            if name == 'TagResource':
+                changes = [(tag['key'].lower(), tag['value']) for tag in params.get('tags', [])]
+            else:
+                changes = [(key.lower(), None) for key in params.get('tagKeys', [])]
+
+            for key, value in changes:
+                if key in account['tags']:
+                    touched_tag_groups.add(tag_group_key(key, account['tags'].pop(key)))
+                if value is not None:
+                    account['tags'][key] = value
+                    touched_tag_groups.add(tag_group_key(key, value))
+
+        else:
+            requires_full_sync = True
+
+    affected_groups = set(touched_tag_groups)
+    for ou_id in touched:
+        affected_groups |= ancestor_paths(snapshot, ou_id) | ancestor_paths(new, ou_id)
+
+    return new, affected_groups, requires_full_sync
@@ -0,0 +1,91 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+
+def build_ou_index(snapshot):
+    # returns {OU path: set of account ids in that OU or any OU below it}, built
+    # in a single pass over the accounts of the org snapshot
+    ous = snapshot['ous']
+    ancestors = {}
+
+    def get_ancestor_paths(ou_id):
+        if ou_id not in ancestors:
+            ou = ous[ou_id]
+            paths = [ou['path']]
+            if ou['parent_id'] is not None:
+                paths += get_ancestor_paths(ou['parent_id'])
+            ancestors[ou_id] = paths
+
+        return ancestors[ou_id]
+
+    index = dict((ou['path'], set()) for ou in ous.values())
+    for account_id, account in snapshot['accounts'].items():
+        # left out of the metadata tables as well, see metadata_from_snapshot
+        if account['ou_id'] not in ous:
+            continue
+
+        for path in get_ancestor_paths(account['ou_id']):
+            index[path].add(account_id)
+
+    return index
+
+
+def tag_group_key(key, value):
+    # tag groups sit next to OU groups and their filters are named the same way,
+    # eg account_metadata_filter_TAG_team_payments_<hash>
+    return 'TAG='+key+'='+value
+
+
+def build_tag_index(snapshot, keys=None):
+    # returns {tag key: {tag value: set of account ids with that tag}}, built in a
+    # single pass over the accounts. keys limits the index to those tag keys
+    index = {}
+    for account_id, account in snapshot['accounts'].items():
+        for key, value in account['tags'].items():
+            if keys and key not in keys:
+                continue
+
+            index.setdefault(key, {}).setdefault(value, set()).add(account_id)
+
+    return index
+
+
+def subtree_ou_ids(snapshot, ou_ids):
+    # the given OUs and every OU below them
+    children = {}
+    for ou_id, ou in snapshot['ous'].items():
+        children.setdefault(ou['parent_id'], []).append(ou_id)
+
+    found = set()
+    pending = [ou_id for ou_id in ou_ids if ou_id in snapshot['ous']]
+    while pending:
+        ou_id = pending.pop()
+        if ou_id in found:
+            continue
+
+        found.add(ou_id)
+        pending += children.get(ou_id, [])
+
+    return found
+
+
+def changed_groups(old_snapshot, new_snapshot, keys=None):
+    # OU paths and tag group keys whose accounts differ between the two snapshots
+    changed = set()
+
+    old_index = build_ou_index(old_snapshot)
+    new_index = build_ou_index(new_snapshot)
+    for path in set(old_index) | set(new_index):
+        if old_index.get(path) != new_index.get(path):
+            changed.add(path)
+
+    old_index = build_tag_index(old_snapshot, keys)
+    new_index = build_tag_index(new_snapshot, keys)
+    for key in set(old_index) | set(new_index):
+        old_values = old_index.get(key, {})
+        new_values = new_index.get(key, {})
+        for value in set(old_values) | set(new_values):
+            if old_values.get(value) != new_values.get(value):
+                changed.add(tag_group_key(key, value))
+
+    return changed
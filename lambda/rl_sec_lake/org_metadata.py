@@ -0,0 +1,342 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import copy
+import gzip
+import json
+import time
+import boto3
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from throttling import TokenBucket, call_with_backoff, paginate
+from metrics import instrument
+from org_index import subtree_ou_ids
+
+ORG_WALK_WORKERS = int(os.environ.get('org_walk_workers', '8'))
+ORG_API_RATE = float(os.environ.get('org_api_rate', '8'))
+
+# the last org snapshot is kept in the metadata bucket, gzipped, so change events
+# can be applied to it without walking the whole org again
+ORG_SNAPSHOT_KEY = '_state/org_snapshot.json.gz'
+ORG_SNAPSHOT_VERSION = 2
+
+# account tags and OU names read less than this long ago are taken from the last
+# snapshot instead of being read again. tag and OU changes are applied from org
+# events as they happen, this bounds how long a missed event goes unnoticed
+ORG_CACHE_TTL_HOURS = float(os.environ.get('org_cache_ttl_hours', '24'))
+
+# {(bucket, key): (etag, snapshot body)} of the last snapshot loaded or saved, a warm
+# lambda only downloads it again when it has changed
+snapshot_cache = {}
+
+# throttling is handled by our shared token bucket so all workers back off
+# together, rather than botocore retrying each request on its own. server errors
+# and dropped connections are retried by call_with_backoff as well
+ORG_CLIENT_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 1})
+
+
+def new_snapshot(organizations, bucket):
+
+    # get org-id
+    response = call_with_backoff(bucket, organizations.describe_organization)
+    org_info = response.get("Organization")
+
+    response = call_with_backoff(bucket, organizations.list_roots)
+    roots = response.get("Roots", None)
+    if not roots:
+        raise Exception('Unable to find the root of the organization')
+
+    root_id = roots[0]["Id"]
+
+    return {
+        'org_id': org_info['Id'],
+        'root_id': root_id,
+        'ous': {
+            root_id: {'name': 'root', 'parent_id': None, 'path': 'OU=root'}
+        },
+        'accounts': {},
+        'taken_at': time.time(),
+        # when each OU's name and each account's tags were read from Organizations,
+        # kept apart from the OUs and accounts so they don't change the fingerprint
+        'fetched_at': {'ous': {root_id: time.time()}, 'tags': {}}
+    }
+
+
+def fetch_times(snapshot, kind):
+    # {OU or account id: time read} for 'ous' or 'tags'. snapshots changed by org
+    # events may not have one for everything, those are read again on the next walk
+    return snapshot.setdefault('fetched_at', {}).setdefault(kind, {})
+
+
+def is_fresh(snapshot, kind, resource_id, max_age_hours):
+    if snapshot is None:
+        return False
+
+    return time.time()-fetch_times(snapshot, kind).get(resource_id, 0) < max_age_hours*3600
+
+
+def reuse_tags(snapshot, previous, account_id, max_age_hours):
+    # copies the account's tags from the previous snapshot when they're recent
+    # enough. returns False when they have to be read again
+    if previous is None or account_id not in previous['accounts'] or not is_fresh(previous, 'tags', account_id, max_age_hours):
+        return False
+
+    snapshot['accounts'][account_id]['tags'] = dict(previous['accounts'][account_id]['tags'])
+    fetch_times(snapshot, 'tags')[account_id] = fetch_times(previous, 'tags')[account_id]
+    return True
+
+
+def get_tags(organizations, bucket, id):
+    tags = {}
+    for tag in paginate(bucket, organizations.list_tags_for_resource, 'Tags', ResourceId=id):
+        tags[tag["Key"]] = tag["Value"]
+
+    # make sure all tag keys are lower case
+    return dict((k.lower(), v) for k,v in tags.items())
+
+
+def get_child_orgunits(organizations, bucket, parent_id):
+    return paginate(bucket, organizations.list_organizational_units_for_parent, 'OrganizationalUnits', ParentId=parent_id)
+
+
+def add_orgunit(snapshot, orgunit, parent_id):
+    snapshot['ous'][orgunit["Id"]] = {
+        'name': orgunit["Name"],
+        'parent_id': parent_id,
+        'path': snapshot['ous'][parent_id]['path']+',OU='+orgunit["Name"]
+    }
+    fetch_times(snapshot, 'ous')[orgunit["Id"]] = time.time()
+
+
+def drain(pool, pending, handle_result):
+    # pending maps futures to a (kind, resource_id) tuple. handle_result may queue
+    # more work into pending, and is only ever called from this thread
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, resource_id = pending.pop(future)
+                handle_result(kind, resource_id, future.result())
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+def walk_subtrees(organizations, bucket, snapshot, ou_ids, max_workers=ORG_WALK_WORKERS, previous=None, max_age_hours=ORG_CACHE_TTL_HOURS):
+    # adds the accounts and OUs below each of the given OUs to the snapshot, the
+    # OUs themselves have to be in it already. recent tags are taken from previous
+
+    def get_children(parent_id):
+        try:
+            accounts = paginate(bucket, organizations.list_accounts_for_parent, 'Accounts', ParentId=parent_id)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ParentNotFoundException':
+                raise
+            return None
+
+        orgunits = get_child_orgunits(organizations, bucket, parent_id)
+
+        return accounts, orgunits
+
+    # sibling OUs and per-account tag lookups are fanned out over the pool
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = dict((pool.submit(get_children, ou_id), ('ou', ou_id)) for ou_id in ou_ids)
+
+        def handle_result(kind, resource_id, result):
+            if kind == 'tags':
+                snapshot['accounts'][resource_id]['tags'] = result
+                fetch_times(snapshot, 'tags')[resource_id] = time.time()
+                return
+
+            # the OU was deleted since it was listed or the snapshot was taken
+            if result is None:
+                logging.info('--- OU '+resource_id+' no longer exists ---')
+                del snapshot['ous'][resource_id]
+                return
+
+            child_accounts, child_orgunits = result
+            for account in child_accounts:
+                snapshot['accounts'][account["Id"]] = {
+                    'name': account['Name'],
+                    'ou_id': resource_id,
+                    'tags': {}
+                }
+                if not reuse_tags(snapshot, previous, account["Id"], max_age_hours):
+                    pending[pool.submit(get_tags, organizations, bucket, account["Id"])] = ('tags', account["Id"])
+
+            for orgunit in child_orgunits:
+                add_orgunit(snapshot, orgunit, resource_id)
+                pending[pool.submit(get_children, orgunit["Id"])] = ('ou', orgunit["Id"])
+
+        drain(pool, pending, handle_result)
+
+    return snapshot
+
+
+def walk_org_snapshot(organizations, bucket, max_workers=ORG_WALK_WORKERS, previous=None, max_age_hours=ORG_CACHE_TTL_HOURS):
+    snapshot = new_snapshot(organizations, bucket)
+    return walk_subtrees(organizations, bucket, snapshot, [snapshot['root_id']], max_workers, previous, max_age_hours)
+
+
+def metadata_from_snapshot(snapshot):
+    accounts_list = {}
+    accounts_list['Accounts'] = []
+
+    ous = snapshot['ous']
+    accounts = []
+    for account_id, account in snapshot['accounts'].items():
+        if account['ou_id'] not in ous:
+            # the walk never leaves these behind, a stale snapshot might. the next full walk puts them back
+            logging.warning('Account '+account_id+' is in OU '+str(account['ou_id'])+', which is not in the org snapshot, leaving it out')
+            continue
+        accounts.append((account_id, account))
+
+    for account_id, account in sorted(accounts, key=lambda item: (ous[item[1]['ou_id']]['path'], item[0])):
+        account_info = {}
+        account_info['id'] = account_id
+        account_info['name'] = account['name']
+        account_info['org_id'] = snapshot['org_id']
+        account_info['ou'] = ous[account['ou_id']]['path']
+        account_info['ou_id'] = account['ou_id']
+        account_info['tags'] = account['tags']
+        logging.info("Found account: "+json.dumps(account_info))
+        accounts_list['Accounts'].append(account_info)
+
+    ou_list = sorted(ou['path'] for ou in ous.values())
+
+    return accounts_list, ou_list
+
+
+def get_org_snapshot(session=None, previous=None, max_age_hours=ORG_CACHE_TTL_HOURS):
+    # previous is the last snapshot, its recent tags are reused rather than read again
+
+    # if we don't get a session, create one
+    if session is None:
+        session = boto3.Session()
+
+    instrument(session)
+    organizations = session.client('organizations', config=ORG_CLIENT_CONFIG)
+    bucket = TokenBucket(ORG_API_RATE)
+
+    snapshot = walk_org_snapshot(organizations, bucket, ORG_WALK_WORKERS, previous, max_age_hours)
+    reused = sum(1 for fetched_at in fetch_times(snapshot, 'tags').values() if fetched_at < snapshot['taken_at'])
+    logging.info('--- Org snapshot made '+str(bucket.calls)+' Organizations API calls, reused the tags of '+str(reused)+' accounts ---')
+
+    return snapshot
+
+
+def refresh_org_subtrees(snapshot, ou_ids, session=None, max_age_hours=ORG_CACHE_TTL_HOURS):
+    # returns a copy of the snapshot with everything below the given OUs walked
+    # again, the rest of the org is kept as it was. recent OU names and tags are kept
+    if session is None:
+        session = boto3.Session()
+
+    instrument(session)
+    organizations = session.client('organizations', config=ORG_CLIENT_CONFIG)
+    bucket = TokenBucket(ORG_API_RATE)
+
+    previous = snapshot
+    snapshot = copy.deepcopy(snapshot)
+    subtree = subtree_ou_ids(snapshot, ou_ids)
+
+    # only walk from the top of each subtree, OUs below another one in the list are covered by it
+    tops = sorted(ou_id for ou_id in subtree if snapshot['ous'][ou_id]['parent_id'] not in subtree)
+
+    # OUs may have been renamed or deleted since the snapshot was taken, OUs
+    # can't be moved so their parent is still the same. names read recently are
+    # kept, an OU deleted since then is found by the walk below
+    for ou_id in list(tops):
+        if ou_id == snapshot['root_id'] or is_fresh(snapshot, 'ous', ou_id, max_age_hours):
+            continue
+
+        try:
+            response = call_with_backoff(bucket, organizations.describe_organizational_unit, OrganizationalUnitId=ou_id)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'OrganizationalUnitNotFoundException':
+                raise
+            logging.info('--- OU '+ou_id+' no longer exists ---')
+            tops.remove(ou_id)
+            continue
+
+        ou = snapshot['ous'][ou_id]
+        ou['name'] = response['OrganizationalUnit']['Name']
+        ou['path'] = snapshot['ous'][ou['parent_id']]['path']+',OU='+ou['name']
+        fetch_times(snapshot, 'ous')[ou_id] = time.time()
+
+    for ou_id in subtree - set(tops):
+        del snapshot['ous'][ou_id]
+
+    previous_accounts = dict(
+        (account_id, snapshot['accounts'].pop(account_id))
+        for account_id in [account_id for account_id, account in snapshot['accounts'].items() if account['ou_id'] in subtree]
+    )
+
+    walk_subtrees(organizations, bucket, snapshot, tops, ORG_WALK_WORKERS, previous, max_age_hours)
+    tops = [ou_id for ou_id in tops if ou_id in snapshot['ous']]
+
+    # accounts that aren't in the subtrees any more have been moved out of them or have left the org
+    for account_id, account in sorted(previous_accounts.items()):
+        if account_id in snapshot['accounts']:
+            continue
+
+        try:
+            response = call_with_backoff(bucket, organizations.list_parents, ChildId=account_id)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('ChildNotFoundException', 'AccountNotFoundException'):
+                raise
+            logging.info('--- Account '+account_id+' has left the organization ---')
+            continue
+
+        parent_id = response['Parents'][0]['Id']
+        if parent_id not in snapshot['ous']:
+            logging.info('--- Account '+account_id+' was moved to '+parent_id+', which is not in the org snapshot ---')
+            continue
+
+        snapshot['accounts'][account_id] = dict(account, ou_id=parent_id)
+
+    logging.info('--- Walking '+str(len(tops))+' OU subtrees made '+str(bucket.calls)+' Organizations API calls ---')
+
+    return snapshot
+
+
+def get_account_metadata(session=None):
+    return metadata_from_snapshot(get_org_snapshot(session))
+
+
+def load_org_snapshot(s3_client, bucket, key=ORG_SNAPSHOT_KEY):
+    start = time.time()
+    cached = snapshot_cache.get((bucket, key))
+    kwargs = {'Bucket': bucket, 'Key': key}
+    if cached is not None and cached[0]:
+        kwargs['IfNoneMatch'] = cached[0]
+
+    try:
+        response = s3_client.get_object(**kwargs)
+        body = gzip.decompress(response['Body'].read())
+        snapshot_cache[(bucket, key)] = (response.get('ETag'), body)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        if e.response['Error']['Code'] != '304':
+            raise
+        body = cached[1]
+
+    # every load gets its own copy, callers are free to change it
+    snapshot = json.loads(body)
+    if snapshot.get('version') != ORG_SNAPSHOT_VERSION:
+        logging.info('--- Ignoring org snapshot with version '+str(snapshot.get('version'))+' ---')
+        return None
+
+    logging.info('--- Loaded org snapshot of '+str(len(snapshot['accounts']))+' accounts in '+str(int((time.time()-start)*1000))+' ms ---')
+    return snapshot
+
+
+def save_org_snapshot(s3_client, bucket, snapshot, key=ORG_SNAPSHOT_KEY):
+    body = json.dumps(dict(snapshot, version=ORG_SNAPSHOT_VERSION), separators=(',', ':')).encode('utf-8')
+    response = s3_client.put_object(Bucket=bucket, Key=key, Body=gzip.compress(body), ContentType='application/gzip')
+    snapshot_cache[(bucket, key)] = (response.get('ETag'), body)
@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import re
+
+from iceberg_tables import sql_string
+
+# groups whose expression would be longer than this are split over several
+# data cells filters, which are always granted together
+FILTER_EXPRESSION_MAX_LENGTH = int(os.environ.get('filter_expression_max_length', '2048'))
+
+
+def shard_filter_name(name, index):
+    # the first shard keeps the group's filter name so small groups look as they always have
+    if index == 0:
+        return name
+
+    return name+'__part'+str(index+1)
+
+
+def unshard_filter_name(name):
+    # the group's filter name for any of its shards
+    return re.sub(r'__part\d+$', '', name)
+
+
+def build_row_filters(name, column, account_ids, max_length=FILTER_EXPRESSION_MAX_LENGTH):
+    # returns [(filter name, expression)] with a compact IN list on column. accounts are
+    # sorted so a group always produces the same shards for the same members
+    prefix = column+' IN ('
+    values = [sql_string(account_id) for account_id in sorted(set(str(a) for a in account_ids))]
+
+    if not values:
+        # a group without accounts shares nothing, an empty id never matches
+        return [(name, prefix+"'')")]
+
+    shards = []
+    current = []
+    length = len(prefix)+1
+    for value in values:
+        added = len(value)+2 if current else len(value)
+        if current and length+added > max_length:
+            shards.append(current)
+            current = []
+            length = len(prefix)+1
+            added = len(value)
+
+        current.append(value)
+        length += added
+
+    shards.append(current)
+
+    return [(shard_filter_name(name, index), prefix+', '.join(shard)+')') for index, shard in enumerate(shards)]
@@ -0,0 +1,73 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+# DeleteObjects takes at most 1,000 keys, which is also a full ListObjectsV2 page
+DELETE_OBJECTS_BATCH_SIZE = 1000
+
+# DeleteObjects requests in flight while the rest of the prefix is being listed
+S3_DELETE_WORKERS = int(os.environ.get('s3_delete_workers', '8'))
+
+
+def list_prefix_pages(s3_client, bucket, prefix):
+    # yields the objects under the prefix a page at a time, a prefix with nothing
+    # under it has no Contents at all
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        objects = response.get('Contents', [])
+        if objects:
+            yield objects
+
+        if not response.get('IsTruncated'):
+            return
+
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def delete_batch(s3_client, bucket, objects):
+    # returns (objects deleted, bytes deleted, [errors]) for one DeleteObjects request
+    response = s3_client.delete_objects(
+        Bucket=bucket,
+        Delete={'Objects': [{'Key': item['Key']} for item in objects], 'Quiet': True}
+    )
+    errors = response.get('Errors', [])
+    failed = set(error['Key'] for error in errors)
+    deleted = [item for item in objects if item['Key'] not in failed]
+
+    return len(deleted), sum(item.get('Size', 0) for item in deleted), errors
+
+
+def delete_prefix(s3_client, bucket, prefix, max_workers=S3_DELETE_WORKERS):
+    # deletes everything under the prefix, batches are deleted while the next pages
+    # are listed. returns {'objects', 'bytes'} deleted, raises if any object is left
+    if not prefix or not prefix.endswith('/'):
+        raise Exception('Refusing to delete s3://'+bucket+'/'+prefix+', prefixes must end with /')
+
+    result = {'objects': 0, 'bytes': 0}
+    errors = []
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = []
+        for objects in list_prefix_pages(s3_client, bucket, prefix):
+            for start in range(0, len(objects), DELETE_OBJECTS_BATCH_SIZE):
+                futures.append(pool.submit(delete_batch, s3_client, bucket, objects[start:start+DELETE_OBJECTS_BATCH_SIZE]))
+
+        for future in futures:
+            deleted, size, batch_errors = future.result()
+            result['objects'] += deleted
+            result['bytes'] += size
+            errors += batch_errors
+
+    logging.info('--- Deleted '+str(result['objects'])+' objects ('+str(result['bytes'])+' bytes) under s3://'+bucket+'/'+prefix+' ---')
+
+    if errors:
+        for error in errors[:10]:
+            logging.error('Unable to delete '+error['Key']+': '+error.get('Code', '')+' '+error.get('Message', ''))
+        raise Exception('Unable to delete '+str(len(errors))+' objects under s3://'+bucket+'/'+prefix)
+
+    return result
@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import fnmatch
+import logging
+
+from lf_executor import run_concurrently
+
+# Security Lake tables are partitioned by region, accountid and eventday. a row
+# filter on the partition key lets Athena skip the partitions of other accounts
+ACCOUNT_PARTITION_KEY = 'accountid'
+
+# the account in the OCSF record itself, OCSF 1.1 and later, then OCSF 1.0
+OCSF_ACCOUNT_COLUMNS = ['cloud.account.uid', 'cloud.account_uid']
+
+# Security Lake names its Glue database and tables after their region, with the
+# dashes of the region name replaced, eg amazon_security_lake_glue_db_us_east_1
+SECURITY_LAKE_DB_PREFIX = 'amazon_security_lake_glue_db_'
+
+
+def struct_fields(type_string):
+    # {field name: type} for the top level fields of a Glue struct<...> type
+    type_string = (type_string or '').strip()
+    if not type_string.lower().startswith('struct<') or not type_string.endswith('>'):
+        return {}
+
+    body = type_string[len('struct<'):-1]
+    fields = {}
+    parts = []
+    depth = 0
+    start = 0
+    for index, character in enumerate(body):
+        if character in '<(':
+            depth += 1
+        elif character in '>)':
+            depth -= 1
+        elif character == ',' and depth == 0:
+            parts.append(body[start:index])
+            start = index+1
+    parts.append(body[start:])
+
+    for part in parts:
+        name, _, field_type = part.partition(':')
+        if name.strip():
+            fields[name.strip().lower()] = field_type.strip()
+
+    return fields
+
+
+def has_column(columns, path):
+    # columns is {name: type}, path can point into struct columns, eg cloud.account.uid
+    names = path.lower().split('.')
+    column_type = columns.get(names[0])
+    for name in names[1:]:
+        if column_type is None:
+            return False
+        column_type = struct_fields(column_type).get(name)
+
+    return column_type is not None
+
+
+def get_account_column(glue_client, database, table_name):
+    # the column data cells filters on the table match account ids against. the
+    # partition key when there is one, otherwise the account in the OCSF record
+    table = glue_client.get_table(DatabaseName=database, Name=table_name)['Table']
+    partition_keys = [key['Name'].lower() for key in table.get('PartitionKeys', [])]
+    if ACCOUNT_PARTITION_KEY in partition_keys:
+        return ACCOUNT_PARTITION_KEY
+
+    columns = dict((column['Name'].lower(), column.get('Type', '')) for column in table.get('StorageDescriptor', {}).get('Columns', []))
+    for column in OCSF_ACCOUNT_COLUMNS:
+        if has_column(columns, column):
+            logging.warning(database+'.'+table_name+' is not partitioned by '+ACCOUNT_PARTITION_KEY+', filtering on '+column+' which scans every partition')
+            return column
+
+    raise Exception(database+'.'+table_name+' has neither an '+ACCOUNT_PARTITION_KEY+' partition key nor a '+' or '.join(OCSF_ACCOUNT_COLUMNS)+' column to filter accounts on')
+
+
+def table_patterns(value):
+    # security_lake_table is a comma separated list of table names, which can use
+    # shell style wildcards, eg amazon_security_lake_table_us_east_1_*
+    return [pattern.strip().lower() for pattern in str(value or '').split(',') if pattern.strip()]
+
+
+def region_suffix(region):
+    return region.replace('-', '_')
+
+
+def regional_names(database, patterns, home_region, region):
+    # the Security Lake database and table patterns of another region, derived from
+    # the ones configured for the region the lambda runs in
+    if region == home_region:
+        return database, patterns
+
+    home_suffix = region_suffix(home_region)
+    return SECURITY_LAKE_DB_PREFIX+region_suffix(region), [pattern.replace(home_suffix, region_suffix(region)) for pattern in patterns]
+
+
+def find_security_lake_tables(glue_client, database, patterns):
+    # the tables in the Security Lake database that match any of the patterns
+    kwargs = {'DatabaseName': database}
+    names = []
+    while True:
+        response = glue_client.get_tables(**kwargs)
+        names += [table['Name'] for table in response.get('TableList', [])]
+
+        if not response.get('NextToken'):
+            break
+
+        kwargs['NextToken'] = response['NextToken']
+
+    tables = sorted(name for name in names if any(fnmatch.fnmatchcase(name.lower(), pattern) for pattern in patterns))
+    for pattern in patterns:
+        if not any(fnmatch.fnmatchcase(name.lower(), pattern) for name in names):
+            logging.warning('No table in '+database+' matches '+pattern)
+
+    if not tables:
+        raise Exception('No table in '+database+' matches '+', '.join(patterns))
+
+    return tables
+
+
+def get_account_columns(glue_client, database, patterns):
+    # {table name: account column} for every matching table, their schemas are read
+    # concurrently and any table without an account column fails the lot
+    tables = find_security_lake_tables(glue_client, database, patterns)
+    results, errors = run_concurrently(lambda table_name: get_account_column(glue_client, database, table_name), tables)
+    if errors:
+        raise errors[0][1]
+
+    return dict(results)
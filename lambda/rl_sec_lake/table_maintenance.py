@@ -0,0 +1,67 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import os
+import time
+
+from iceberg_tables import table_exists
+from s3_cleanup import list_prefix_pages
+
+# snapshots older than this are expired by VACUUM, along with the files only they
+# referenced and any file under the table that no snapshot references
+SNAPSHOT_RETENTION_HOURS = float(os.environ.get('maintenance_snapshot_retention_hours', '24'))
+
+# OPTIMIZE on a table with a lot of small files can ask to be run again
+MAX_OPTIMIZE_RUNS = 5
+
+
+def table_files(s3_client, bucket, table_name):
+    # file counts and sizes under the table's location, split into data and metadata
+    usage = {'files': 0, 'bytes': 0, 'data_files': 0, 'data_bytes': 0, 'metadata_files': 0, 'metadata_bytes': 0}
+    prefix = table_name+'/'
+    for objects in list_prefix_pages(s3_client, bucket, prefix):
+        for item in objects:
+            kind = item['Key'][len(prefix):].split('/')[0]
+            usage['files'] += 1
+            usage['bytes'] += item.get('Size', 0)
+            if kind in ('data', 'metadata'):
+                usage[kind+'_files'] += 1
+                usage[kind+'_bytes'] += item.get('Size', 0)
+
+    return usage
+
+
+def run_statement(database, sql):
+    import awswrangler as wr
+
+    logging.info('--- Running '+sql+' ---')
+    wr.athena.start_query_execution(sql=sql, database=database, wait=True)
+
+
+def maintain_table(s3_client, glue_client, database, table_name, bucket):
+    # compacts the table's data files, then expires old snapshots and removes the
+    # files nothing references any more. returns the file usage before and after
+    if not table_exists(glue_client, database, table_name):
+        logging.info('--- No '+table_name+' table, skipping maintenance ---')
+        return None
+
+    start = time.time()
+    before = table_files(s3_client, bucket, table_name)
+
+    run_statement(database, f"ALTER TABLE {table_name} SET TBLPROPERTIES ('vacuum_max_snapshot_age_seconds'='{int(SNAPSHOT_RETENTION_HOURS*3600)}')")
+
+    for run in range(MAX_OPTIMIZE_RUNS):
+        try:
+            run_statement(database, f'OPTIMIZE {table_name} REWRITE DATA USING BIN_PACK')
+            break
+        except Exception as e:
+            if 'ICEBERG_OPTIMIZE_MORE_RUNS_NEEDED' not in str(e) or run == MAX_OPTIMIZE_RUNS-1:
+                raise
+
+    run_statement(database, f'VACUUM {table_name}')
+
+    after = table_files(s3_client, bucket, table_name)
+    logging.info('--- '+table_name+' table: '+str(before['files'])+' files ('+str(before['bytes'])+' bytes) before maintenance, '+str(after['files'])+' files ('+str(after['bytes'])+' bytes) after ---')
+
+    return {'before': before, 'after': after, 'seconds': round(time.time()-start, 3)}
@@ -0,0 +1,149 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import logging
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+THROTTLING_ERROR_CODES = (
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'Throttling',
+    'RequestLimitExceeded',
+)
+
+# Lake Formation also pushes back on changes that race with other changes to the
+# same table's permissions, which calms down the same way
+ADAPTIVE_ERROR_CODES = THROTTLING_ERROR_CODES + ('ConcurrentModificationException',)
+
+# server side failures and dropped connections. botocore's own retries are turned
+# off so these are retried here, they say nothing about our request rate so the
+# rate isn't cut for them
+TRANSIENT_ERROR_CODES = (
+    'InternalFailure',
+    'InternalServerError',
+    'InternalServiceException',
+    'ServiceException',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+    'RequestTimeout',
+    'RequestTimeoutException',
+)
+
+MAX_ATTEMPTS = 8
+MAX_BACKOFF_SECONDS = 20
+
+
+def error_code(error):
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+
+    return type(error).__name__
+
+
+def is_throttling_error(error):
+    return isinstance(error, ClientError) and error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(error):
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+
+    if not isinstance(error, ClientError):
+        return False
+
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+    return error_code(error) in TRANSIENT_ERROR_CODES or status >= 500
+
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, 0.25 * 2 ** attempt))
+
+
+class TokenBucket:
+    # shared token bucket that every worker takes a token from before making an
+    # API request. the refill rate is halved whenever the service throttles us and
+    # climbs back towards the configured rate as calls succeed again
+
+    def __init__(self, rate, burst=None, min_rate=0.5):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # drop any saved up burst so other workers slow down straight away
+            self.tokens = min(self.tokens, 0.0)
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def call_with_backoff(bucket, operation, max_attempts=MAX_ATTEMPTS, **kwargs):
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            response = operation(**kwargs)
+        except (ClientError, BotoConnectionError, HTTPClientError) as e:
+            attempt += 1
+            throttled = is_throttling_error(e)
+            if not (throttled or is_transient_error(e)) or attempt >= max_attempts:
+                raise
+
+            # imported here as metrics itself depends on this module
+            from metrics import record_retry
+            record_retry(operation)
+
+            delay = backoff_delay(attempt)
+            if throttled:
+                bucket.on_throttle()
+                logging.warning('Throttled calling '+operation.__name__+', retrying in '+str(round(delay, 2))+'s (rate now '+str(round(bucket.rate, 2))+'/s)')
+            else:
+                logging.warning(str(error_code(e))+' calling '+operation.__name__+', retrying in '+str(round(delay, 2))+'s')
+            time.sleep(delay)
+            continue
+
+        bucket.on_success()
+        return response
+
+
+def paginate(bucket, operation, result_key, **kwargs):
+    # manual pagination so every page request goes through the token bucket
+    items = []
+    while True:
+        response = call_with_backoff(bucket, operation, **kwargs)
+        items += response.get(result_key, [])
+
+        next_token = response.get('NextToken')
+        if not next_token:
+            return items
+
+        kwargs['NextToken'] = next_token
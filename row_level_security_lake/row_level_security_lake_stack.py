@@ -1,6 +1,8 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import json
+
 from aws_cdk import (
     Stack,
     CfnParameter,
@@ -38,9 +40,15 @@ class RowLevelSecurityLakeStack(Stack):
         cf_param_security_lake_table = CfnParameter(self, "SecurityLakeTable",
             type="String",
             default=self.node.try_get_context('security_lake_table'),
-            description="The name of the Security Lake table you want to share."
+            description="The Security Lake tables you want to share, comma separated names or patterns such as amazon_security_lake_table_ap_southeast_2_*."
             )
 
+        # other regions whose Security Lake is shared from this one, eg "us-west-2,eu-west-1"
+        security_lake_regions = self.node.try_get_context('security_lake_regions') or ''
+        if not isinstance(security_lake_regions, str):
+            security_lake_regions = ','.join(security_lake_regions)
+        other_regions = [region.strip() for region in security_lake_regions.split(',') if region.strip() and region.strip() != Stack.of(self).region]
+
         # bucket to store AWS account and groups metadata
         metadata_bucket = _s3.Bucket(
             self,
@@ -67,6 +75,7 @@ class RowLevelSecurityLakeStack(Stack):
                             "organizations:ListTagsForResource",
                             "organizations:ListOrganizationalUnitsForParent",
                             "organizations:ListAccountsForParent",
+                            "organizations:ListParents",
                             "organizations:DescribeOrganizationalUnit",
                             "organizations:DescribeOrganization"
                         ],
@@ -98,6 +107,7 @@ class RowLevelSecurityLakeStack(Stack):
                             "lakeformation:ListResources",
                             "lakeformation:GetDataAccess",
                             "lakeformation:BatchGrantPermissions",
+                            "lakeformation:BatchRevokePermissions",
                             "lakeformation:CreateDataCellsFilter",
                             "lakeformation:UpdateDataCellsFilter",
                             "lakeformation:DeleteDataCellsFilter",
@@ -125,17 +135,28 @@ class RowLevelSecurityLakeStack(Stack):
                         )
                     ]
                 ),
+                # the tables to share are found by listing the Security Lake database
                 "GlueSecLakeTableAccess": _iam.PolicyDocument(
                     statements=[_iam.PolicyStatement(
                         actions=[
                             "glue:GetTable",
+                            "glue:GetTables",
                             "glue:UpdateTable",
                             "glue:PutResourcePolicy",
                             "glue:BatchGetTable",
                         ],
                         resources=[
+                            f"arn:aws:glue:{Stack.of(self).region}:{Stack.of(self).account}:catalog",
                             f"arn:aws:glue:{Stack.of(self).region}:{Stack.of(self).account}:database/{cf_param_security_lake_db.value_as_string}",
-                            f"arn:aws:glue:{Stack.of(self).region}:{Stack.of(self).account}:table/{cf_param_security_lake_db.value_as_string}/{cf_param_security_lake_table.value_as_string}"
+                            f"arn:aws:glue:{Stack.of(self).region}:{Stack.of(self).account}:table/{cf_param_security_lake_db.value_as_string}/*"
+                            ] + [
+                            arn
+                            for region in other_regions
+                            for arn in [
+                                f"arn:aws:glue:{region}:{Stack.of(self).account}:catalog",
+                                f"arn:aws:glue:{region}:{Stack.of(self).account}:database/amazon_security_lake_glue_db_{region.replace('-', '_')}",
+                                f"arn:aws:glue:{region}:{Stack.of(self).account}:table/amazon_security_lake_glue_db_{region.replace('-', '_')}/*",
+                                ]
                             ]
                         )
                     ]
@@ -182,6 +203,18 @@ class RowLevelSecurityLakeStack(Stack):
                         )
                     ]
                 ),
+                # lets a run that is running out of time hand over to a new invocation
+                "LambdaResume": _iam.PolicyDocument(
+                    statements=[_iam.PolicyStatement(
+                        actions=[
+                            "lambda:InvokeFunction"
+                        ],
+                        resources=[
+                            f"arn:aws:lambda:{Stack.of(self).region}:{Stack.of(self).account}:function:RLSecLakeLambda"
+                            ]
+                        )
+                    ]
+                ),
                 }
         )
 
@@ -210,10 +243,16 @@ class RowLevelSecurityLakeStack(Stack):
                 'account_id': Stack.of(self).account,
                 'security_lake_db': cf_param_security_lake_db.value_as_string,
                 'security_lake_table': cf_param_security_lake_table.value_as_string,
+                'group_by_tag': self.node.try_get_context('group_by_tag') or '',
+                'security_lake_regions': security_lake_regions,
             },
             role=rl_sec_lake_lambda_role,
             timeout=cdk.Duration.minutes(5),
-            memory_size=512
+            memory_size=512,
+            # one invocation at a time, so change events, resyncs and the full sync
+            # never write the snapshot and Lake Formation over each other. the others
+            # wait in the lambda's async queue until it is free
+            reserved_concurrent_executions=1
         )
 
         # permissions needed for custom resource lambda
@@ -266,21 +305,71 @@ class RowLevelSecurityLakeStack(Stack):
             on_event_handler=custom_resource_lambda
             )
 
+        # a resync_scope, eg '{"ou_paths": ["OU=root,OU=Team"]}', is applied on the next
+        # deploy without waiting for the scheduled run or walking the whole org
+        resync_scope = self.node.try_get_context('resync_scope') or ''
+        if not isinstance(resync_scope, str):
+            resync_scope = json.dumps(resync_scope)
+
         cdk.CustomResource(
             scope=self,
             id='RLSecLakeCustomResource',
             service_token=provider.service_token,
             removal_policy=cdk.RemovalPolicy.DESTROY,
-            resource_type="Custom::RLSecLakeCustomResource"
+            resource_type="Custom::RLSecLakeCustomResource",
+            properties={
+                'Scope': resync_scope
+            }
         )
 
-        # eventbridge schedule trigger to run lambda every hour
+        # eventbridge schedule trigger to run a full walk of the org, this is a
+        # consistency sweep as org changes are also applied as they happen
         rule = _events.Rule(self, "LambdaTriggerRule",
-            schedule=_events.Schedule.rate(cdk.Duration.hours(1))
+            schedule=_events.Schedule.rate(cdk.Duration.hours(self.node.try_get_context('full_sync_interval_hours') or 1))
         )
 
         rule.add_target(_targets.LambdaFunction(rl_sec_lake_lambda))
 
+        # apply organizations changes to the stored org snapshot as they happen.
+        # organizations only publishes these events in us-east-1 of the management
+        # account, so they need forwarding to this event bus when deployed elsewhere
+        org_change_rule = _events.Rule(self, "OrgChangeRule",
+            event_pattern=_events.EventPattern(
+                source=["aws.organizations"],
+                detail_type=[
+                    "AWS API Call via CloudTrail",
+                    "AWS Service Event via CloudTrail"
+                ],
+                detail={
+                    "eventName": [
+                        "MoveAccount",
+                        "CreateAccount",
+                        "CreateAccountResult",
+                        "AcceptHandshake",
+                        "RemoveAccountFromOrganization",
+                        "LeaveOrganization",
+                        "CreateOrganizationalUnit",
+                        "UpdateOrganizationalUnit",
+                        "DeleteOrganizationalUnit",
+                        "TagResource",
+                        "UntagResource"
+                    ]
+                }
+            )
+        )
+
+        org_change_rule.add_target(_targets.LambdaFunction(rl_sec_lake_lambda))
+
+        # compacts the metadata tables and expires their old snapshots on its own
+        # schedule, so the hourly sync doesn't wait for it
+        maintenance_rule = _events.Rule(self, "MaintenanceRule",
+            schedule=_events.Schedule.rate(cdk.Duration.hours(self.node.try_get_context('maintenance_interval_hours') or 24))
+        )
+
+        maintenance_rule.add_target(_targets.LambdaFunction(rl_sec_lake_lambda,
+            event=_events.RuleTargetInput.from_object({'maintenance': True})
+        ))
+
         # CDK needs ability to manage permissions in Lake Formation
         admin_permissions = _lakeformation.CfnDataLakeSettings(
             self, "DataLakeSettings",
@@ -333,6 +422,8 @@ class RowLevelSecurityLakeStack(Stack):
         # rl_sec_lake_s3_permissions.add_dependency(metadata_bucket)
         rl_sec_lake_s3_permissions.add_dependency(admin_permissions)
 
+        # SELECT on every table in the Security Lake database, so tables matched by a
+        # pattern, including ones Security Lake adds later, can be filtered and shared
         rl_sec_lake_sec_lake_permissions = _lakeformation.CfnPermissions(self, "ExistingSecLakeTablePermissions",
             data_lake_principal=_lakeformation.CfnPermissions.DataLakePrincipalProperty(
                 data_lake_principal_identifier=rl_sec_lake_lambda_role.role_arn
@@ -341,7 +432,7 @@ class RowLevelSecurityLakeStack(Stack):
                 table_resource=_lakeformation.CfnPermissions.TableResourceProperty(
                     catalog_id=cdk.Aws.ACCOUNT_ID,
                     database_name=cf_param_security_lake_db.value_as_string,
-                    name=cf_param_security_lake_table.value_as_string
+                    table_wildcard=_lakeformation.CfnPermissions.TableWildcardProperty()
                 ),
             ),
             permissions=["SELECT"],
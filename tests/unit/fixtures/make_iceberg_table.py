@@ -0,0 +1,174 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Writes the small ou_groups Iceberg table in iceberg/ou_groups that the reader
+# tests use. Run it again after changing the table, it needs fastavro and pyarrow.
+#
+# The current snapshot has two data files, a data file the snapshot removed, and
+# a position delete file for a row that was updated, as Athena UPDATE writes it.
+# File paths are the table's s3:// location, the tests map it to this directory.
+
+import json
+import os
+import shutil
+
+import fastavro
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+TABLE_LOCATION = 's3://metadata-bucket/ou_groups'
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'iceberg', 'ou_groups')
+
+SNAPSHOT_ID = 2000
+PARENT_SNAPSHOT_ID = 1000
+
+# trimmed down Iceberg v2 manifest schemas, with the nested types Iceberg writes
+DATA_FILE_SCHEMA = {
+    'type': 'record',
+    'name': 'r2',
+    'fields': [
+        {'name': 'content', 'type': 'int'},
+        {'name': 'file_path', 'type': 'string'},
+        {'name': 'file_format', 'type': 'string'},
+        {'name': 'partition', 'type': {'type': 'record', 'name': 'r102', 'fields': []}},
+        {'name': 'record_count', 'type': 'long'},
+        {'name': 'file_size_in_bytes', 'type': 'long'},
+        {'name': 'column_sizes', 'type': ['null', {
+            'type': 'array',
+            'logicalType': 'map',
+            'items': {'type': 'record', 'name': 'k117_v118', 'fields': [{'name': 'key', 'type': 'int'}, {'name': 'value', 'type': 'long'}]}
+        }], 'default': None},
+        {'name': 'lower_bounds', 'type': ['null', {
+            'type': 'array',
+            'logicalType': 'map',
+            'items': {'type': 'record', 'name': 'k126_v127', 'fields': [{'name': 'key', 'type': 'int'}, {'name': 'value', 'type': 'bytes'}]}
+        }], 'default': None},
+        {'name': 'key_metadata', 'type': ['null', 'bytes'], 'default': None},
+        {'name': 'split_offsets', 'type': ['null', {'type': 'array', 'items': 'long'}], 'default': None},
+        {'name': 'sort_order_id', 'type': ['null', 'int'], 'default': None},
+    ]
+}
+
+MANIFEST_ENTRY_SCHEMA = {
+    'type': 'record',
+    'name': 'manifest_entry',
+    'fields': [
+        {'name': 'status', 'type': 'int'},
+        {'name': 'snapshot_id', 'type': ['null', 'long'], 'default': None},
+        {'name': 'sequence_number', 'type': ['null', 'long'], 'default': None},
+        {'name': 'file_sequence_number', 'type': ['null', 'long'], 'default': None},
+        {'name': 'data_file', 'type': DATA_FILE_SCHEMA},
+    ]
+}
+
+MANIFEST_FILE_SCHEMA = {
+    'type': 'record',
+    'name': 'manifest_file',
+    'fields': [
+        {'name': 'manifest_path', 'type': 'string'},
+        {'name': 'manifest_length', 'type': 'long'},
+        {'name': 'partition_spec_id', 'type': 'int'},
+        {'name': 'content', 'type': 'int'},
+        {'name': 'sequence_number', 'type': 'long'},
+        {'name': 'min_sequence_number', 'type': 'long'},
+        {'name': 'added_snapshot_id', 'type': 'long'},
+    ]
+}
+
+
+def table_uri(path):
+    return TABLE_LOCATION+'/'+path
+
+
+def write_parquet(path, columns):
+    pq.write_table(pa.table(columns), os.path.join(TABLE_DIR, path))
+    return os.path.getsize(os.path.join(TABLE_DIR, path))
+
+
+def data_file(content, path, record_count, size):
+    return {
+        'content': content,
+        'file_path': table_uri(path),
+        'file_format': 'PARQUET',
+        'partition': {},
+        'record_count': record_count,
+        'file_size_in_bytes': size,
+        'column_sizes': [{'key': 1, 'value': size}],
+        'lower_bounds': [{'key': 1, 'value': b'OU=root'}],
+        'key_metadata': None,
+        'split_offsets': [4],
+        'sort_order_id': 0,
+    }
+
+
+def entry(status, snapshot_id, sequence_number, file):
+    return {
+        'status': status,
+        'snapshot_id': snapshot_id,
+        'sequence_number': sequence_number,
+        'file_sequence_number': sequence_number,
+        'data_file': file,
+    }
+
+
+def write_avro(path, schema, records, codec):
+    with open(os.path.join(TABLE_DIR, path), 'wb') as f:
+        fastavro.writer(f, fastavro.parse_schema(schema), records, codec=codec, metadata={'format-version': '2'})
+
+    return os.path.getsize(os.path.join(TABLE_DIR, path))
+
+
+def main():
+    shutil.rmtree(TABLE_DIR, ignore_errors=True)
+    os.makedirs(os.path.join(TABLE_DIR, 'data'))
+    os.makedirs(os.path.join(TABLE_DIR, 'metadata'))
+
+    first = write_parquet('data/00000-first.parquet', {
+        'ou': ['OU=root', 'OU=root,OU=Security', 'OU=root,OU=Workloads'],
+        'consumer_aws_account_id': ['', '111111111111', ''],
+    })
+    # UPDATE ou_groups SET consumer_aws_account_id = '222222222222,333333333333' WHERE ou = 'OU=root,OU=Workloads'
+    updated = write_parquet('data/00001-update.parquet', {
+        'ou': ['OU=root,OU=Workloads'],
+        'consumer_aws_account_id': ['222222222222,333333333333'],
+    })
+    deletes = write_parquet('data/00001-deletes.parquet', {
+        'file_path': [table_uri('data/00000-first.parquet')],
+        'pos': pa.array([2], pa.int64()),
+    })
+
+    data_manifest = write_avro('metadata/data-m0.avro', MANIFEST_ENTRY_SCHEMA, [
+        entry(0, PARENT_SNAPSHOT_ID, 1, data_file(0, 'data/00000-first.parquet', 3, first)),
+        entry(1, SNAPSHOT_ID, 2, data_file(0, 'data/00001-update.parquet', 1, updated)),
+        # removed by a rewrite in this snapshot, it isn't in the directory any more
+        entry(2, SNAPSHOT_ID, 1, data_file(0, 'data/00000-removed.parquet', 5, 100)),
+    ], 'deflate')
+    delete_manifest = write_avro('metadata/deletes-m0.avro', MANIFEST_ENTRY_SCHEMA, [
+        entry(1, SNAPSHOT_ID, 2, data_file(1, 'data/00001-deletes.parquet', 1, deletes)),
+    ], 'null')
+
+    write_avro('metadata/snap-'+str(SNAPSHOT_ID)+'.avro', MANIFEST_FILE_SCHEMA, [
+        {'manifest_path': table_uri('metadata/data-m0.avro'), 'manifest_length': data_manifest, 'partition_spec_id': 0,
+         'content': 0, 'sequence_number': 2, 'min_sequence_number': 1, 'added_snapshot_id': SNAPSHOT_ID},
+        {'manifest_path': table_uri('metadata/deletes-m0.avro'), 'manifest_length': delete_manifest, 'partition_spec_id': 0,
+         'content': 1, 'sequence_number': 2, 'min_sequence_number': 2, 'added_snapshot_id': SNAPSHOT_ID},
+    ], 'deflate')
+
+    metadata = {
+        'format-version': 2,
+        'table-uuid': '6f0ed7c2-3c64-4c4f-9a1e-3c1d2f4b5a60',
+        'location': TABLE_LOCATION,
+        'last-sequence-number': 2,
+        'current-snapshot-id': SNAPSHOT_ID,
+        'snapshots': [
+            # an older snapshot whose manifest list has been expired
+            {'snapshot-id': PARENT_SNAPSHOT_ID, 'sequence-number': 1, 'manifest-list': table_uri('metadata/snap-'+str(PARENT_SNAPSHOT_ID)+'.avro')},
+            {'snapshot-id': SNAPSHOT_ID, 'parent-snapshot-id': PARENT_SNAPSHOT_ID, 'sequence-number': 2, 'manifest-list': table_uri('metadata/snap-'+str(SNAPSHOT_ID)+'.avro')},
+        ],
+    }
+    with open(os.path.join(TABLE_DIR, 'metadata', '00002-current.metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import time
+
+from botocore.exceptions import ClientError
+
+from checkpoint import (
+    CHECKPOINT_LEASE_SECONDS,
+    new_checkpoint,
+    load_checkpoint,
+    take_lease,
+    is_checkpoint_active,
+    record_failure,
+    abandon_checkpoint,
+    hand_over,
+)
+
+SNAPSHOT = {'org_id': 'o-a1b2c3d4e5', 'root_id': 'r-ab12', 'ous': {}, 'accounts': {}}
+
+
+class FakeS3:
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, 'GetObject')
+
+        return {'Body': FakeBody(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class FakeBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeLambda:
+
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.payloads.append(json.loads(Payload))
+
+
+class FakeContext:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:111111111111:function:RLSecLakeLambda'
+
+
+def test_run_is_active_while_leased():
+    checkpoint = new_checkpoint('full', SNAPSHOT, None)
+    assert not is_checkpoint_active(checkpoint)
+
+    take_lease(checkpoint)
+    assert is_checkpoint_active(checkpoint)
+    assert checkpoint['lease_until'] >= time.time()+CHECKPOINT_LEASE_SECONDS-5
+
+    checkpoint['lease_until'] = time.time()-1
+    assert not is_checkpoint_active(checkpoint)
+
+
+def test_hand_over_keeps_the_lease():
+    s3_client = FakeS3()
+    lambda_client = FakeLambda()
+    checkpoint = new_checkpoint('full', SNAPSHOT, None)
+
+    assert hand_over(s3_client, lambda_client, 'bucket', checkpoint, FakeContext())
+
+    saved = load_checkpoint(s3_client, 'bucket', 'full')
+    assert saved['resumes'] == 1
+    assert is_checkpoint_active(saved)
+    assert lambda_client.payloads == [{'resume': {'run_id': checkpoint['run_id'], 'kind': 'full'}}]
+
+
+def test_failed_full_sync_is_recorded_and_released():
+    s3_client = FakeS3()
+    checkpoint = new_checkpoint('full', SNAPSHOT, None)
+    take_lease(checkpoint)
+
+    record_failure(s3_client, 'bucket', checkpoint, RuntimeError('AccessDeniedException'))
+
+    saved = load_checkpoint(s3_client, 'bucket', 'full')
+    assert saved['error'] == 'AccessDeniedException'
+    assert not is_checkpoint_active(saved)
+
+
+def test_failed_event_run_is_dropped():
+    s3_client = FakeS3()
+    checkpoint = new_checkpoint('event', SNAPSHOT, set(['OU=root']))
+    take_lease(checkpoint)
+
+    record_failure(s3_client, 'bucket', checkpoint, RuntimeError('AccessDeniedException'))
+
+    assert load_checkpoint(s3_client, 'bucket', 'event', checkpoint['run_id']) is None
+
+
+def test_abandoned_run_replays_the_changes_waiting_on_it():
+    s3_client = FakeS3()
+    lambda_client = FakeLambda()
+    checkpoint = new_checkpoint('full', SNAPSHOT, None)
+    events = [{'scope': {'ou_ids': ['ou-ab12-11111111']}}, {'scope': {'consumers': ['222222222222']}}]
+    checkpoint['pending_events'] = list(events)
+    record_failure(s3_client, 'bucket', checkpoint, RuntimeError('AccessDeniedException'))
+
+    abandon_checkpoint(s3_client, lambda_client, 'bucket', load_checkpoint(s3_client, 'bucket', 'full'), FakeContext())
+
+    assert lambda_client.payloads == events
+    assert load_checkpoint(s3_client, 'bucket', 'full') is None
@@ -0,0 +1,64 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import importlib.util
+import json
+import os
+
+import pytest
+
+CUSTOM_RESOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'custom_resource', 'lambda_function.py')
+
+
+class FakeLambda:
+
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload=None):
+        self.payloads.append(json.loads(Payload))
+        return {'StatusCode': 202}
+
+
+@pytest.fixture
+def custom_resource(monkeypatch):
+    # the handler has the same module name as the RLSecLake lambda, so it is loaded from its path
+    monkeypatch.setenv('rlseclake_lambda_arn', 'arn:aws:lambda:us-east-1:111111111111:function:RLSecLakeLambda')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    spec = importlib.util.spec_from_file_location('custom_resource_function', CUSTOM_RESOURCE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.client = FakeLambda()
+    return module
+
+
+def update(scope):
+    return {'RequestType': 'Update', 'ResourceProperties': {'Scope': scope}}
+
+
+def test_update_resyncs_the_scope(custom_resource):
+    custom_resource.on_event(update('{"ou_paths": ["OU=root,OU=Payments"], "consumer_account_ids": "123456789012"}'), None)
+
+    assert custom_resource.client.payloads == [{'scope': {'ou_paths': ['OU=root,OU=Payments'], 'consumer_account_ids': '123456789012'}}]
+
+
+def test_update_without_a_scope_does_nothing(custom_resource):
+    assert custom_resource.on_event(update(''), None) is None
+    assert custom_resource.client.payloads == []
+
+
+@pytest.mark.parametrize('scope, reason', [
+    ('{"ou_paths": ["OU=root"]', 'not valid JSON'),
+    ("{'ou_paths': ['OU=root']}", 'not valid JSON'),
+    ('["OU=root"]', 'must be a JSON object'),
+    ('{"ou_path": ["OU=root"]}', 'unknown keys'),
+    ('{"ou_ids": [123]}', 'must be a string or a list of strings'),
+    ('{"ou_ids": {"id": "ou-ab12-11111111"}}', 'must be a string or a list of strings'),
+    ('{"ou_ids": []}', 'needs at least one of'),
+    ('{}', 'needs at least one of'),
+])
+def test_update_with_a_bad_scope_fails_before_invoking(custom_resource, scope, reason):
+    with pytest.raises(Exception, match=reason):
+        custom_resource.on_event(update(scope), None)
+
+    assert custom_resource.client.payloads == []
@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import copy
+import time
+
+import fingerprint
+from fingerprint import compute_fingerprint, is_unchanged
+
+ROOT_ID = 'r-ab12'
+
+SNAPSHOT = {
+    'org_id': 'o-a1b2c3d4e5',
+    'root_id': ROOT_ID,
+    'ous': {
+        ROOT_ID: {'name': 'root', 'parent_id': None, 'path': 'OU=root'},
+        'ou-ab12-11111111': {'name': 'Security', 'parent_id': ROOT_ID, 'path': 'OU=root,OU=Security'},
+    },
+    'accounts': {
+        '222222222222': {'name': 'Log Archive', 'ou_id': 'ou-ab12-11111111', 'tags': {'team': 'security'}},
+        '333333333333': {'name': 'Payments', 'ou_id': ROOT_ID, 'tags': {'team': 'payments'}},
+    },
+    'taken_at': 1700000000.0,
+    'fetched_at': {'ous': {ROOT_ID: 1700000000.0}, 'tags': {'222222222222': 1700000000.0}},
+}
+
+MAPPINGS = {'OU=root,OU=Security': ['444444444444'], 'TAG=team=payments': ['555555555555']}
+
+SETTINGS = {
+    'metadata_database': 'aws_account_metadata_db',
+    'security_lake': {
+        'database': 'amazon_security_lake_glue_db_us_east_1',
+        'account_columns': {
+            'us-east-1': {'amazon_security_lake_table_us_east_1_sh_findings_2_0': 'accountid'},
+        },
+    },
+    'group_by_tag': ['team'],
+    'filter_expression_max_length': 2048,
+    'filter_name_version': 2,
+}
+
+
+def stored(snapshot=SNAPSHOT, mappings=MAPPINGS, settings=SETTINGS, applied_at=None):
+    return {
+        'fingerprint': compute_fingerprint(snapshot, mappings, settings),
+        'run_id': 'a1b2c3',
+        'applied_at': time.time() if applied_at is None else applied_at,
+    }
+
+
+def test_same_org_and_mappings_are_unchanged():
+    snapshot = copy.deepcopy(SNAPSHOT)
+    # the same org walked in another order
+    snapshot['accounts'] = dict(reversed(list(snapshot['accounts'].items())))
+
+    assert is_unchanged(stored(), compute_fingerprint(snapshot, dict(MAPPINGS), copy.deepcopy(SETTINGS)))
+
+
+def test_nothing_stored_is_a_change():
+    assert not is_unchanged(None, compute_fingerprint(SNAPSHOT, MAPPINGS, SETTINGS))
+
+
+def test_tag_fetch_times_are_not_a_change():
+    snapshot = copy.deepcopy(SNAPSHOT)
+    snapshot['taken_at'] = 1700090000.0
+    snapshot['fetched_at']['tags'] = {'222222222222': 1700090000.0, '333333333333': 1700090000.0}
+    snapshot['fetched_at']['ous']['ou-ab12-11111111'] = 1700090000.0
+
+    assert is_unchanged(stored(), compute_fingerprint(snapshot, MAPPINGS, SETTINGS))
+
+
+def test_org_changes_are_a_change():
+    moved = copy.deepcopy(SNAPSHOT)
+    moved['accounts']['333333333333']['ou_id'] = 'ou-ab12-11111111'
+
+    retagged = copy.deepcopy(SNAPSHOT)
+    retagged['accounts']['333333333333']['tags']['team'] = 'platform'
+
+    renamed = copy.deepcopy(SNAPSHOT)
+    renamed['ous']['ou-ab12-11111111']['path'] = 'OU=root,OU=SecOps'
+
+    for snapshot in (moved, retagged, renamed):
+        assert not is_unchanged(stored(), compute_fingerprint(snapshot, MAPPINGS, SETTINGS))
+
+
+def test_mapping_changes_are_a_change():
+    new_consumer = dict(MAPPINGS, **{'OU=root,OU=Security': ['444444444444', '666666666666']})
+    unshared = {'OU=root,OU=Security': ['444444444444']}
+    newly_shared = dict(MAPPINGS, **{'OU=root': ['444444444444']})
+
+    for mappings in (new_consumer, unshared, newly_shared):
+        assert not is_unchanged(stored(), compute_fingerprint(SNAPSHOT, mappings, SETTINGS))
+
+
+def test_security_lake_table_changes_are_a_change():
+    new_table = copy.deepcopy(SETTINGS)
+    new_table['security_lake']['account_columns']['us-east-1']['amazon_security_lake_table_us_east_1_vpc_flow_2_0'] = 'accountid'
+
+    new_column = copy.deepcopy(SETTINGS)
+    new_column['security_lake']['account_columns']['us-east-1']['amazon_security_lake_table_us_east_1_sh_findings_2_0'] = 'cloud.account.uid'
+
+    new_region = copy.deepcopy(SETTINGS)
+    new_region['security_lake']['account_columns']['eu-west-1'] = {'amazon_security_lake_table_eu_west_1_sh_findings_2_0': 'accountid'}
+
+    for settings in (new_table, new_column, new_region):
+        assert not is_unchanged(stored(), compute_fingerprint(SNAPSHOT, MAPPINGS, settings))
+
+
+def test_old_apply_is_a_change():
+    current = compute_fingerprint(SNAPSHOT, MAPPINGS, SETTINGS)
+    max_age_seconds = fingerprint.FINGERPRINT_MAX_AGE_HOURS*3600
+
+    assert is_unchanged(stored(applied_at=time.time()-max_age_seconds+60), current)
+    assert not is_unchanged(stored(applied_at=time.time()-max_age_seconds-60), current)
+    assert not is_unchanged({'fingerprint': current}, current)
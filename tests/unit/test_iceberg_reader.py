@@ -0,0 +1,95 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import json
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from iceberg_reader import FileReader, read_avro_records, read_iceberg_records, get_iceberg_metadata_location
+
+# written by fixtures/make_iceberg_table.py, with its files under s3://metadata-bucket/ou_groups
+TABLE_LOCATION = 's3://metadata-bucket/ou_groups'
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'iceberg', 'ou_groups')
+METADATA_LOCATION = TABLE_LOCATION+'/metadata/00002-current.metadata.json'
+
+
+class FixtureReader(FileReader):
+    # reads the table's s3:// files from the fixture directory
+
+    def resolve(self, uri):
+        if uri.startswith(TABLE_LOCATION+'/'):
+            return self.local, os.path.join(TABLE_DIR, uri[len(TABLE_LOCATION)+1:])
+
+        return FileReader.resolve(self, uri)
+
+
+def read_fixture(name):
+    with open(os.path.join(TABLE_DIR, name), 'rb') as f:
+        return f.read()
+
+
+def test_reads_live_rows_of_current_snapshot():
+    records = read_iceberg_records(METADATA_LOCATION, FixtureReader())
+
+    # the updated row comes from the new data file, its old version is deleted by
+    # position and the file the snapshot removed isn't read at all
+    assert sorted(records, key=lambda record: record['ou']) == [
+        {'ou': 'OU=root', 'consumer_aws_account_id': ''},
+        {'ou': 'OU=root,OU=Security', 'consumer_aws_account_id': '111111111111'},
+        {'ou': 'OU=root,OU=Workloads', 'consumer_aws_account_id': '222222222222,333333333333'},
+    ]
+
+
+def test_reads_gzipped_metadata(tmp_path):
+    metadata_path = tmp_path / '00002-current.gz.metadata.json'
+    metadata_path.write_bytes(gzip.compress(read_fixture('metadata/00002-current.metadata.json')))
+
+    records = read_iceberg_records(str(metadata_path), FixtureReader())
+
+    assert len(records) == 3
+
+
+def test_table_without_snapshot_is_empty(tmp_path):
+    metadata_path = tmp_path / '00000-empty.metadata.json'
+    metadata_path.write_text(json.dumps({'format-version': 2, 'current-snapshot-id': -1, 'snapshots': []}))
+
+    assert read_iceberg_records(str(metadata_path), FixtureReader()) == []
+
+
+def test_decodes_manifest_list():
+    manifests = read_avro_records(read_fixture('metadata/snap-2000.avro'))
+
+    assert [(manifest['manifest_path'], manifest['content']) for manifest in manifests] == [
+        (TABLE_LOCATION+'/metadata/data-m0.avro', 0),
+        (TABLE_LOCATION+'/metadata/deletes-m0.avro', 1),
+    ]
+
+
+def test_decodes_manifest_entries():
+    # deflate compressed, with unions, nested records and map arrays
+    entries = read_avro_records(read_fixture('metadata/data-m0.avro'))
+
+    assert [entry['status'] for entry in entries] == [0, 1, 2]
+    assert entries[0]['snapshot_id'] == 1000
+    assert entries[0]['data_file']['file_path'] == TABLE_LOCATION+'/data/00000-first.parquet'
+    assert entries[0]['data_file']['record_count'] == 3
+    assert entries[0]['data_file']['partition'] == {}
+    assert entries[0]['data_file']['lower_bounds'] == [{'key': 1, 'value': b'OU=root'}]
+    assert entries[0]['data_file']['key_metadata'] is None
+
+
+def test_rejects_files_that_are_not_avro():
+    with pytest.raises(ValueError):
+        read_avro_records(read_fixture('metadata/00002-current.metadata.json'))
+
+
+def test_metadata_location_of_iceberg_table():
+    table = {'Name': 'ou_groups', 'Parameters': {'table_type': 'ICEBERG', 'metadata_location': METADATA_LOCATION}}
+
+    assert get_iceberg_metadata_location(table) == METADATA_LOCATION
+    with pytest.raises(ValueError):
+        get_iceberg_metadata_location({'Name': 'ou_groups', 'Parameters': {'table_type': 'EXTERNAL_TABLE'}})
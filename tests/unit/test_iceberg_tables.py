@@ -0,0 +1,160 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import re
+import sys
+import types
+
+import pytest
+from botocore.exceptions import ClientError
+
+from iceberg_tables import DELETE_BATCH_SIZE, TABLE_STATE_PREFIX, upsert_iceberg_table
+
+DATABASE = 'aws_account_metadata_db'
+TABLE = 'account_metadata'
+BUCKET = 'metadata-bucket'
+
+
+class FakeS3:
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, 'GetObject')
+
+        return {'Body': FakeBody(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+
+class FakeBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class FakeGlue:
+    # a table that isn't Iceberg as far as its parameters go, so it is read through Athena
+
+    def __init__(self, exists):
+        self.exists = exists
+
+    def get_table(self, DatabaseName, Name):
+        if not self.exists:
+            raise ClientError({'Error': {'Code': 'EntityNotFoundException'}}, 'GetTable')
+
+        return {'Table': {'DatabaseName': DatabaseName, 'Name': Name, 'Parameters': {}}}
+
+
+class FakeAthena:
+    # the parts of awswrangler.athena upsert_iceberg_table uses, kept against a dict of rows by id
+
+    def __init__(self, rows):
+        self.rows = dict((row['id'], dict(row)) for row in rows)
+        self.merged = []
+        self.statements = []
+
+    def to_iceberg(self, df, database, table, merge_cols=None, **kwargs):
+        for row in df.to_dict('records'):
+            self.merged.append(row)
+            self.rows[row['id']] = row
+
+    def start_query_execution(self, sql, database, wait=False):
+        self.statements.append(sql)
+        match = re.match(r'DELETE FROM "account_metadata" WHERE "id" IN \((.*)\)$', sql)
+        for key in re.findall(r"'([^']*)'", match.group(1)):
+            self.rows.pop(key, None)
+
+    def read_sql_query(self, sql, database, **kwargs):
+        import pandas as pd
+
+        assert sql == 'SELECT * FROM "account_metadata"'
+        return pd.DataFrame(list(self.rows.values()))
+
+
+@pytest.fixture
+def athena(monkeypatch):
+    def install(rows=()):
+        athena = FakeAthena(rows)
+        monkeypatch.setitem(sys.modules, 'awswrangler', types.SimpleNamespace(athena=athena))
+        return athena
+
+    return install
+
+
+def account(account_id, name, ou='OU=root'):
+    return {'id': account_id, 'name': name, 'ou': ou}
+
+
+def write(s3_client, glue_client, records):
+    upsert_iceberg_table(s3_client, glue_client, DATABASE, TABLE, records, BUCKET)
+
+
+def saved_state(s3_client):
+    return json.loads(s3_client.objects[TABLE_STATE_PREFIX+TABLE+'.json'])
+
+
+def test_upsert_writes_only_the_difference(athena):
+    s3_client = FakeS3()
+    before = [account('222222222222', 'Log Archive'), account('333333333333', 'Payments'), account('444444444444', 'Sandbox')]
+    athena(before)
+    write(s3_client, FakeGlue(exists=True), before)
+
+    wrangler = athena(before)
+    write(s3_client, FakeGlue(exists=True), [
+        account('222222222222', 'Log Archive'),
+        account('333333333333', 'Payments', 'OU=root,OU=Finance'),
+        account('555555555555', 'Data'),
+    ])
+
+    assert sorted(row['id'] for row in wrangler.merged) == ['333333333333', '555555555555']
+    assert wrangler.statements == ['DELETE FROM "account_metadata" WHERE "id" IN (\'444444444444\')']
+    assert sorted(wrangler.rows) == ['222222222222', '333333333333', '555555555555']
+    assert wrangler.rows['333333333333']['ou'] == 'OU=root,OU=Finance'
+    assert sorted(saved_state(s3_client)['rows']) == ['222222222222', '333333333333', '555555555555']
+
+
+def test_upsert_skips_an_unchanged_table(athena):
+    s3_client = FakeS3()
+    records = [account('222222222222', 'Log Archive')]
+    athena(records)
+    write(s3_client, FakeGlue(exists=True), records)
+
+    wrangler = athena(records)
+    write(s3_client, FakeGlue(exists=True), [dict(record) for record in records])
+
+    assert wrangler.merged == []
+    assert wrangler.statements == []
+
+
+def test_upsert_without_state_deletes_what_the_table_no_longer_needs(athena):
+    # an org of many accounts written by an older version of the lambda, which didn't
+    # keep the state. only the accounts that have gone are named, in batches
+    kept = [account(str(100000000000+index), 'Kept') for index in range(3*DELETE_BATCH_SIZE)]
+    gone = [account(str(200000000000+index), 'Gone') for index in range(2*DELETE_BATCH_SIZE+1)]
+    s3_client = FakeS3()
+    wrangler = athena(kept+gone)
+
+    write(s3_client, FakeGlue(exists=True), kept)
+
+    assert len(wrangler.statements) == 3
+    assert all(' NOT IN ' not in sql and len(sql) < 262144 for sql in wrangler.statements)
+    assert sorted(wrangler.rows) == sorted(row['id'] for row in kept)
+    assert len(saved_state(s3_client)['rows']) == len(kept)
+
+
+def test_upsert_creates_a_missing_table(athena):
+    s3_client = FakeS3()
+    wrangler = athena()
+
+    write(s3_client, FakeGlue(exists=False), [account('222222222222', 'Log Archive')])
+
+    assert list(wrangler.rows) == ['222222222222']
+    assert wrangler.statements == []
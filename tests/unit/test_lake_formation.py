@@ -0,0 +1,244 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+
+from lake_formation import (
+    ACCOUNT_METADATA_FILTER_PREFIX,
+    SECURITY_LAKE_FILTER_PREFIX,
+    MAX_FILTER_NAME_LENGTH,
+    PERMISSIONS_BATCH_SIZE,
+    apply_grants,
+    group_filter_name,
+    plan_grants,
+    sweep_orphan_filters,
+)
+from org_index import tag_group_key
+from row_filters import build_row_filters, unshard_filter_name
+
+CATALOG_ID = '111111111111'
+DATABASE = 'amazon_security_lake_glue_db_us_east_1'
+TABLE = 'amazon_security_lake_table_us_east_1_sh_findings_2_0'
+
+
+class FakeLakeFormation:
+    # the data cells filters and their SELECT grants on one table. revokes of the
+    # filters in failing_revokes fail, and their grants stay in place
+
+    def __init__(self, filters, grants=(), failing_revokes=()):
+        self.filters = dict((name, 'accountid IN (\'\')') for name in filters)
+        self.grants = set(grants)
+        self.failing_revokes = set(failing_revokes)
+        self.revoke_batches = []
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    def list_data_cells_filter(self, Table, NextToken=None, MaxResults=None):
+        # two filters a page, so paging is exercised as well
+        names = sorted(self.filters)
+        start = int(NextToken or 0)
+        response = {'DataCellsFilters': [{'Name': name, 'RowFilter': {'FilterExpression': self.filters[name]}} for name in names[start:start+2]]}
+        if start+2 < len(names):
+            response['NextToken'] = str(start+2)
+
+        return response
+
+    def list_permissions(self, CatalogId, Resource, IncludeRelated=None, NextToken=None):
+        return {'PrincipalResourcePermissions': [{
+            'Principal': {'DataLakePrincipalIdentifier': principal},
+            'Resource': {'DataCellsFilter': {'TableCatalogId': CatalogId, 'DatabaseName': DATABASE, 'TableName': TABLE, 'Name': name}},
+            'Permissions': ['SELECT'],
+        } for name, principal in sorted(self.grants)]}
+
+    def batch_revoke_permissions(self, CatalogId, Entries):
+        failures = []
+        with self.lock:
+            self.revoke_batches.append(Entries)
+            for entry in Entries:
+                grant = (entry['Resource']['DataCellsFilter']['Name'], entry['Principal']['DataLakePrincipalIdentifier'])
+                if grant[0] in self.failing_revokes:
+                    failures.append({'RequestEntry': entry, 'Error': {'ErrorCode': 'AccessDeniedException', 'ErrorMessage': 'denied'}})
+                else:
+                    self.grants.discard(grant)
+
+        return {'Failures': failures}
+
+    def delete_data_cells_filter(self, TableCatalogId, DatabaseName, TableName, Name):
+        with self.lock:
+            del self.filters[Name]
+            self.deleted.append(Name)
+
+
+def test_filter_names_are_readable():
+    name = group_filter_name(ACCOUNT_METADATA_FILTER_PREFIX, 'OU=root,OU=Security')
+
+    assert name.startswith('account_metadata_filter_OU_root_OU_Security_')
+    assert name == group_filter_name(ACCOUNT_METADATA_FILTER_PREFIX, 'OU=root,OU=Security')
+
+
+def test_groups_that_read_the_same_get_different_filters():
+    # both read TAG_cost_center_x once = and , are mapped to _
+    first = group_filter_name(SECURITY_LAKE_FILTER_PREFIX, tag_group_key('cost_center', 'x'))
+    second = group_filter_name(SECURITY_LAKE_FILTER_PREFIX, tag_group_key('cost', 'center_x'))
+
+    assert first.startswith('security_lake_filter_TAG_cost_center_x_')
+    assert second.startswith('security_lake_filter_TAG_cost_center_x_')
+    assert first != second
+
+    # an OU called A_OU_B and an OU B below an OU A
+    assert group_filter_name(SECURITY_LAKE_FILTER_PREFIX, 'OU=root,OU=A_OU_B') != group_filter_name(SECURITY_LAKE_FILTER_PREFIX, 'OU=root,OU=A,OU=B')
+
+
+def test_long_groups_fit_with_shards():
+    group = tag_group_key('description', 'x'*256)
+    name = group_filter_name(ACCOUNT_METADATA_FILTER_PREFIX, group)
+    shards = build_row_filters(name, 'id', [str(100000000000+i) for i in range(2000)], 200)
+
+    assert len(shards) > 100
+    assert all(len(shard_name) <= MAX_FILTER_NAME_LENGTH for shard_name, expression in shards)
+    assert name != group_filter_name(ACCOUNT_METADATA_FILTER_PREFIX, tag_group_key('description', 'x'*255))
+
+
+def test_shard_names_lead_back_to_their_group():
+    # the readable part never holds two underscores in a row, so it can't look like a shard
+    name = group_filter_name(SECURITY_LAKE_FILTER_PREFIX, tag_group_key('stage', 'blue__part2'))
+
+    assert unshard_filter_name(name) == name
+    assert unshard_filter_name(name+'__part2') == name
+    assert unshard_filter_name(name+'__part117') == name
+
+
+def security_lake_filter(group):
+    return group_filter_name(SECURITY_LAKE_FILTER_PREFIX, group)
+
+
+def test_sweep_deletes_orphans_after_revoking_them():
+    kept = security_lake_filter('OU=root,OU=Security')
+    orphan = security_lake_filter('OU=root,OU=Retired')
+    lf_client = FakeLakeFormation([kept, orphan], [(kept, '222222222222'), (orphan, '333333333333')])
+
+    deleted, failures = sweep_orphan_filters(lf_client, CATALOG_ID, DATABASE, TABLE, SECURITY_LAKE_FILTER_PREFIX, set([kept]), 100)
+
+    assert (deleted, failures) == (1, 0)
+    assert lf_client.deleted == [orphan]
+    assert lf_client.grants == set([(kept, '222222222222')])
+
+
+def test_sweep_keeps_shards_of_desired_groups():
+    name = security_lake_filter('OU=root')
+    shards = [shard_name for shard_name, expression in build_row_filters(name, 'accountid', [str(100000000000+i) for i in range(100)], 400)]
+    lf_client = FakeLakeFormation(shards+[name+'__part99'])
+
+    deleted, failures = sweep_orphan_filters(lf_client, CATALOG_ID, DATABASE, TABLE, SECURITY_LAKE_FILTER_PREFIX, set(shards), 100)
+
+    # only the shard the group no longer needs goes
+    assert len(shards) > 2
+    assert lf_client.deleted == [name+'__part99']
+    assert sorted(lf_client.filters) == sorted(shards)
+
+
+def test_sweep_leaves_filters_outside_its_prefix_alone():
+    orphan = security_lake_filter('OU=root,OU=Retired')
+    others = [group_filter_name(ACCOUNT_METADATA_FILTER_PREFIX, 'OU=root,OU=Retired'), 'analysts_manual_filter', 'security_lake_filtered_by_hand']
+    lf_client = FakeLakeFormation([orphan]+others, [(name, '444444444444') for name in others])
+
+    deleted, failures = sweep_orphan_filters(lf_client, CATALOG_ID, DATABASE, TABLE, SECURITY_LAKE_FILTER_PREFIX, set(), 100)
+
+    assert lf_client.deleted == [orphan]
+    assert sorted(lf_client.filters) == sorted(others)
+    assert lf_client.grants == set((name, '444444444444') for name in others)
+    assert all(entry['Resource']['DataCellsFilter']['Name'] == orphan for batch in lf_client.revoke_batches for entry in batch)
+
+
+def test_sweep_stops_above_max_deletes():
+    orphans = [security_lake_filter('OU=root,OU=Retired'+str(index)) for index in range(6)]
+    lf_client = FakeLakeFormation(orphans, [(name, '222222222222') for name in orphans])
+
+    assert sweep_orphan_filters(lf_client, CATALOG_ID, DATABASE, TABLE, SECURITY_LAKE_FILTER_PREFIX, set(), 5) == (0, 0)
+    assert lf_client.deleted == []
+    assert lf_client.revoke_batches == []
+
+    assert sweep_orphan_filters(lf_client, CATALOG_ID, DATABASE, TABLE, SECURITY_LAKE_FILTER_PREFIX, set(), 6) == (6, 0)
+
+
+def test_sweep_keeps_filters_whose_revoke_failed():
+    revoked = security_lake_filter('OU=root,OU=Retired')
+    still_granted = security_lake_filter('OU=root,OU=Locked')
+    lf_client = FakeLakeFormation([revoked, still_granted], [(revoked, '222222222222'), (still_granted, '333333333333')], failing_revokes=[still_granted])
+
+    deleted, failures = sweep_orphan_filters(lf_client, CATALOG_ID, DATABASE, TABLE, SECURITY_LAKE_FILTER_PREFIX, set(), 100)
+
+    assert (deleted, failures) == (1, 1)
+    assert lf_client.deleted == [revoked]
+    assert still_granted in lf_client.filters
+
+
+def test_plan_grants_only_revokes_what_is_in_scope():
+    kept = security_lake_filter('OU=root,OU=Security')
+    other = security_lake_filter('OU=root,OU=Payments')
+    desired = {kept: set(['222222222222', '333333333333'])}
+    existing = set([(kept, '222222222222'), (kept, '444444444444'), (other, '444444444444')])
+
+    to_grant, to_revoke = plan_grants(desired, existing, lambda name, principal: name == kept)
+
+    assert to_grant == [(kept, '333333333333')]
+    # the grant on the filter out of scope, eg one a scoped run didn't walk, stays
+    assert to_revoke == [(kept, '444444444444')]
+
+
+def test_plan_grants_leaves_principals_that_are_not_accounts_alone():
+    name = security_lake_filter('OU=root,OU=Security')
+    existing = set([
+        (name, '222222222222'),
+        (name, 'arn:aws:iam::222222222222:role/Analyst'),
+        (name, 'arn:aws:identitystore:::group/1234'),
+        (name, '2222222222'),
+    ])
+
+    to_grant, to_revoke = plan_grants({}, existing, lambda name, principal: True)
+
+    assert to_grant == []
+    assert to_revoke == [(name, '222222222222')]
+
+
+class FakeBatchOperation:
+    # stands in for batch_grant_permissions, the principals in failing fail
+
+    __name__ = 'batch_grant_permissions'
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, CatalogId, Entries):
+        with self.lock:
+            self.batches.append(Entries)
+
+        return {'Failures': [{'RequestEntry': entry, 'Error': {'ErrorCode': 'InvalidInputException'}} for entry in Entries if entry['Principal']['DataLakePrincipalIdentifier'] in self.failing]}
+
+
+def test_apply_grants_sends_full_batches_with_distinct_ids():
+    name = security_lake_filter('OU=root,OU=Security')
+    grants = [(name, str(200000000000+index)) for index in range(2*PERMISSIONS_BATCH_SIZE+5)]
+    batch_operation = FakeBatchOperation()
+
+    assert apply_grants(batch_operation, CATALOG_ID, DATABASE, TABLE, grants) == 0
+
+    assert PERMISSIONS_BATCH_SIZE == 20
+    assert sorted(len(batch) for batch in batch_operation.batches) == [5, 20, 20]
+    for batch in batch_operation.batches:
+        assert len(set(entry['Id'] for entry in batch)) == len(batch)
+
+    sent = [entry for batch in batch_operation.batches for entry in batch]
+    assert sorted((entry['Resource']['DataCellsFilter']['Name'], entry['Principal']['DataLakePrincipalIdentifier']) for entry in sent) == grants
+    assert all(entry['Resource']['DataCellsFilter']['TableName'] == TABLE and entry['Permissions'] == ['SELECT'] for entry in sent)
+
+
+def test_apply_grants_counts_failures():
+    name = security_lake_filter('OU=root,OU=Security')
+    grants = [(name, str(200000000000+index)) for index in range(PERMISSIONS_BATCH_SIZE+1)]
+    batch_operation = FakeBatchOperation(failing=['200000000003', '200000000020'])
+
+    assert apply_grants(batch_operation, CATALOG_ID, DATABASE, TABLE, grants) == 2
+    assert apply_grants(batch_operation, CATALOG_ID, DATABASE, TABLE, []) == 0
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import logging
+
+import boto3
+from botocore.stub import Stubber
+
+import metrics
+
+
+class RecordHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+
+def emitted_record(run_metrics):
+    # what emit() writes to the log, through the metrics logger's own handler
+    handler = RecordHandler()
+    metrics.metrics_logger.addHandler(handler)
+    try:
+        run_metrics.emit()
+    finally:
+        metrics.metrics_logger.removeHandler(handler)
+
+    assert len(handler.records) == 1
+    return json.loads(handler.records[0])
+
+
+def test_emit_writes_emf_record():
+    run_metrics = metrics.start_run()
+    run_metrics.dimensions['RunKind'] = 'full'
+    run_metrics.properties['RunId'] = 'abc123'
+
+    with metrics.phase('OrgWalk'):
+        pass
+    with metrics.phase('OrgWalk'):
+        pass
+    metrics.set_total('Accounts', 42)
+    metrics.add_total('FiltersCreated')
+    metrics.add_total('FiltersCreated', 2)
+    metrics.add_total('TableBytesAfter', 2048, 'Bytes')
+
+    metrics.on_after_call('after-call.lakeformation.CreateDataCellsFilter', parsed={'ResponseMetadata': {'RetryAttempts': 2}})
+    metrics.on_after_call('after-call.lakeformation.CreateDataCellsFilter', parsed={'Error': {'Code': 'ThrottlingException'}})
+    metrics.on_after_call('after-call.lakeformation.BatchGrantPermissions', parsed={'Error': {'Code': 'AccessDeniedException'}})
+    metrics.on_after_call_error('after-call-error.organizations.ListAccounts')
+
+    record = emitted_record(run_metrics)
+
+    emf = record['_aws']
+    assert isinstance(emf['Timestamp'], int)
+    assert len(emf['CloudWatchMetrics']) == 1
+    directive = emf['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == metrics.METRICS_NAMESPACE
+    assert directive['Dimensions'] == [['FunctionName', 'RunKind']]
+
+    # every metric in the directive has a value at the top level of the record
+    units = dict((metric['Name'], metric['Unit']) for metric in directive['Metrics'])
+    assert all(name in record for name in units)
+    assert units['OrgWalkSeconds'] == 'Seconds'
+    assert units['Accounts'] == 'Count'
+    assert units['TableBytesAfter'] == 'Bytes'
+    assert units['DurationSeconds'] == 'Seconds'
+
+    assert record['FunctionName'] == 'RLSecLakeLambda'
+    assert record['RunKind'] == 'full'
+    assert record['RunId'] == 'abc123'
+    assert record['OrgWalkSeconds'] >= 0
+    assert record['Accounts'] == 42
+    assert record['FiltersCreated'] == 3
+    assert record['TableBytesAfter'] == 2048
+
+    assert record['LakeformationCalls'] == 3
+    assert record['LakeformationRetries'] == 2
+    assert record['LakeformationThrottles'] == 1
+    assert record['LakeformationErrors'] == 1
+    assert record['OrganizationsCalls'] == 1
+    assert record['OrganizationsErrors'] == 1
+    assert record['ApiCallsByOperation'] == {
+        'lakeformation.BatchGrantPermissions': {'Calls': 1, 'Errors': 1},
+        'lakeformation.CreateDataCellsFilter': {'Calls': 2, 'Retries': 2, 'Throttles': 1},
+        'organizations.ListAccounts': {'Calls': 1, 'Errors': 1},
+    }
+
+
+def test_runs_start_from_zero():
+    metrics.start_run()
+    metrics.add_total('FiltersCreated', 5)
+
+    record = emitted_record(metrics.start_run())
+
+    assert 'FiltersCreated' not in record
+    assert record['ApiCallsByOperation'] == {}
+
+
+def test_instrumented_session_counts_calls():
+    session = metrics.instrument(boto3.session.Session(region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing'))
+    client = session.client('organizations')
+    run_metrics = metrics.start_run()
+
+    with Stubber(client) as stubber:
+        stubber.add_response('list_roots', {'Roots': [{'Id': 'r-ab12'}]})
+        stubber.add_client_error('list_accounts', service_error_code='TooManyRequestsException', http_status_code=400)
+        client.list_roots()
+        try:
+            client.list_accounts()
+        except client.exceptions.TooManyRequestsException:
+            pass
+
+    record = run_metrics.record()
+
+    assert record['OrganizationsCalls'] == 2
+    assert record['OrganizationsThrottles'] == 1
+    assert record['ApiCallsByOperation']['organizations.ListRoots'] == {'Calls': 1}
@@ -0,0 +1,313 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import copy
+
+from org_events import is_org_change_event, apply_org_events
+
+ROOT_ID = 'r-ab12'
+SECURITY_OU = 'ou-ab12-11111111'
+WORKLOADS_OU = 'ou-ab12-22222222'
+PROD_OU = 'ou-ab12-33333333'
+
+SNAPSHOT = {
+    'org_id': 'o-a1b2c3d4e5',
+    'root_id': ROOT_ID,
+    'ous': {
+        ROOT_ID: {'name': 'root', 'parent_id': None, 'path': 'OU=root'},
+        SECURITY_OU: {'name': 'Security', 'parent_id': ROOT_ID, 'path': 'OU=root,OU=Security'},
+        WORKLOADS_OU: {'name': 'Workloads', 'parent_id': ROOT_ID, 'path': 'OU=root,OU=Workloads'},
+        PROD_OU: {'name': 'Prod', 'parent_id': WORKLOADS_OU, 'path': 'OU=root,OU=Workloads,OU=Prod'},
+    },
+    'accounts': {
+        '111111111111': {'name': 'log-archive', 'ou_id': SECURITY_OU, 'tags': {'team': 'security'}},
+        '222222222222': {'name': 'payments-prod', 'ou_id': PROD_OU, 'tags': {'team': 'payments', 'env': 'prod'}},
+        '333333333333': {'name': 'sandbox', 'ou_id': ROOT_ID, 'tags': {}},
+    },
+}
+
+
+def cloudtrail_event(event_name, request_parameters, response_elements=None):
+    # an Organizations API call as EventBridge delivers it from CloudTrail
+    return {
+        'version': '0',
+        'id': '6f6b3b8e-9c43-4c4e-8f0e-5b0a9a4e2d11',
+        'detail-type': 'AWS API Call via CloudTrail',
+        'source': 'aws.organizations',
+        'account': '999999999999',
+        'time': '2026-10-18T09:12:44Z',
+        'region': 'us-east-1',
+        'resources': [],
+        'detail': {
+            'eventVersion': '1.09',
+            'userIdentity': {
+                'type': 'AssumedRole',
+                'principalId': 'AROAEXAMPLEID:admin',
+                'arn': 'arn:aws:sts::999999999999:assumed-role/OrgAdmin/admin',
+                'accountId': '999999999999',
+                'sessionContext': {'attributes': {'creationDate': '2026-10-18T09:01:02Z', 'mfaAuthenticated': 'false'}},
+            },
+            'eventTime': '2026-10-18T09:12:44Z',
+            'eventSource': 'organizations.amazonaws.com',
+            'eventName': event_name,
+            'awsRegion': 'us-east-1',
+            'sourceIPAddress': '203.0.113.10',
+            'userAgent': 'aws-cli/2.17.0 Python/3.11.9 Linux/6.1 exe/x86_64.amzn.2',
+            'requestParameters': request_parameters,
+            'responseElements': response_elements,
+            'requestID': 'c0a8f2d4-1e2b-4f5a-9c3d-7e6f5a4b3c2d',
+            'eventID': '0b1c2d3e-4f50-6172-8394-a5b6c7d8e9f0',
+            'readOnly': False,
+            'eventType': 'AwsApiCall',
+            'managementEvent': True,
+            'recipientAccountId': '999999999999',
+            'eventCategory': 'Management',
+        },
+    }
+
+
+def create_account_result_event(state, account_id=None):
+    # the service event Organizations sends once CreateAccount has finished
+    status = {
+        'id': 'car-1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d',
+        'state': state,
+        'accountName': '****',
+        'requestedTimestamp': 'Oct 18, 2026 9:12:44 AM',
+        'completedTimestamp': 'Oct 18, 2026 9:13:40 AM',
+    }
+    if account_id is not None:
+        status['accountId'] = account_id
+    if state == 'FAILED':
+        status['failureReason'] = 'EMAIL_ALREADY_EXISTS'
+
+    return {
+        'version': '0',
+        'id': '4c5d6e7f-8091-4a2b-b3c4-d5e6f7a8b9c0',
+        'detail-type': 'AWS Service Event via CloudTrail',
+        'source': 'aws.organizations',
+        'account': '999999999999',
+        'time': '2026-10-18T09:13:40Z',
+        'region': 'us-east-1',
+        'resources': [],
+        'detail': {
+            'eventVersion': '1.08',
+            'userIdentity': {'accountId': '999999999999', 'invokedBy': 'AWS Internal'},
+            'eventTime': '2026-10-18T09:13:40Z',
+            'eventSource': 'organizations.amazonaws.com',
+            'eventName': 'CreateAccountResult',
+            'awsRegion': 'us-east-1',
+            'sourceIPAddress': 'AWS Internal',
+            'userAgent': 'AWS Internal',
+            'requestParameters': None,
+            'responseElements': None,
+            'eventID': '9f8e7d6c-5b4a-4392-8170-6f5e4d3c2b1a',
+            'readOnly': False,
+            'eventType': 'AwsServiceEvent',
+            'managementEvent': True,
+            'recipientAccountId': '999999999999',
+            'serviceEventDetails': {'createAccountStatus': status},
+            'eventCategory': 'Management',
+        },
+    }
+
+
+def apply(event):
+    snapshot = copy.deepcopy(SNAPSHOT)
+    new, affected_groups, requires_full_sync = apply_org_events(snapshot, [event])
+
+    # the stored snapshot is never changed in place
+    assert snapshot == SNAPSHOT
+    return new, affected_groups, requires_full_sync
+
+
+def test_is_org_change_event():
+    assert is_org_change_event(cloudtrail_event('MoveAccount', {}))
+    assert not is_org_change_event({'force_refresh': True})
+    assert not is_org_change_event({'source': 'aws.events', 'detail-type': 'Scheduled Event', 'detail': {}})
+
+
+def test_move_account():
+    event = cloudtrail_event('MoveAccount', {
+        'accountId': '222222222222',
+        'sourceParentId': PROD_OU,
+        'destinationParentId': SECURITY_OU,
+    })
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert not requires_full_sync
+    assert new['accounts']['222222222222']['ou_id'] == SECURITY_OU
+    # the account leaves Prod and everything above it, and joins Security
+    assert affected_groups == set(['OU=root', 'OU=root,OU=Workloads', 'OU=root,OU=Workloads,OU=Prod', 'OU=root,OU=Security'])
+
+
+def test_move_account_to_unknown_ou_needs_full_sync():
+    event = cloudtrail_event('MoveAccount', {
+        'accountId': '222222222222',
+        'sourceParentId': PROD_OU,
+        'destinationParentId': 'ou-ab12-99999999',
+    })
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert requires_full_sync
+
+
+def test_create_account_result():
+    new, affected_groups, requires_full_sync = apply(create_account_result_event('SUCCEEDED', '444444444444'))
+
+    assert not requires_full_sync
+    # new accounts start in the root, the masked name is left for the next walk to read
+    assert new['accounts']['444444444444'] == {'name': '', 'ou_id': ROOT_ID, 'tags': {}}
+    assert affected_groups == set(['OU=root'])
+
+
+def test_failed_create_account_result_changes_nothing():
+    new, affected_groups, requires_full_sync = apply(create_account_result_event('FAILED'))
+
+    assert not requires_full_sync
+    assert new == SNAPSHOT
+    assert affected_groups == set()
+
+
+def test_rename_ou_updates_subtree():
+    event = cloudtrail_event('UpdateOrganizationalUnit', {
+        'organizationalUnitId': WORKLOADS_OU,
+        'name': 'Applications',
+    }, {
+        'organizationalUnit': {
+            'id': WORKLOADS_OU,
+            'name': 'Applications',
+            'arn': 'arn:aws:organizations::999999999999:ou/o-a1b2c3d4e5/'+WORKLOADS_OU,
+        },
+    })
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert not requires_full_sync
+    assert new['ous'][WORKLOADS_OU]['path'] == 'OU=root,OU=Applications'
+    assert new['ous'][PROD_OU]['path'] == 'OU=root,OU=Applications,OU=Prod'
+    assert new['ous'][SECURITY_OU] == SNAPSHOT['ous'][SECURITY_OU]
+    # the groups under the old paths go away and the ones under the new paths take their place
+    assert affected_groups == set([
+        'OU=root',
+        'OU=root,OU=Workloads',
+        'OU=root,OU=Workloads,OU=Prod',
+        'OU=root,OU=Applications',
+        'OU=root,OU=Applications,OU=Prod',
+    ])
+
+
+def test_rename_ou_updates_every_level_below_it():
+    snapshot = copy.deepcopy(SNAPSHOT)
+    snapshot['ous']['ou-ab12-44444444'] = {'name': 'Payments', 'parent_id': PROD_OU, 'path': 'OU=root,OU=Workloads,OU=Prod,OU=Payments'}
+    snapshot['ous']['ou-ab12-55555555'] = {'name': 'Cards', 'parent_id': 'ou-ab12-44444444', 'path': 'OU=root,OU=Workloads,OU=Prod,OU=Payments,OU=Cards'}
+    event = cloudtrail_event('UpdateOrganizationalUnit', {'organizationalUnitId': WORKLOADS_OU, 'name': 'W'})
+
+    new, affected_groups, requires_full_sync = apply_org_events(snapshot, [event])
+
+    assert not requires_full_sync
+    assert new['ous']['ou-ab12-55555555']['path'] == 'OU=root,OU=W,OU=Prod,OU=Payments,OU=Cards'
+    assert new['ous']['ou-ab12-44444444']['path'] == 'OU=root,OU=W,OU=Prod,OU=Payments'
+
+
+def test_tag_account():
+    event = cloudtrail_event('TagResource', {
+        'resourceId': '222222222222',
+        'tags': [{'key': 'Team', 'value': 'checkout'}, {'key': 'cost-center', 'value': '1234'}],
+    })
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert not requires_full_sync
+    assert new['accounts']['222222222222']['tags'] == {'team': 'checkout', 'env': 'prod', 'cost-center': '1234'}
+    assert affected_groups == set(['TAG=team=payments', 'TAG=team=checkout', 'TAG=cost-center=1234'])
+
+
+def test_untag_account():
+    event = cloudtrail_event('UntagResource', {
+        'resourceId': '222222222222',
+        'tagKeys': ['env', 'owner'],
+    })
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert not requires_full_sync
+    assert new['accounts']['222222222222']['tags'] == {'team': 'payments'}
+    assert affected_groups == set(['TAG=env=prod'])
+
+
+def test_tags_on_ous_policies_and_root_change_nothing():
+    for resource_id in (WORKLOADS_OU, 'p-a1b2c3d4', ROOT_ID):
+        event = cloudtrail_event('TagResource', {
+            'resourceId': resource_id,
+            'tags': [{'key': 'team', 'value': 'platform'}],
+        })
+
+        new, affected_groups, requires_full_sync = apply(event)
+
+        assert not requires_full_sync
+        assert new == SNAPSHOT
+        assert affected_groups == set()
+
+
+def test_tag_on_unknown_account_needs_full_sync():
+    event = cloudtrail_event('TagResource', {
+        'resourceId': '555555555555',
+        'tags': [{'key': 'team', 'value': 'platform'}],
+    })
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert requires_full_sync
+
+
+def test_failed_call_is_ignored():
+    event = cloudtrail_event('MoveAccount', {
+        'accountId': '222222222222',
+        'sourceParentId': PROD_OU,
+        'destinationParentId': SECURITY_OU,
+    })
+    event['detail']['errorCode'] = 'AccessDeniedException'
+    event['detail']['errorMessage'] = 'You don\'t have permissions to access this resource.'
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert not requires_full_sync
+    assert new == SNAPSHOT
+
+
+def test_unsupported_event_needs_full_sync():
+    # an account that accepted an invitation, the snapshot doesn't know where it is
+    event = cloudtrail_event('AcceptHandshake', {'handshakeId': 'h-1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d'}, {
+        'handshake': {
+            'id': 'h-1a2b3c4d5e6f7a8b9c0d1e2f3a4b5c6d',
+            'state': 'ACCEPTED',
+            'action': 'INVITE',
+            'parties': [{'id': '666666666666', 'type': 'ACCOUNT'}, {'id': 'o-a1b2c3d4e5', 'type': 'ORGANIZATION'}],
+        },
+    })
+
+    new, affected_groups, requires_full_sync = apply(event)
+
+    assert requires_full_sync
+
+
+def test_delete_empty_ou():
+    snapshot = copy.deepcopy(SNAPSHOT)
+    snapshot['accounts']['111111111111']['ou_id'] = ROOT_ID
+    event = cloudtrail_event('DeleteOrganizationalUnit', {'organizationalUnitId': SECURITY_OU})
+
+    new, affected_groups, requires_full_sync = apply_org_events(snapshot, [event])
+
+    assert not requires_full_sync
+    assert SECURITY_OU not in new['ous']
+    assert affected_groups == set(['OU=root', 'OU=root,OU=Security'])
+
+
+def test_delete_ou_with_members_needs_full_sync():
+    # Organizations only deletes empty OUs, so the stored snapshot has missed a change
+    for ou_id in (SECURITY_OU, WORKLOADS_OU):
+        new, affected_groups, requires_full_sync = apply(cloudtrail_event('DeleteOrganizationalUnit', {'organizationalUnitId': ou_id}))
+
+        assert requires_full_sync
@@ -0,0 +1,183 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import gzip
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import org_metadata
+from org_metadata import walk_org_snapshot, metadata_from_snapshot, fetch_times, load_org_snapshot, save_org_snapshot
+from org_index import build_ou_index
+from throttling import TokenBucket
+
+ROOT_ID = 'r-ab12'
+
+
+class FakeOrganizations:
+    # an org of {OU id: (name, parent id)} and {account id: (name, parent id, tags)}
+
+    def __init__(self, ous, accounts):
+        self.ous = ous
+        self.accounts = accounts
+        self.calls = 0
+        self.tags_read = []
+        self.lock = threading.Lock()
+
+    def count(self):
+        with self.lock:
+            self.calls += 1
+
+    def describe_organization(self):
+        self.count()
+        return {'Organization': {'Id': 'o-a1b2c3d4e5'}}
+
+    def list_roots(self, **kwargs):
+        self.count()
+        return {'Roots': [{'Id': ROOT_ID, 'Name': 'Root'}]}
+
+    def list_organizational_units_for_parent(self, ParentId, **kwargs):
+        self.count()
+        orgunits = []
+        with self.lock:
+            for ou_id, (name, parent_id) in sorted(self.ous.items()):
+                if parent_id != ParentId:
+                    continue
+                orgunits.append({'Id': ou_id, 'Name': name})
+
+        return {'OrganizationalUnits': orgunits}
+
+    def list_accounts_for_parent(self, ParentId, **kwargs):
+        self.count()
+        if ParentId != ROOT_ID and ParentId not in self.ous:
+            raise ClientError({'Error': {'Code': 'ParentNotFoundException'}}, 'ListAccountsForParent')
+
+        return {'Accounts': [{'Id': account_id, 'Name': name} for account_id, (name, parent_id, tags) in sorted(self.accounts.items()) if parent_id == ParentId]}
+
+    def list_tags_for_resource(self, ResourceId, **kwargs):
+        self.count()
+        self.tags_read.append(ResourceId)
+        return {'Tags': [{'Key': key, 'Value': value} for key, value in sorted(self.accounts[ResourceId][2].items())]}
+
+
+OUS = {
+    'ou-ab12-11111111': ('Security', ROOT_ID),
+    'ou-ab12-22222222': ('Workloads', ROOT_ID),
+    'ou-ab12-33333333': ('Prod', 'ou-ab12-22222222'),
+}
+
+ACCOUNTS = {
+    '111111111111': ('log-archive', 'ou-ab12-11111111', {'Team': 'security'}),
+    '222222222222': ('payments-prod', 'ou-ab12-33333333', {'team': 'payments'}),
+    '333333333333': ('sandbox', ROOT_ID, {}),
+}
+
+
+def test_walk_reads_every_ou_and_account():
+    organizations = FakeOrganizations(OUS, ACCOUNTS)
+
+    snapshot = walk_org_snapshot(organizations, TokenBucket(1000), 4)
+
+    assert snapshot['ous']['ou-ab12-33333333'] == {'name': 'Prod', 'parent_id': 'ou-ab12-22222222', 'path': 'OU=root,OU=Workloads,OU=Prod'}
+    assert snapshot['accounts'] == {
+        '111111111111': {'name': 'log-archive', 'ou_id': 'ou-ab12-11111111', 'tags': {'team': 'security'}},
+        '222222222222': {'name': 'payments-prod', 'ou_id': 'ou-ab12-33333333', 'tags': {'team': 'payments'}},
+        '333333333333': {'name': 'sandbox', 'ou_id': ROOT_ID, 'tags': {}},
+    }
+    # the org and its root, the child OUs and accounts of each OU and the tags of each account
+    assert organizations.calls == 2 + 2*(len(OUS)+1) + len(ACCOUNTS)
+
+
+def test_accounts_in_unknown_ous_are_left_out():
+    snapshot = walk_org_snapshot(FakeOrganizations(OUS, ACCOUNTS), TokenBucket(1000), 4)
+    snapshot['accounts']['444444444444'] = {'name': 'moved', 'ou_id': 'ou-ab12-99999999', 'tags': {}}
+
+    accounts, ou_paths = metadata_from_snapshot(snapshot)
+
+    assert [account['id'] for account in accounts['Accounts']] == ['333333333333', '111111111111', '222222222222']
+    assert accounts['Accounts'][2]['ou'] == 'OU=root,OU=Workloads,OU=Prod'
+    assert ou_paths == ['OU=root', 'OU=root,OU=Security', 'OU=root,OU=Workloads', 'OU=root,OU=Workloads,OU=Prod']
+    assert build_ou_index(snapshot)['OU=root'] == set(['111111111111', '222222222222', '333333333333'])
+
+
+def test_walk_reuses_recent_tags():
+    previous = walk_org_snapshot(FakeOrganizations(OUS, ACCOUNTS), TokenBucket(1000), 4)
+    fetch_times(previous, 'tags')['222222222222'] = time.time()-25*3600
+    accounts = dict(ACCOUNTS, **{'444444444444': ('new', ROOT_ID, {'team': 'data'})})
+    organizations = FakeOrganizations(OUS, accounts)
+
+    snapshot = walk_org_snapshot(organizations, TokenBucket(1000), 4, previous, 24)
+
+    # the stale and the new account are read, the others are taken from the previous snapshot
+    assert sorted(organizations.tags_read) == ['222222222222', '444444444444']
+    assert snapshot['accounts']['111111111111']['tags'] == {'team': 'security'}
+    assert fetch_times(snapshot, 'tags')['111111111111'] == fetch_times(previous, 'tags')['111111111111']
+    assert fetch_times(snapshot, 'tags')['222222222222'] > time.time()-60
+
+
+class FakeS3:
+    # keeps the gzipped snapshot and answers a conditional get with 304 while it is unchanged
+
+    def __init__(self):
+        self.objects = {}
+        self.downloads = 0
+        self.puts = 0
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.puts += 1
+        etag = '"'+str(self.puts)+'"'
+        self.objects[Key] = (etag, Body)
+        return {'ETag': etag}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+        etag, body = self.objects[Key]
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304'}}, 'GetObject')
+
+        self.downloads += 1
+        return {'ETag': etag, 'Body': FakeBody(body)}
+
+
+class FakeBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+def test_snapshot_is_saved_gzipped_and_loaded_back():
+    s3_client = FakeS3()
+    org_metadata.snapshot_cache.clear()
+    snapshot = walk_org_snapshot(FakeOrganizations(OUS, ACCOUNTS), TokenBucket(1000), 4)
+
+    assert load_org_snapshot(s3_client, 'bucket') is None
+    save_org_snapshot(s3_client, 'bucket', snapshot)
+
+    stored = json.loads(gzip.decompress(s3_client.objects[org_metadata.ORG_SNAPSHOT_KEY][1]))
+    assert stored['accounts'] == snapshot['accounts']
+
+    # a cold lambda downloads it, a warm one only when it has changed
+    org_metadata.snapshot_cache.clear()
+    loaded = load_org_snapshot(s3_client, 'bucket')
+    assert dict(loaded, version=None) == dict(snapshot, version=None)
+    assert s3_client.downloads == 1
+
+    loaded['accounts'].clear()
+    assert load_org_snapshot(s3_client, 'bucket')['accounts'] == snapshot['accounts']
+    assert s3_client.downloads == 1
+
+
+def test_snapshot_of_another_version_is_ignored():
+    s3_client = FakeS3()
+    org_metadata.snapshot_cache.clear()
+    snapshot = walk_org_snapshot(FakeOrganizations(OUS, ACCOUNTS), TokenBucket(1000), 4)
+    s3_client.put_object('bucket', org_metadata.ORG_SNAPSHOT_KEY, gzip.compress(json.dumps(dict(snapshot, version=0)).encode('utf-8')))
+
+    assert load_org_snapshot(s3_client, 'bucket') is None
@@ -0,0 +1,74 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import random
+import re
+
+from row_filters import build_row_filters
+
+
+def account_ids(count, start=100000000000):
+    return [str(start+i) for i in range(count)]
+
+
+def filtered_ids(expression):
+    # the account ids in an IN list, with quotes unescaped
+    return [value.replace("''", "'") for value in re.findall(r"'((?:[^']|'')*)'", expression)]
+
+
+def test_small_group_is_one_filter():
+    filters = build_row_filters('security_lake_filter_OU_root', 'accountid', ['222222222222', '111111111111'])
+
+    assert filters == [('security_lake_filter_OU_root', "accountid IN ('111111111111', '222222222222')")]
+
+
+def test_every_shard_fits_max_length():
+    for max_length in (40, 64, 100, 257, 2048):
+        filters = build_row_filters('group', 'accountid', account_ids(500), max_length)
+
+        assert len(filters) > 1
+        assert all(len(expression) <= max_length for name, expression in filters)
+
+
+def test_shards_cover_every_account_once():
+    accounts = account_ids(300)
+    filters = build_row_filters('group', 'accountid', accounts + accounts[:10], 200)
+
+    ids = [account_id for name, expression in filters for account_id in filtered_ids(expression)]
+    assert sorted(ids) == sorted(accounts)
+
+
+def test_shards_do_not_depend_on_account_order():
+    accounts = account_ids(200)
+    shuffled = list(accounts)
+    random.Random(7).shuffle(shuffled)
+
+    assert build_row_filters('group', 'accountid', accounts, 150) == build_row_filters('group', 'accountid', shuffled, 150)
+
+
+def test_shard_names():
+    filters = build_row_filters('security_lake_filter_OU_root', 'accountid', account_ids(40), 120)
+    names = [name for name, expression in filters]
+
+    assert len(names) > 2
+    assert names[0] == 'security_lake_filter_OU_root'
+    assert names[1:] == ['security_lake_filter_OU_root__part'+str(index) for index in range(2, len(names)+1)]
+
+
+def test_column_is_used_as_given():
+    metadata_filters = build_row_filters('account_metadata_filter_OU_root', 'id', ['111111111111'])
+    security_lake_filters = build_row_filters('security_lake_filter_OU_root', 'accountid', ['111111111111'])
+
+    assert metadata_filters == [('account_metadata_filter_OU_root', "id IN ('111111111111')")]
+    assert security_lake_filters == [('security_lake_filter_OU_root', "accountid IN ('111111111111')")]
+
+
+def test_quotes_are_escaped():
+    filters = build_row_filters('group', 'id', ["o'brien"])
+
+    assert filters == [('group', "id IN ('o''brien')")]
+    assert filtered_ids(filters[0][1]) == ["o'brien"]
+
+
+def test_empty_group_matches_nothing():
+    assert build_row_filters('group', 'accountid', []) == [('group', "accountid IN ('')")]
@@ -0,0 +1,106 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import threading
+
+import pytest
+
+from s3_cleanup import DELETE_OBJECTS_BATCH_SIZE, delete_prefix
+
+BUCKET = 'metadata-bucket'
+
+
+class FakeS3:
+    # a bucket of {key: size}. ListObjectsV2 returns at most 1,000 keys a page, and
+    # DeleteObjects fails for the keys in failing, as it would for a missing permission
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, keys, failing=()):
+        self.objects = dict((key, 10) for key in keys)
+        self.failing = set(failing)
+        self.list_calls = 0
+        self.delete_batches = []
+        self.lock = threading.Lock()
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        # the token is the last key listed, so deletes between pages don't shift the next one
+        with self.lock:
+            self.list_calls += 1
+            keys = sorted(key for key in self.objects if key.startswith(Prefix) and key > (ContinuationToken or ''))
+
+        page = keys[:self.PAGE_SIZE]
+        response = {'IsTruncated': len(keys) > self.PAGE_SIZE}
+        if page:
+            response['Contents'] = [{'Key': key, 'Size': 10} for key in page]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+
+        return response
+
+    def delete_objects(self, Bucket, Delete):
+        assert len(Delete['Objects']) <= 1000
+        errors = []
+        with self.lock:
+            self.delete_batches.append(len(Delete['Objects']))
+            for item in Delete['Objects']:
+                if item['Key'] in self.failing:
+                    errors.append({'Key': item['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+                else:
+                    del self.objects[item['Key']]
+
+        return {'Errors': errors} if errors else {}
+
+
+def table_files(table_name, count):
+    return [table_name+'/data/'+str(index).zfill(5)+'.parquet' for index in range(count)]
+
+
+NEIGHBOURS = ['account_metadata_v2/data/00000.parquet', 'account_metadata.json', '_state/tables/account_metadata.json', 'ou_groups/metadata/00001.metadata.json']
+
+
+def test_delete_prefix_pages_through_every_object():
+    s3_client = FakeS3(table_files('account_metadata', 2*DELETE_OBJECTS_BATCH_SIZE+500))
+
+    result = delete_prefix(s3_client, BUCKET, 'account_metadata/', max_workers=4)
+
+    assert result == {'objects': 2500, 'bytes': 25000}
+    assert s3_client.objects == {}
+    assert s3_client.list_calls == 3
+    assert sorted(s3_client.delete_batches) == [500, 1000, 1000]
+
+
+def test_delete_prefix_leaves_everything_outside_the_prefix():
+    s3_client = FakeS3(table_files('account_metadata', 1200)+NEIGHBOURS)
+
+    delete_prefix(s3_client, BUCKET, 'account_metadata/')
+
+    assert sorted(s3_client.objects) == sorted(NEIGHBOURS)
+
+
+def test_delete_prefix_raises_for_objects_it_could_not_delete():
+    keys = table_files('account_metadata', 1500)
+    s3_client = FakeS3(keys, failing=[keys[3], keys[1200]])
+
+    with pytest.raises(Exception, match='Unable to delete 2 objects under s3://metadata-bucket/account_metadata/'):
+        delete_prefix(s3_client, BUCKET, 'account_metadata/')
+
+    # the rest of the prefix is still deleted
+    assert sorted(s3_client.objects) == [keys[3], keys[1200]]
+
+
+def test_delete_prefix_of_nothing():
+    s3_client = FakeS3(NEIGHBOURS)
+
+    assert delete_prefix(s3_client, BUCKET, 'account_metadata/') == {'objects': 0, 'bytes': 0}
+    assert s3_client.delete_batches == []
+
+
+@pytest.mark.parametrize('prefix', ['', 'account_metadata', '_state'])
+def test_delete_prefix_refuses_prefixes_that_are_not_folders(prefix):
+    s3_client = FakeS3(table_files('account_metadata', 3)+NEIGHBOURS)
+
+    with pytest.raises(Exception, match='prefixes must end with /'):
+        delete_prefix(s3_client, BUCKET, prefix)
+
+    assert len(s3_client.objects) == 3+len(NEIGHBOURS)
@@ -0,0 +1,210 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+
+from security_lake import (
+    struct_fields,
+    has_column,
+    get_account_column,
+    get_account_columns,
+    find_security_lake_tables,
+    regional_names,
+    table_patterns,
+)
+
+# the Glue types of columns in Security Lake tables, as get_table returns them
+
+# OCSF 1.0, Security Lake 1.0 sources
+CLOUD_OCSF_1_0 = 'struct<account_uid:string,provider:string,region:string,zone:string>'
+
+# OCSF 1.1 and later, Security Lake 2.0 sources
+CLOUD_OCSF_1_1 = (
+    'struct<account:struct<name:string,type:string,type_id:int,uid:string,labels:array<string>>,'
+    'org:struct<name:string,ou_id:string,ou_name:string,uid:string>,'
+    'provider:string,region:string,zone:string>'
+)
+
+METADATA = (
+    'struct<correlation_uid:string,event_code:string,uid:string,'
+    'labels:array<string>,log_name:string,log_provider:string,log_version:string,'
+    'logged_time:bigint,modified_time:bigint,original_time:string,'
+    'product:struct<name:string,vendor_name:string,version:string,feature:struct<name:string,uid:string,version:string>>,'
+    'profiles:array<string>,version:string>'
+)
+
+RESOURCES = (
+    'array<struct<cloud_partition:string,region:string,data:string,'
+    'account:struct<uid:string>,group:struct<name:string>,'
+    'labels:array<string>,name:string,owner:struct<account:struct<uid:string>,uid:string>,'
+    'type:string,uid:string>>'
+)
+
+UNMAPPED = 'map<string,string>'
+
+ENRICHMENTS = 'array<struct<data:map<string,string>,name:string,provider:string,type:string,value:string>>'
+
+
+@pytest.mark.parametrize('type_string, expected', [
+    (CLOUD_OCSF_1_0, {'account_uid': 'string', 'provider': 'string', 'region': 'string', 'zone': 'string'}),
+    (CLOUD_OCSF_1_1, {
+        'account': 'struct<name:string,type:string,type_id:int,uid:string,labels:array<string>>',
+        'org': 'struct<name:string,ou_id:string,ou_name:string,uid:string>',
+        'provider': 'string',
+        'region': 'string',
+        'zone': 'string',
+    }),
+    ('STRUCT<Uid:string, Data:map<string,array<struct<a:int,b:decimal(10,2)>>>>', {
+        'uid': 'string',
+        'data': 'map<string,array<struct<a:int,b:decimal(10,2)>>>',
+    }),
+    (RESOURCES, {}),
+    (UNMAPPED, {}),
+    ('string', {}),
+    ('', {}),
+    (None, {}),
+])
+def test_struct_fields(type_string, expected):
+    assert struct_fields(type_string) == expected
+
+
+def test_struct_fields_of_nested_types():
+    fields = struct_fields(METADATA)
+
+    assert fields['labels'] == 'array<string>'
+    assert fields['version'] == 'string'
+    assert struct_fields(fields['product'])['feature'] == 'struct<name:string,uid:string,version:string>'
+
+
+OCSF_1_0_COLUMNS = {'metadata': METADATA, 'time': 'bigint', 'cloud': CLOUD_OCSF_1_0, 'unmapped': UNMAPPED}
+OCSF_1_1_COLUMNS = {'metadata': METADATA, 'time': 'bigint', 'cloud': CLOUD_OCSF_1_1, 'resources': RESOURCES, 'enrichments': ENRICHMENTS, 'unmapped': UNMAPPED}
+
+
+@pytest.mark.parametrize('columns, path, expected', [
+    (OCSF_1_1_COLUMNS, 'cloud.account.uid', True),
+    (OCSF_1_1_COLUMNS, 'CLOUD.Account.UID', True),
+    (OCSF_1_1_COLUMNS, 'cloud.account_uid', False),
+    (OCSF_1_0_COLUMNS, 'cloud.account_uid', True),
+    (OCSF_1_0_COLUMNS, 'cloud.account.uid', False),
+    # fields inside arrays and maps can't be filtered on
+    (OCSF_1_1_COLUMNS, 'resources.account.uid', False),
+    (OCSF_1_1_COLUMNS, 'unmapped.account', False),
+    (OCSF_1_1_COLUMNS, 'cloud.account.uid.value', False),
+    (OCSF_1_1_COLUMNS, 'accountid', False),
+])
+def test_has_column(columns, path, expected):
+    assert has_column(columns, path) == expected
+
+
+class FakeGlue:
+    # every table has the same columns and partition keys, other_tables have theirs.
+    # GetTables returns two tables a page
+
+    def __init__(self, columns, partition_keys, other_tables=None):
+        self.columns = columns
+        self.partition_keys = partition_keys
+        self.other_tables = other_tables or {}
+        self.table_names = []
+
+    def get_table(self, DatabaseName, Name):
+        columns, partition_keys = self.other_tables.get(Name, (self.columns, self.partition_keys))
+        return {'Table': {
+            'DatabaseName': DatabaseName,
+            'Name': Name,
+            'StorageDescriptor': {'Columns': [{'Name': name, 'Type': column_type} for name, column_type in columns.items()]},
+            'PartitionKeys': [{'Name': name, 'Type': 'string'} for name in partition_keys],
+        }}
+
+    def get_tables(self, DatabaseName, NextToken=None):
+        start = int(NextToken or 0)
+        response = {'TableList': [{'Name': name} for name in self.table_names[start:start+2]]}
+        if start+2 < len(self.table_names):
+            response['NextToken'] = str(start+2)
+
+        return response
+
+
+@pytest.mark.parametrize('columns, partition_keys, expected', [
+    (OCSF_1_1_COLUMNS, ['region', 'accountid', 'eventday'], 'accountid'),
+    (OCSF_1_0_COLUMNS, ['region', 'accountId', 'eventDay'], 'accountid'),
+    (OCSF_1_1_COLUMNS, ['region', 'eventday'], 'cloud.account.uid'),
+    (OCSF_1_0_COLUMNS, ['region', 'eventday'], 'cloud.account_uid'),
+    ({'Metadata': METADATA, 'Cloud': 'STRUCT<Account:STRUCT<Uid:STRING>>'}, [], 'cloud.account.uid'),
+])
+def test_get_account_column(columns, partition_keys, expected):
+    glue_client = FakeGlue(columns, partition_keys)
+
+    assert get_account_column(glue_client, 'amazon_security_lake_glue_db_us_east_1', 'amazon_security_lake_table_us_east_1_sh_findings_2_0') == expected
+
+
+def test_get_account_column_without_one():
+    columns = dict(OCSF_1_1_COLUMNS, cloud='struct<provider:string,region:string>')
+    glue_client = FakeGlue(columns, ['region', 'eventday'])
+
+    with pytest.raises(Exception, match='neither an accountid partition key'):
+        get_account_column(glue_client, 'amazon_security_lake_glue_db_us_east_1', 'amazon_security_lake_table_us_east_1_vpc_flow_2_0')
+
+
+US_EAST_1_TABLES = [
+    'amazon_security_lake_table_us_east_1_cloud_trail_mgmt_2_0',
+    'amazon_security_lake_table_us_east_1_route53_2_0',
+    'amazon_security_lake_table_us_east_1_sh_findings_2_0',
+    'amazon_security_lake_table_us_east_1_vpc_flow_2_0',
+    'unrelated_table',
+]
+
+
+def test_table_patterns():
+    assert table_patterns(' Amazon_Security_Lake_Table_US_EAST_1_*, ,amazon_security_lake_table_us_east_1_sh_findings_2_0,') == [
+        'amazon_security_lake_table_us_east_1_*',
+        'amazon_security_lake_table_us_east_1_sh_findings_2_0',
+    ]
+    assert table_patterns('') == []
+    assert table_patterns(None) == []
+
+
+def test_find_security_lake_tables_pages_through_the_database():
+    glue_client = FakeGlue(OCSF_1_1_COLUMNS, ['region', 'accountid', 'eventday'])
+    glue_client.table_names = list(reversed(US_EAST_1_TABLES))
+
+    assert find_security_lake_tables(glue_client, 'amazon_security_lake_glue_db_us_east_1', ['amazon_security_lake_table_us_east_1_*']) == US_EAST_1_TABLES[:4]
+    assert find_security_lake_tables(glue_client, 'amazon_security_lake_glue_db_us_east_1', ['*_sh_findings_2_0', '*_vpc_flow_*', '*_eks_audit_2_0']) == [
+        'amazon_security_lake_table_us_east_1_sh_findings_2_0',
+        'amazon_security_lake_table_us_east_1_vpc_flow_2_0',
+    ]
+
+    with pytest.raises(Exception, match='No table in amazon_security_lake_glue_db_us_east_1 matches'):
+        find_security_lake_tables(glue_client, 'amazon_security_lake_glue_db_us_east_1', ['*_eks_audit_2_0'])
+
+
+def test_get_account_columns_of_every_matching_table():
+    glue_client = FakeGlue(OCSF_1_1_COLUMNS, ['region', 'accountid', 'eventday'], {
+        'amazon_security_lake_table_us_east_1_route53_2_0': (OCSF_1_1_COLUMNS, ['region', 'eventday']),
+    })
+    glue_client.table_names = US_EAST_1_TABLES
+
+    assert get_account_columns(glue_client, 'amazon_security_lake_glue_db_us_east_1', ['amazon_security_lake_table_us_east_1_*']) == {
+        'amazon_security_lake_table_us_east_1_cloud_trail_mgmt_2_0': 'accountid',
+        'amazon_security_lake_table_us_east_1_route53_2_0': 'cloud.account.uid',
+        'amazon_security_lake_table_us_east_1_sh_findings_2_0': 'accountid',
+        'amazon_security_lake_table_us_east_1_vpc_flow_2_0': 'accountid',
+    }
+
+
+def test_get_account_columns_fails_for_a_table_without_one():
+    glue_client = FakeGlue(OCSF_1_1_COLUMNS, ['region', 'accountid', 'eventday'], {
+        'amazon_security_lake_table_us_east_1_vpc_flow_2_0': ({'time': 'bigint'}, ['region', 'eventday']),
+    })
+    glue_client.table_names = US_EAST_1_TABLES
+
+    with pytest.raises(Exception, match='amazon_security_lake_table_us_east_1_vpc_flow_2_0 has neither'):
+        get_account_columns(glue_client, 'amazon_security_lake_glue_db_us_east_1', ['amazon_security_lake_table_us_east_1_*'])
+
+
+@pytest.mark.parametrize('region, expected', [
+    ('us-east-1', ('amazon_security_lake_glue_db_us_east_1', ['amazon_security_lake_table_us_east_1_*', '*_sh_findings_2_0'])),
+    ('eu-west-1', ('amazon_security_lake_glue_db_eu_west_1', ['amazon_security_lake_table_eu_west_1_*', '*_sh_findings_2_0'])),
+    ('ap-southeast-2', ('amazon_security_lake_glue_db_ap_southeast_2', ['amazon_security_lake_table_ap_southeast_2_*', '*_sh_findings_2_0'])),
+])
+def test_regional_names(region, expected):
+    assert regional_names('amazon_security_lake_glue_db_us_east_1', ['amazon_security_lake_table_us_east_1_*', '*_sh_findings_2_0'], 'us-east-1', region) == expected
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import sys
+import types
+
+import pytest
+from botocore.exceptions import ClientError
+
+import table_maintenance
+from table_maintenance import MAX_OPTIMIZE_RUNS, maintain_table
+
+DATABASE = 'aws_account_metadata_db'
+BUCKET = 'metadata-bucket'
+
+
+class FakeS3:
+    # the files of an Iceberg table, {key: size}. VACUUM in FakeAthena removes some
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        return {'Contents': [{'Key': key, 'Size': size} for key, size in sorted(self.objects.items()) if key.startswith(Prefix)], 'IsTruncated': False}
+
+
+class FakeGlue:
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def get_table(self, DatabaseName, Name):
+        if Name not in self.tables:
+            raise ClientError({'Error': {'Code': 'EntityNotFoundException'}}, 'GetTable')
+
+        return {'Table': {'Name': Name}}
+
+
+class FakeAthena:
+    # OPTIMIZE asks to be run again more_runs times, VACUUM leaves the table's live files
+
+    def __init__(self, s3_client, live_files, more_runs=0):
+        self.s3_client = s3_client
+        self.live_files = set(live_files)
+        self.more_runs = more_runs
+        self.statements = []
+
+    def start_query_execution(self, sql, database, wait=False):
+        self.statements.append(sql)
+        if sql.startswith('OPTIMIZE') and self.more_runs:
+            self.more_runs -= 1
+            raise Exception('ICEBERG_OPTIMIZE_MORE_RUNS_NEEDED: Optimize needs more runs to complete')
+        if sql.startswith('VACUUM'):
+            self.s3_client.objects = dict((key, size) for key, size in self.s3_client.objects.items() if key in self.live_files or not key.startswith('ou_groups/'))
+
+
+OU_GROUPS_FILES = {
+    'ou_groups/data/00001.parquet': 100,
+    'ou_groups/data/00002.parquet': 100,
+    'ou_groups/data/00003.parquet': 300,
+    'ou_groups/metadata/00001.metadata.json': 10,
+    'ou_groups/metadata/00002.metadata.json': 10,
+    'ou_groups/metadata/snap-1.avro': 5,
+    'ou_groups/temp/upload.csv': 1,
+    'tags_groups/data/00001.parquet': 100,
+}
+
+
+@pytest.fixture
+def athena(monkeypatch):
+    def install(s3_client, live_files, more_runs=0):
+        athena = FakeAthena(s3_client, live_files, more_runs)
+        monkeypatch.setitem(sys.modules, 'awswrangler', types.SimpleNamespace(athena=athena))
+        return athena
+
+    return install
+
+
+def test_maintain_table_compacts_and_reports_the_files(athena):
+    s3_client = FakeS3(OU_GROUPS_FILES)
+    wrangler = athena(s3_client, ['ou_groups/data/00003.parquet', 'ou_groups/metadata/00002.metadata.json'])
+
+    result = maintain_table(s3_client, FakeGlue(['ou_groups']), DATABASE, 'ou_groups', BUCKET)
+
+    assert wrangler.statements == [
+        "ALTER TABLE ou_groups SET TBLPROPERTIES ('vacuum_max_snapshot_age_seconds'='"+str(int(table_maintenance.SNAPSHOT_RETENTION_HOURS*3600))+"')",
+        'OPTIMIZE ou_groups REWRITE DATA USING BIN_PACK',
+        'VACUUM ou_groups',
+    ]
+    assert result['before'] == {'files': 7, 'bytes': 526, 'data_files': 3, 'data_bytes': 500, 'metadata_files': 3, 'metadata_bytes': 25}
+    assert result['after'] == {'files': 2, 'bytes': 310, 'data_files': 1, 'data_bytes': 300, 'metadata_files': 1, 'metadata_bytes': 10}
+    assert 'tags_groups/data/00001.parquet' in s3_client.objects
+
+
+def test_maintain_table_runs_optimize_again_when_asked(athena):
+    s3_client = FakeS3(OU_GROUPS_FILES)
+    wrangler = athena(s3_client, [], more_runs=2)
+
+    maintain_table(s3_client, FakeGlue(['ou_groups']), DATABASE, 'ou_groups', BUCKET)
+
+    assert [sql.split()[0] for sql in wrangler.statements] == ['ALTER', 'OPTIMIZE', 'OPTIMIZE', 'OPTIMIZE', 'VACUUM']
+
+
+def test_maintain_table_gives_up_on_optimize(athena):
+    s3_client = FakeS3(OU_GROUPS_FILES)
+    wrangler = athena(s3_client, [], more_runs=MAX_OPTIMIZE_RUNS)
+
+    with pytest.raises(Exception, match='ICEBERG_OPTIMIZE_MORE_RUNS_NEEDED'):
+        maintain_table(s3_client, FakeGlue(['ou_groups']), DATABASE, 'ou_groups', BUCKET)
+
+    # nothing is vacuumed while the data files are still being rewritten
+    assert 'VACUUM ou_groups' not in wrangler.statements
+    assert s3_client.objects == OU_GROUPS_FILES
+
+
+def test_maintain_table_skips_a_missing_table(athena):
+    s3_client = FakeS3(OU_GROUPS_FILES)
+    wrangler = athena(s3_client, [])
+
+    assert maintain_table(s3_client, FakeGlue([]), DATABASE, 'ou_groups', BUCKET) is None
+    assert wrangler.statements == []